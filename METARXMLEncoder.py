@@ -13,6 +13,9 @@
 import difflib, os, re, sys, tempfile, time, uuid
 import xml.etree.ElementTree as ET
 import xmlpp
+import station_registry
+import station_table
+import metar_util
 #
 NameSpaces = { 'gco':'http://www.isotc211.org/2005/gco',
                'gmd':'http://www.isotc211.org/2005/gmd',
@@ -130,45 +133,22 @@ def getGeography(file):
         
     return d
 
-def fix_date(tms):
-    """Tries to determine month and year from report timestamp.
-    tms contains day, hour, min of the report, current year and month"""
-    
-    now = time.time()
-    t = time.mktime(tms)    
-    if t > now + 86400.0:       # previous month
-        if tms[1] > 1:
-            tms[1] -= 1
-        else:
-            tms[1] = 12
-            tms[0] -= 1
-    elif t < now - 25*86400.0:  # next month
-        if tms[1] < 12:
-            tms[1] += 1
-        else:
-            tms[1] = 1
-            tms[0] += 1
-
-def _getAllMatches(re,inputstr):
-
-    curpos = 0
-    matches = []
-    while len(inputstr[curpos:]):
-        try:
-            m = re.search(inputstr[curpos:])
-            matches.append(m.groupdict())
-            curpos += m.end()
-        except AttributeError:
-            break
-            
-    return matches
-    
 class XMLEncoder:
     
-    def __init__(self,wwCodesFile='../data/ww.xml',metarStationInfoFile='../data/metarStationInfo.txt'):
+    def __init__(self,wwCodesFile='../data/ww.xml',metarStationInfoFile='../data/metarStationInfo.txt',stationRegistry=None):
         #
-        # Populate METAR metadata dictionary
-        self.metarMetaData = getGeography(metarStationInfoFile)
+        # METAR metadata, served by the station registry shared within the
+        # process. It follows changes to the station information file.
+        # A compiled station table (see station_table.py) is used only when
+        # it is given as the station information file. It is mapped in place
+        # and shared by all the processes using it, at the cost of slower
+        # lookups than the registry's dict.
+        if stationRegistry is None and station_table.is_table(metarStationInfoFile):
+            self.metarMetaData = station_table.StationTable(metarStationInfoFile)
+        else:
+            if stationRegistry is None:
+                stationRegistry = station_registry.get_registry(stationInfoFile=metarStationInfoFile,usStationsFile=None)
+            self.metarMetaData = stationRegistry.geographyView()
         #
         # Populate the dictionary with precipitation/obstruction and other phenomenon
         root,wwCodeSpaces = parseAndGetNameSpaces(wwCodesFile)
@@ -203,11 +183,19 @@ class XMLEncoder:
         setattr(self,'minT6h', self.minTemperature)
         setattr(self,'minT24h',self.minTemperature)
         
-    def __call__(self,decodedMetar,report=None,allowUSExtensions=False,nameSpaceDeclarations=False,debugComment=False):
+    def __call__(self,decodedMetar,report=None,allowUSExtensions=False,nameSpaceDeclarations=False,debugComment=False,
+                 reference=None):
         #
-        # decodedMetar is a dictionary
+        # decodedMetar is a dictionary. reference is the metar_util.ReferenceTime
+        # it was decoded against, the time it is encoded if not given.
         if decodedMetar.has_key('fatal'):
-            print 'Fatal error at %s %s in report.' % (decodedMetar['index'],decodedMetar['fatal'])
+            #
+            # Decoded groups give their 'index' lazily, a report has none
+            fatal = decodedMetar['fatal']
+            index = decodedMetar.get('index')
+            if index is None and hasattr(fatal, 'get'):
+                index = fatal.get('index')
+            print 'Fatal error at %s %s in report.' % (index,fatal)
             return
         #
         # see if we have the metadata for the observation
@@ -216,6 +204,7 @@ class XMLEncoder:
         #
         self.rawReport = report.strip()
         self.decodedMetar = decodedMetar
+        self.reference = reference
         self.nameSpacesDeclared = nameSpaceDeclarations
         self.debugComment = debugComment
         self.defaultNSPrefix = 'iwxxm'
@@ -1144,25 +1133,28 @@ class XMLEncoder:
         
         inputstr = token['str']
         issueTime = time.gmtime(self.decodedMetar['itime']['value'])
+        reference = self.reference
+        if reference is None:
+            reference = metar_util.ReferenceTime()
         pcphistory = {}
             
-        for match in _getAllMatches(_re_pcpnhist,inputstr):
+        for match in metar_util.iter_matches(_re_pcpnhist,inputstr):
             
-            ww = match.get('PCP')
-            timeHistory = match.get('TIME')
+            ww = match.group('PCP')
             events = []
-            
-            for event in _getAllMatches(_re_event,timeHistory):
+            #
+            # The events are found within the time history, in place
+            for event in metar_util.iter_matches(_re_event,inputstr,match.start('TIME'),match.end('TIME')):
                 
                 issueTimeList = list(issueTime)
-                e = event.get('EVENT')
-                hhmm = event.get('TIME')
+                e = event.group('EVENT')
+                hhmm = event.group('TIME')
                 
                 if len(hhmm) == 2:
                     issueTimeList[4] = int(hhmm)
                 elif len(hhmm) == 4:
                     issueTimeList[3:5] = int(hhmm[:2]),int(hhmm[2:])
-                    fix_date(issueTimeList)
+                    reference.fix_date(issueTimeList)
                 else:
                     continue
                 
@@ -1493,8 +1485,9 @@ if __name__ == '__main__':
     allobs.pop()
     #
     # Convert TAC to python dictionary
-    for report in allobs:
-        result = decoder(report)
+    for report, result, fault in decoder.decode_many([(r, r) for r in allobs]):
+        if fault is not None:
+            print 'Decoder fault: %s; METAR: %s' % (str(fault), report)
         #
         # Pass results to encoder. The first argument, the python dictionary,
         # is required. The other two show the optional named arguments and
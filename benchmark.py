@@ -0,0 +1,650 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+Microbenchmarks for the METAR decoding pipeline.
+
+   ./benchmark.py [options] benchmark [raw feed file]
+
+Without a feed file a small built-in bulletin is used.
+'''
+import optparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import bulletin_util
+
+SAMPLE_BULLETIN = ('\x01\r\r\n123 \r\r\nSAUS70 KWBC 121200\r\r\nMTRDEN\r\r\n'
+                   'METAR KDEN 121153Z 36010KT 10SM FEW080 SCT150 BKN250 21/M03 A3012 RMK AO2 SLP153\r\r\n'
+                   '     T02061033 10217 20128 53006=\r\r\n'
+                   'KBOU 121153Z AUTO 02007KT 10SM CLR 19/M02 A3015 RMK AO2=\r\r\n'
+                   'KCOS 121154Z 17012G21KT 1 1/2SM -TSRA BR BKN045CB OVC080 18/13 A3011 RMK AO2 PK WND 19032/1120\r\r\n'
+                   '     WSHFT 1115 LTG DSNT NW-N AND E TSB20RAB25 SLP164 P0002 60012 T01830128=\r\r\n'
+                   '\x03')
+
+#Reports with long remarks sections
+REMARK_REPORTS = [
+    'METAR\nKCOS 121154Z 17012G21KT 1 1/2SM -TSRA BR BKN045CB OVC080 18/13 A3011 RMK AO2 PK WND 19032/1120 '
+    'WSHFT 1115 LTG DSNT NW-N AND E TSB20RAB25 PRESRR SLP164 P0002 60012 T01830128 10206 20178 53012=',
+    'METAR\nKDEN 121153Z 36010KT 2SM BR FEW080 21/M03 A3012 RMK AO2 SFC VIS 1/4 VIS 1/2V3 CIG 005V010 '
+    'BKN014 V OVC SLP153 P0000 60000 70012 4/005 933012 98012 T02061033 10217 20128 401001015 53006 PWINO TSNO $=',
+    'SPECI\nKBOU 121210Z AUTO 02007KT 10SM CLR 19/M02 A3015 RMK AO2 VIS NE 2 1/2 GR 1 3/4 SNINCR 2/10 '
+    'FRQ LTGICCG OHD AND DSNT SE TS OHD MOV E RAE15SNB15 I1012 PRESFR RVRNO WIND ESTIMATED=',
+]
+
+def load_bulletins(path=None):
+    """Returns the bulletins in a raw feed file, or the built-in sample"""
+
+    if path is None:
+        return [SAMPLE_BULLETIN]
+    return list(bulletin_util.iter_file_bulletins(path))
+
+def timed(func, number, repeat=3):
+    """Returns the best time, in seconds, of calling func number times"""
+
+    best = None
+    for i in range(repeat):
+        t0 = time.time()
+        for n in xrange(number):
+            func()
+        t = time.time() - t0
+        if best is None or t < best:
+            best = t
+    return best
+
+def report(label, seconds, count, unit='bulletin'):
+    print '%-32s %10.3f s %12.2f us/%s' % (label, seconds, seconds*1e6/count, unit)
+
+##############################################################################
+# WMO heading and report type
+def bench_header(bulletins, number):
+    """Regular expressions + str.replace vs. bulletin_util.parse_header()"""
+
+    import parse_metar_us as pmu
+
+    def regex_path():
+        for text in bulletins:
+            m = pmu.wmo_hdr.match(text)
+            if m:
+                text = text.replace(m.group(0),'',1)
+            m = pmu.metar_type.match(text)
+            if m:
+                text = text.replace(m.group(0),'',1)
+
+    def offset_path():
+        for text in bulletins:
+            header = bulletin_util.parse_header(text)
+            text = text[header[5]:]
+
+    for text in bulletins:
+        m = pmu.wmo_hdr.match(text)
+        rest = text[m.end():] if m else text
+        t = pmu.metar_type.match(rest)
+        body = len(text) - len(rest) + (t.end() if t else 0)
+        header = bulletin_util.parse_header(text)
+        if header[4] is not None and header[5] != body:
+            print 'MISMATCH at body offset %d vs %d: %r' % (header[5], body, text[:80])
+
+    count = number * len(bulletins)
+    report('regex + replace', timed(regex_path, number), count)
+    report('parse_header', timed(offset_path, number), count)
+
+##############################################################################
+# Report normalization
+def _old_normalize(stext):
+    """The chained str.replace normalization parse_metar_us.py used to do"""
+
+    stext = stext.strip()
+    stext = stext.replace( '.', '' )\
+        .replace( '\x03','')\
+        .replace( ' \r\n ', ' ' )\
+        .replace( '\r\n ', ' ' )\
+        .replace( ' \r\n', ' ' )\
+        .replace( '\r\n', ' ' )\
+        .replace( '\r', ' ' )\
+        .replace( '\n', ' ' )\
+        .replace( '     ', ' ' )\
+        .replace( '    ', ' ' )\
+        .replace( '   ', ' ' )\
+        .replace( '  ', ' ' )
+    if re.sub(r'[\s]+', '', stext) == '':
+        return ''
+    return stext
+
+def split_reports(bulletins):
+    """Returns the raw, unnormalized, reports in the bulletins"""
+
+    reports = []
+    for text in bulletins:
+        header = bulletin_util.parse_header(text)
+        reports.extend(re.split('=\s*', text[header[5]:]))
+    return reports
+
+def bench_normalize(bulletins, number):
+    """Chained str.replace vs. bulletin_util.normalize_report()"""
+
+    reports = split_reports(bulletins)
+
+    def old_path():
+        for text in reports:
+            _old_normalize(text)
+
+    def new_path():
+        for text in reports:
+            bulletin_util.normalize_report(text)
+
+    differ = 0
+    for text in reports:
+        old, new = _old_normalize(text), bulletin_util.normalize_report(text)
+        if old != new:
+            differ += 1
+            if ' '.join(old.split()) != new:
+                print 'MISMATCH: %r vs %r' % (old, new)
+    print '%d reports, %d differ only by collapsed whitespace' % (len(reports), differ)
+
+    count = number * len(reports)
+    t = timed(old_path, number)
+    report('str.replace chain', t, count, 'report')
+    print '%-32s %10.1f reports/s' % ('', count/t)
+    t = timed(new_path, number)
+    report('normalize_report', t, count, 'report')
+    print '%-32s %10.1f reports/s' % ('', count/t)
+
+##############################################################################
+# Station metadata
+def _write_station_info(filename, count):
+    """Writes a synthetic metarStationInfo.txt of count stations"""
+
+    with open(filename, 'w') as f:
+        f.write('#uuid|icao|lat|lon|elev|name|country|type\n')
+        for i in xrange(count):
+            icao = 'K%03d' % i if i < 1000 else '%c%c%c%c' % tuple(65 + (i // 26**n) % 26 for n in range(4))
+            f.write('%08d-0000-0000-0000-000000000000|%s|%.2f|%.2f|%.2f|STATION %d|US|MTR\n' %
+                    (i, icao, 30 + i % 20, -120 + i % 50, i % 3000, i))
+
+def _geography_size(geography):
+    """Bytes the getGeography() dict takes in each process that loads it"""
+
+    size = sys.getsizeof(geography)
+    for icao, value in geography.iteritems():
+        size += sys.getsizeof(icao) + sys.getsizeof(value)
+        size += sum([sys.getsizeof(text) for text in value])
+    return size
+
+def bench_stations(bulletins, number):
+    """METARXMLEncoder.getGeography() dict vs. a mapped station_table"""
+
+    import METARXMLEncoder as MXE
+    import station_table
+
+    tmpdir = tempfile.mkdtemp()
+    textfile = os.path.join(tmpdir, 'metarStationInfo.txt')
+    tablefile = os.path.join(tmpdir, 'metarStationInfo.bin')
+    try:
+        _write_station_info(textfile, 10000)
+        station_table.main(['-o', tablefile, textfile])
+        geography = MXE.getGeography(textfile)
+        table = station_table.StationTable(tablefile)
+        for icao in geography:
+            if table[icao] != geography[icao]:
+                print 'MISMATCH for %s: %r vs %r' % (icao, table[icao], geography[icao])
+        print '%d stations, text %d bytes, table %d bytes' % (len(geography),
+              os.path.getsize(textfile), os.path.getsize(tablefile))
+        print 'dict %d bytes in every process, table %d bytes shared by all' % (
+              _geography_size(geography), os.path.getsize(tablefile))
+
+        loads = max(number // 100, 1)
+        report('getGeography() load', timed(lambda: MXE.getGeography(textfile), loads), loads, 'load')
+        report('StationTable() open', timed(lambda: station_table.StationTable(tablefile).close(), loads), loads, 'load')
+
+        icaos = sorted(geography)[::10] + ['EGLL', 'ZZZZ']
+        def dict_lookup():
+            for icao in icaos:
+                geography.get(icao)
+        def table_lookup():
+            for icao in icaos:
+                table.get(icao)
+        count = number * len(icaos)
+        report('dict lookup', timed(dict_lookup, number), count, 'lookup')
+        report('table lookup', timed(table_lookup, number), count, 'lookup')
+        table.close()
+    finally:
+        for name in os.listdir(tmpdir):
+            os.unlink(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+
+##############################################################################
+# Decoder
+def decode_reports(bulletins):
+    """Returns the reports in the bulletins as parse_metar_us.py hands them
+       to the decoder, whatever their station
+    """
+    reports = []
+    for text in bulletins:
+        metartype, body = bulletin_util.parse_header(text)[4:]
+        if metartype is None:
+            continue
+        for raw in re.split('=\s*', text[body:]):
+            stext = bulletin_util.normalize_report(raw)
+            if not stext:
+                continue
+            if stext[0:5] != metartype:
+                stext = "%s\n%s=" % (metartype, stext)
+            reports.append(stext)
+    return reports
+
+def bench_decoder(bulletins, number):
+    """usMetarDecoder.VerboseDecoder vs. the production Decoder"""
+
+    import usMetarDecoder
+
+    reports = decode_reports(bulletins)
+    decoder = usMetarDecoder.Decoder()
+    verbose = usMetarDecoder.VerboseDecoder()
+    #
+    # The trace is thrown away, as it is not what is being compared
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        mismatches = [r for r in reports if verbose(r) != decoder(r)]
+
+        def verbose_path():
+            for r in reports:
+                verbose(r)
+
+        def fast_path():
+            for r in reports:
+                decoder(r)
+
+        count = number * len(reports)
+        tverbose = timed(verbose_path, number)
+        tfast = timed(fast_path, number)
+    finally:
+        sys.stdout = stdout
+
+    for r in mismatches:
+        print 'MISMATCH: %r' % r
+    print '%d reports, %d decoded differently' % (len(reports), len(mismatches))
+    report('VerboseDecoder', tverbose, count, 'report')
+    print '%-32s %10.1f reports/s' % ('', count/tverbose)
+    report('Decoder', tfast, count, 'report')
+    print '%-32s %10.1f reports/s' % ('', count/tfast)
+
+##############################################################################
+# Decoder start up
+def _import_time(cachedir, number):
+    """Best time of number fresh interpreters importing usMetarDecoder and
+       creating a Decoder
+    """
+    env = dict(os.environ, METAR_GRAMMAR_CACHE=cachedir)
+    cmd = [sys.executable, '-c', 'import usMetarDecoder; usMetarDecoder.Decoder()']
+    here = os.path.dirname(os.path.abspath(__file__))
+    return timed(lambda: subprocess.check_call(cmd, env=env, cwd=here), 1, number)
+
+def bench_import(bulletins, number):
+    """usMetarDecoder import time, compiling the grammar vs. loading it from the cache"""
+
+    number = min(number, 20)
+    cachedir = tempfile.mkdtemp()
+    try:
+        report('grammar compiled', _import_time('', number), 1, 'import')
+        _import_time(cachedir, 1)
+        report('grammar from cache', _import_time(cachedir, number), 1, 'import')
+    finally:
+        shutil.rmtree(cachedir)
+
+##############################################################################
+# Decoder fast path
+def bench_fastpath(bulletins, number):
+    """tpg alone vs. the Decoder fast path, with the fast path hit rate"""
+
+    import usMetarDecoder
+
+    reports = decode_reports(bulletins)
+    fast = usMetarDecoder.Decoder()
+    slow = usMetarDecoder.Decoder()
+    slow.fastpath = False
+
+    mismatches = [r for r in reports if fast(r) != slow(r)]
+    for r in mismatches:
+        print 'MISMATCH: %r' % r
+    print '%d reports, %d decoded differently' % (len(reports), len(mismatches))
+    print 'fast path hit rate %.1f%% (%d handed to tpg)' % (100.0*fast.fastpathRate(), fast.fastpathFallbacks)
+
+    def slow_path():
+        for r in reports:
+            slow(r)
+
+    def fast_path():
+        for r in reports:
+            fast(r)
+
+    count = number * len(reports)
+    t = timed(slow_path, number)
+    report('tpg', t, count, 'report')
+    print '%-32s %10.1f reports/s' % ('', count/t)
+    t = timed(fast_path, number)
+    report('fast path', t, count, 'report')
+    print '%-32s %10.1f reports/s' % ('', count/t)
+
+##############################################################################
+# Decoder callbacks
+def _callback_times(decoder, reports, number):
+    """Decodes the reports number times, returning {callback: [calls, seconds]}"""
+
+    import usMetarDecoder
+
+    names = set(['obtype', 'ident', 'itime', 'autocor'])
+    for alternatives, repeat in usMetarDecoder._MandatoryGroups:
+        names.update([callback for token, callback in alternatives])
+    names.update([callback for token, callback in usMetarDecoder._RemarkAlternatives])
+    names.discard(None)
+
+    times = {}
+    for name in names:
+        times[name] = [0, 0.0]
+        setattr(decoder, name, _timer(getattr(decoder, name), times[name]))
+
+    for n in xrange(number):
+        for r in reports:
+            decoder(r)
+    return times
+
+def _timer(method, entry):
+    """Wraps method to add its calls and run time to entry"""
+
+    def timed_method(*args):
+        t0 = time.time()
+        try:
+            return method(*args)
+        finally:
+            entry[0] += 1
+            entry[1] += time.time() - t0
+    return timed_method
+
+def bench_callbacks(bulletins, number):
+    """Time spent in each Decoder callback, matching the token again vs. using the lexer's match"""
+
+    import usMetarDecoder
+
+    class RematchDecoder(usMetarDecoder.Decoder):
+        #
+        # The callbacks as they were, searching the token text again
+        def tokenMatch(self, s):
+            return self.tokenRegex().search(s)
+
+    reports = decode_reports(bulletins)
+    mismatches = [r for r in reports if RematchDecoder()(r) != usMetarDecoder.Decoder()(r)]
+    for r in mismatches:
+        print 'MISMATCH: %r' % r
+    print '%d reports, %d decoded differently' % (len(reports), len(mismatches))
+
+    before = _callback_times(RematchDecoder(), reports, number)
+    after = _callback_times(usMetarDecoder.Decoder(), reports, number)
+    print '%-20s %10s %12s %12s' % ('callback', 'calls', 'rematch', 'lexer match')
+    for name in sorted(before):
+        calls, t = before[name]
+        if calls == 0:
+            continue
+        print '%-20s %10d %9.2f us %9.2f us' % (name, calls, t*1e6/calls, after[name][1]*1e6/calls)
+
+##############################################################################
+# Report issue time
+def bench_reftime(bulletins, number):
+    """Clock, time.gmtime() and time.mktime() per report vs. metar_util.ReferenceTime"""
+
+    import metar_util
+
+    times = []
+    for r in decode_reports(bulletins):
+        m = re.search(r'\s(\d{2})(\d{2})(\d{2})Z\s', r)
+        if m:
+            times.append(tuple(map(int, m.groups())))
+
+    def per_report():
+        for mday, hour, minute in times:
+            now = time.time()
+            tms = list(time.gmtime(now))
+            tms[2:6] = mday, hour, minute, 0
+            metar_util.fix_date(tms, now)
+            if metar_util.valid_day(tms):
+                time.mktime(tms)
+
+    def reference():
+        ref = metar_util.ReferenceTime()
+        for mday, hour, minute in times:
+            ref.resolve(mday, hour, minute)
+
+    count = number * len(times)
+    report('per report', timed(per_report, number), count, 'report')
+    report('ReferenceTime', timed(reference, number), count, 'report')
+
+##############################################################################
+# Decoded report memory
+def _deep_size(obj, seen):
+    """Bytes taken by obj and everything it refers to not already in seen"""
+
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += _deep_size(key, seen) + _deep_size(value, seen)
+    elif isinstance(obj, (tuple, list)):
+        for item in obj:
+            size += _deep_size(item, seen)
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if hasattr(obj, name):
+                size += _deep_size(getattr(obj, name), seen)
+    return size
+
+def bench_memory(bulletins, number):
+    """Memory per 100k decoded reports, dictionaries vs. compact_report records"""
+
+    import usMetarDecoder
+
+    reports = decode_reports(bulletins) * number
+    decoder = usMetarDecoder.Decoder()
+    for compact, label in ((False, 'dictionaries'), (True, 'compact records')):
+        t0 = time.time()
+        results = [result for context, result, fault in decoder.decode_many(reports, compact=compact)]
+        t = time.time() - t0
+        size = _deep_size(results, set()) - sys.getsizeof(results)
+        print '%-32s %10.1f MB/100k reports %8.2f us/report' % (label, size*100000.0/len(results)/2**20,
+                                                                  t*1e6/len(results))
+
+##############################################################################
+# Remarks
+def bench_remarks(bulletins, number):
+    """Remarks tried in turn vs. dispatched on their first character, on RMK-heavy reports"""
+
+    import usMetarDecoder
+
+    reports = [r for r in decode_reports(bulletins) if ' RMK ' in r] + REMARK_REPORTS
+    dispatched = usMetarDecoder.Decoder()
+    inturn = usMetarDecoder.Decoder()
+    inturn.dispatchRemarks = False
+
+    mismatches = [r for r in reports if dispatched(r) != inturn(r)]
+    for r in mismatches:
+        print 'MISMATCH: %r' % r
+    print '%d reports, %d decoded differently' % (len(reports), len(mismatches))
+
+    count = number * len(reports)
+    t = timed(lambda: map(inturn, reports), number)
+    report('remarks in turn', t, count, 'report')
+    t = timed(lambda: map(dispatched, reports), number)
+    report('remarks dispatched', t, count, 'report')
+
+LOCATION_STRINGS = ['DSNT NW-N AND E', 'VC NE', 'OHD AND DSNT SE', 'E', 'DSNT N-NE-E AND SW', 'VC S-SW-W',
+                    'NE-E-S', 'DSNT W', 'SW AND NW-N-NE', 'OHD']
+
+def bench_locations(bulletins, number):
+    """Lightning and thunderstorm location strings parsed every time vs. cached"""
+
+    import usMetarDecoder
+
+    def parse():
+        for s in LOCATION_STRINGS:
+            usMetarDecoder.processLocationString(s, {})
+
+    size = usMetarDecoder.LOCATION_CACHE_SIZE
+    count = 100 * number * len(LOCATION_STRINGS)
+    try:
+        usMetarDecoder.LOCATION_CACHE_SIZE = 0
+        usMetarDecoder._locationCache.clear()
+        t = timed(parse, 100 * number)
+        report('locations parsed', t, count, 'string')
+    finally:
+        usMetarDecoder.LOCATION_CACHE_SIZE = size
+    t = timed(parse, 100 * number)
+    report('locations cached', t, count, 'string')
+
+#Precipitation history remarks, the pcpnhist groups of a report merged
+PCPNHIST_REMARKS = [
+    'RAB05E20B35E50SNB1012E1030B1045E1100',
+    'TSB0101E0120B0135E0150RAB0102E0118B0136E0155SHRAB0159E0210B0222E0238',
+    'FZDZB12E25FZRAB25E40B48E55PLB1240E1255B1301E1315SNB1320E1335B1340',
+    'SHSNB0005E0012B0019E0027B0033E0041B0048E0055SHRAB0101E0109B0115E0123B0130E0139B0146E0152',
+]
+
+def _old_getAllMatches(regex, inputstr):
+    """The search over the rest of the text METARXMLEncoder used to do"""
+
+    curpos = 0
+    matches = []
+    while len(inputstr[curpos:]):
+        try:
+            m = regex.search(inputstr[curpos:])
+            matches.append(m.groupdict())
+            curpos += m.end()
+        except AttributeError:
+            break
+    return matches
+
+def bench_pcpnhist(bulletins, number):
+    """Precipitation history events found searching the rest of the text vs. in place"""
+
+    import METARXMLEncoder
+    import metar_util
+
+    history, event = METARXMLEncoder._re_pcpnhist, METARXMLEncoder._re_event
+
+    def old(text):
+        return [(m['PCP'], [(e['EVENT'], e['TIME']) for e in _old_getAllMatches(event, m['TIME'])])
+                for m in _old_getAllMatches(history, text)]
+
+    def new(text):
+        return [(m.group('PCP'), [(e.group('EVENT'), e.group('TIME'))
+                                  for e in metar_util.iter_matches(event, text, m.start('TIME'), m.end('TIME'))])
+                for m in metar_util.iter_matches(history, text)]
+
+    mismatches = [r for r in PCPNHIST_REMARKS if old(r) != new(r)]
+    for r in mismatches:
+        print 'MISMATCH: %r' % r
+    print '%d remarks, %d found differently' % (len(PCPNHIST_REMARKS), len(mismatches))
+
+    count = 10 * number * len(PCPNHIST_REMARKS)
+    t = timed(lambda: map(old, PCPNHIST_REMARKS), 10 * number)
+    report('pcpnhist rest of text', t, count, 'remark')
+    t = timed(lambda: map(new, PCPNHIST_REMARKS), 10 * number)
+    report('pcpnhist in place', t, count, 'remark')
+
+#Reports the decoder faults on
+FAULT_REPORTS = [
+    'METAR KDEN 121853Z 27010KT 10SM FEW050 22/M02 A3012 RMK AO2 VIS 3V1 SLP155=',
+    'SPECI KCOS 121910Z 17012G21KT 5SM BKN045 18/13 A3011 RMK AO2 VIS 2V1/2 P0002=',
+]
+
+def bench_faults(bulletins, number):
+    """Decoder faults each logged with their report vs. counted, one in 100 logged"""
+
+    import logging
+    import usMetarDecoder
+
+    decoder = usMetarDecoder.Decoder()
+    root = logging.getLogger()
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    root.addHandler(handler)
+    try:
+        count = number * len(FAULT_REPORTS)
+        for interval in (1, 100):
+            decoder.faultLogInterval = interval
+            t = timed(lambda: map(decoder, FAULT_REPORTS), number)
+            report('faults, 1 in %d logged' % interval, t, count, 'report')
+    finally:
+        root.removeHandler(handler)
+    for fault in decoder.faultSummary():
+        print '%d %s at token %s' % fault
+
+#Groups a consumer wanting only the basics asks for
+BASIC_FIELDS = ('ident', 'itime', 'wind', 'vsby', 'sky', 'alt')
+
+def bench_fields(bulletins, number):
+    """Full decode vs. decoding only the basic groups, the remarks skipped"""
+
+    import usMetarDecoder
+
+    reports = decode_reports(bulletins) + REMARK_REPORTS
+    decoder = usMetarDecoder.Decoder()
+
+    mismatches = []
+    for r in reports:
+        full, partial = decoder(r), decoder(r, fields=BASIC_FIELDS)
+        if [full.get(f) for f in BASIC_FIELDS] != [partial.get(f) for f in BASIC_FIELDS]:
+            mismatches.append(r)
+    for r in mismatches:
+        print 'MISMATCH: %r' % r
+    print '%d reports, %d decoded differently' % (len(reports), len(mismatches))
+
+    decoder.skippedReports = decoder.skippedChars = 0
+    list(decoder.decode_many(reports, fields=BASIC_FIELDS))
+    size = sum([len(r) for r in reports])
+    print '%d of %d reports partly skipped, %d of %d characters (%.1f%%)' % (
+        decoder.skippedReports, len(reports), decoder.skippedChars, size, 100.0*decoder.skippedChars/size)
+
+    count = number * len(reports)
+    t = timed(lambda: list(decoder.decode_many(reports)), number)
+    report('full decode', t, count, 'report')
+    t = timed(lambda: list(decoder.decode_many(reports, fields=BASIC_FIELDS)), number)
+    report('basic fields', t, count, 'report')
+
+BENCHMARKS = {
+    'header': bench_header,
+    'normalize': bench_normalize,
+    'stations': bench_stations,
+    'decoder': bench_decoder,
+    'import': bench_import,
+    'fastpath': bench_fastpath,
+    'callbacks': bench_callbacks,
+    'reftime': bench_reftime,
+    'memory': bench_memory,
+    'remarks': bench_remarks,
+    'locations': bench_locations,
+    'pcpnhist': bench_pcpnhist,
+    'faults': bench_faults,
+    'fields': bench_fields,
+}
+
+def main():
+    usage = ("Usage: %%prog [options] benchmark [raw feed file]\n\n"
+             "Benchmarks: %s" % ', '.join(sorted(BENCHMARKS)))
+    parseopts = optparse.OptionParser(usage=usage)
+    parseopts.add_option('-n', action='store', type='int', dest='number', default=1000,
+                         help='Number of passes over the bulletins')
+    opts, args = parseopts.parse_args()
+    if not args or args[0] not in BENCHMARKS:
+        parseopts.print_help()
+        sys.exit(2)
+
+    bulletins = load_bulletins(args[1] if len(args) > 1 else None)
+    BENCHMARKS[args[0]](bulletins, opts.number)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import os
+import re
+import mmap
+
+'''Utilities for framing the WMO bulletins found in a raw LDM feed. Each
+   bulletin starts with SOH (\x01) and ends with ETX (\x03).
+'''
+
+SOH = '\x01'
+ETX = '\x03'
+
+#Largest bulletin we are willing to buffer while waiting for its ETX
+MAX_BULLETIN_SIZE = 1024*1024
+
+class BulletinFramer(object):
+    """
+       Frames bulletins incrementally as data arrives from a stream.
+
+       Bulletins are delimited the same way as the regular expression
+       '\x01.*?\x03' does for a whole file: from a SOH up to the first ETX
+       following it. Anything outside a bulletin is discarded. A bulletin
+       that grows beyond maxsize without an ETX is dropped, so the amount
+       of data held is bounded no matter how long the stream runs.
+    """
+    def __init__(self, maxsize=MAX_BULLETIN_SIZE):
+        self.maxsize = maxsize
+        self.buf = ''
+        #Position in buf from which to continue looking for ETX
+        self.scanned = 0
+        #Number of bulletins dropped for lack of an ETX
+        self.dropped = 0
+
+    def feed(self, data):
+        """
+           Args:
+               data (string): The next block of bytes from the stream
+           Returns:
+               List of the bulletins completed by data, SOH and ETX included.
+        """
+        bulletins = []
+        buf = self.buf + data
+        while True:
+            start = buf.find(SOH)
+            if start < 0:
+                buf = ''
+                self.scanned = 0
+                break
+            if start > 0:
+                buf = buf[start:]
+                self.scanned = 0
+            end = buf.find(ETX, max(self.scanned, 1))
+            if end >= 0:
+                bulletins.append(buf[:end+1])
+                buf = buf[end+1:]
+                self.scanned = 0
+                continue
+            self.scanned = len(buf)
+            if len(buf) > self.maxsize:
+                #Give up on this bulletin and resynchronize on the next SOH
+                self.dropped += 1
+                buf = buf[1:]
+                self.scanned = 0
+                continue
+            break
+
+        self.buf = buf
+        return bulletins
+
+    def pending(self):
+        """
+           Returns: Number of bytes held waiting for the end of a bulletin.
+        """
+        return len(self.buf)
+
+def read_bulletins(fd, blocksize=4096, framer=None):
+    """
+       Generates bulletins from a file descriptor as soon as their ETX is
+       read. os.read() returns whatever is available, so a bulletin is not
+       held back waiting for a full block.
+
+       Args:
+           fd (int): File descriptor of the feed, e.g. stdin or a FIFO
+           blocksize (int): Maximum number of bytes read at a time
+           framer (BulletinFramer): Framer to use, a new one by default
+       Returns:
+           Generator of bulletins, ending when the feed reaches EOF.
+    """
+    if framer is None:
+        framer = BulletinFramer()
+    while True:
+        data = os.read(fd, blocksize)
+        if not data:
+            break
+        for text in framer.feed(data):
+            yield text
+
+def scan_bulletins(buf, start=0, end=None):
+    """
+       Generates the (start, end) offsets of the bulletins in buf, end
+       being one past the ETX. Works on anything with a find() method,
+       a string or an mmap, without copying it.
+    """
+    if end is None:
+        end = len(buf)
+    pos = start
+    while True:
+        soh = buf.find(SOH, pos, end)
+        if soh < 0:
+            break
+        etx = buf.find(ETX, soh+1, end)
+        if etx < 0:
+            break
+        yield soh, etx+1
+        pos = etx+1
+
+def iter_file_bulletins(path):
+    """
+       Generates the bulletins in a raw feed file, one slice at a time, from
+       a memory map of the file. Only the bulletin being processed is
+       copied into a string, however large the file is.
+
+       If the file has no bulletins its whole content is generated instead,
+       the same as parse_metar_us.py does for text read from STDIN.
+    """
+    with open(path, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size == 0:
+            yield ''
+            return
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        found = False
+        for start, end in scan_bulletins(mm):
+            found = True
+            yield mm[start:end]
+        if not found:
+            yield mm[:]
+    finally:
+        mm.close()
+
+#Characters removed from a report before it is decoded
+_REPORT_DELETE = '.' + ETX
+
+def normalize_report(text):
+    """
+       Returns the canonical text of a report as passed to the decoder:
+       periods and ETX removed and every run of whitespace, including the
+       CR/LF line breaks of the bulletin, collapsed to a single space with
+       none leading or trailing. An empty string means there is no report.
+    """
+    return ' '.join(text.translate(None, _REPORT_DELETE).split())
+
+#
+# Fixed-width pieces of the wmo_hdr and metar_type regular expressions in
+# parse_metar_us.py. They are applied at offsets into the buffer, so neither
+# the bulletin nor the text following the heading is ever copied.
+_wmo_group = re.compile(r"""
+ ([A-Z0-9]{6})\s
+ ([A-Z][A-Z0-9]{3})\s
+ ([0-3][0-9][0-2][0-9][0-5][0-9])\s
+ (((RR|CC|AA)[A-Z])|P[A-Z]{2})?
+\s*""", re.VERBOSE)
+
+_type_group = re.compile(r"""
+\s*(MTR[A-Z]{3}\s*)?
+(METAR|SPECI)\s*""", re.VERBOSE)
+
+def parse_header(buf, start=0, end=None):
+    """
+       Tokenizes the WMO abbreviated heading and the METAR/SPECI keyword
+       of a bulletin by offsets into buf, a string or an mmap. Nothing but
+       the returned groups is copied.
+
+       Gives the same result as the wmo_hdr and metar_type regular
+       expressions of parse_metar_us.py: the heading is the first
+       'TTAAii CCCC DDHHMM [BBB]' in the bulletin, optionally followed by
+       'MTRxxx' and the report type.
+
+       Args:
+           buf: Buffer holding the bulletin
+           start (int): Offset of the bulletin in buf
+           end (int): Offset one past the end of the bulletin
+       Returns:
+           (ttaaii, cccc, ddhhmm, bbb, type, body_offset) where the first
+           four are None if there is no heading, bbb is None if absent,
+           type is 'METAR', 'SPECI' or None, and body_offset is the offset
+           of the first report. If type is None, body_offset is just past
+           the heading.
+    """
+    if end is None:
+        end = len(buf)
+
+    ttaaii = cccc = ddhhmm = bbb = None
+    pos = start
+    m = _wmo_group.search(buf, start, end)
+    if m:
+        ttaaii, cccc, ddhhmm, bbb = m.group(1, 2, 3, 4)
+        pos = m.end()
+
+    m = _type_group.match(buf, pos, end)
+    if m:
+        return ttaaii, cccc, ddhhmm, bbb, m.group(2), m.end()
+
+    return ttaaii, cccc, ddhhmm, bbb, None, pos
@@ -0,0 +1,168 @@
+import metar_util
+
+'''Compact records of decoded reports, for holding many of them in memory.
+
+   The decoder returns a dictionary of groups, each a dictionary with the
+   text of its token, 'str', its offsets in the report, 'span', and what was
+   decoded from it. A CompactReport holds the same, with the groups as
+   CompactGroups: the keys of a group or a report are shared by all those
+   with the same keys, short strings such as station ids, units and codes
+   are interned, and the text of a token is kept as its offsets into the
+   report. Both are read as the dictionaries are, with [], get() and
+   has_key(), so METARXMLEncoder.XMLEncoder encodes either.
+'''
+
+#Longest string interned rather than kept as offsets into the report
+INTERN_SIZE = 8
+
+#Key tuples shared by the records, keyed by themselves
+_shapes = {}
+
+def _shape(keys):
+    keys = tuple(keys)
+    return _shapes.setdefault(keys, keys)
+
+def _intern(value):
+    if type(value) is str and len(value) <= INTERN_SIZE:
+        return intern(value)
+    return value
+
+class _Mapping(object):
+    """Read-only dictionary access to a compact record"""
+
+    __slots__ = ()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def has_key(self, key):
+        return key in self.keys()
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def todict(self):
+        """Returns the record as the decoder's dictionary"""
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, _Mapping):
+            other = other.todict()
+        return self.todict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+class CompactGroup(_Mapping):
+    """
+       A decoded group. Its 'str' is read from the report unless it differs
+       from the text at its 'span', as for groups merged from two tokens.
+       Its 'index' is worked out from its 'span' when asked for, as the
+       decoder's groups do.
+    """
+    __slots__ = ('_text', '_start', '_end', '_str', '_keys', '_values')
+
+    def __init__(self, group, text):
+        self._text = text
+        self._start = self._end = self._str = None
+        keys = []
+        values = []
+        for key, value in group.iteritems():
+            if key == 'span':
+                self._start, self._end = value
+            elif key != 'str':
+                keys.append(key)
+                values.append(_intern(value))
+        self._keys = _shape(keys)
+        self._values = tuple(values)
+
+        text = group['str']
+        if len(text) <= INTERN_SIZE:
+            self._str = intern(text)
+        elif self._start is None or self._text[self._start:self._end] != text:
+            self._str = text
+
+    def __getitem__(self, key):
+        if key == 'str':
+            if self._str is not None:
+                return self._str
+            return self._text[self._start:self._end]
+        if key == 'span' and self._start is not None:
+            return self._start, self._end
+        if key == 'index' and self._start is not None:
+            return metar_util.lineColumnIndex(metar_util.findLineStarts(self._text), (self._start, self._end))
+        try:
+            return self._values[self._keys.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def keys(self):
+        if self._start is None:
+            return ['str'] + list(self._keys)
+        return ['str', 'span'] + list(self._keys)
+
+    def has_key(self, key):
+        return key in self
+
+    def __contains__(self, key):
+        if key == 'index':
+            return self._start is not None
+        return key in self.keys()
+
+class CompactReport(_Mapping):
+    """A decoded report, its groups as CompactGroups"""
+
+    __slots__ = ('text', '_keys', '_groups')
+
+    def __init__(self, decoded, text):
+        self.text = text
+        keys = []
+        groups = []
+        for key, group in decoded.iteritems():
+            keys.append(key)
+            if isinstance(group, dict) and 'str' in group:
+                group = CompactGroup(group, text)
+            groups.append(group)
+        self._keys = _shape(keys)
+        self._groups = tuple(groups)
+
+    def __getitem__(self, key):
+        try:
+            return self._groups[self._keys.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def keys(self):
+        return list(self._keys)
+
+    def has_key(self, key):
+        return key in self._keys
+
+    def __contains__(self, key):
+        return key in self._keys
+
+def compact(decoded, text):
+    """
+        Args:
+            decoded (dict): What the decoder returned for a report
+            text (string): The report, as the decoder read it, which the
+                           'span' of the groups are offsets into
+        Returns:
+            The CompactReport of decoded
+    """
+    return CompactReport(decoded, text)
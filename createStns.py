@@ -2,48 +2,65 @@ import sys
 import re
 import uuid
 
+#Every station written to metar_stns.txt gets the same uuid
+STATION_UUID = '3c918d83-618a-450b-a5f3-3f509ea64531'
+
+def convert_line(line):
+    """
+        Args: line (string): A line of stations3.txt, comma delimited:
+                             icao_id,latitude,longitude,elevation,site_name,country
+        Returns: [icao_id, lat, lon, elev, site_name, country] with the
+                 coordinates formatted to two decimals, or None if the
+                 station has no icao id, no location or no country.
+    """
+    #split string based on the ',' delimiter
+    line_tokens = re.split(',',line)
+    icao_id = line_tokens[0]
+    if icao_id == '\N':
+       #Don't include station if it doesn't have an icao id
+       return None
+
+    latitude = line_tokens[1]
+    if latitude == '\N':
+        return None
+    else:
+        lat = "{:.2f}".format(float(latitude))
+
+    longitude = line_tokens[2]
+    if longitude == '\N':
+        return None
+    else:
+        lon = "{:.2f}".format(float(longitude))
+
+    elevation = line_tokens[3]
+    if elevation == '\N':
+        return None
+    else:
+        elev = "{:.2f}".format(float(elevation))
+
+    site_name = line_tokens[4]
+
+    country = line_tokens[5]
+    country_match = re.search(r'[A-Z]{2} ',country)
+    if country_match:
+        pass
+    else:
+        return None
+
+    return [icao_id, lat, lon, elev, site_name, country]
+
 
 if __name__ == "__main__":
     station_entry= []
     outfile = open("./metar_stns.txt", "w")
     with open ( "stations3.txt") as infile:
-        uuid = uuid.uuid1()
         for line in infile:
-            #split string based on the ',' delimiter
-            line_tokens = re.split(',',line) 
-            icao_id = line_tokens[0]
-            if icao_id == '\N':
-               #Don't include station if it doesn't have an icao id
-               continue
-
-            latitude = line_tokens[1]
-            if latitude == '\N':
-                continue  
-            else:
-                lat = "{:.2f}".format(float(latitude))
-
-            longitude = line_tokens[2]
-            if longitude == '\N':
-                continue
-            else:
-                lon = "{:.2f}".format(float(longitude))
-
-            elevation = line_tokens[3]
-            if elevation == '\N':
-                continue
-            else:            
-                elev = "{:.2f}".format(float(elevation))
-
-            site_name = line_tokens[4]
-
-            country = line_tokens[5]
-            country_match = re.search(r'[A-Z]{2} ',country)
-            if country_match:
-                pass 
-            else:
+            fields = convert_line(line)
+            if fields is None:
                 continue
+            icao_id, lat, lon, elev, site_name, country = fields
 
-            uuid = '3c918d83-618a-450b-a5f3-3f509ea64531'
+            uuid = STATION_UUID
             print ("%s |%s| %s| %s| %s| %s| %s")%(uuid,icao_id,lat,lon,elev,site_name,country) 
         
             station_entry = [uuid,'|', icao_id, '|', lat,'|', lon,'|', elev,'|', site_name,'|', country,'|MTR']
@@ -33,6 +33,7 @@ def gather_metrics(file):
     USIcao = re.compile(r'.*(?P<icao>(K[0-9A-Z]{3}|P[AH][0-9A-Z]{2}))_(metar|speci).xml', re.DOTALL)
     unknownStation = 'Unknown station'
     syntacticError = 'SyntacticError'
+    faultSummary = 'INFO:Decoder faults:'
     
     print( "Starting to parse "+file.name+" for metrics")
 
@@ -41,6 +42,8 @@ def gather_metrics(file):
     nFilesUS=0
     nUnknStn=0
     nSynError = 0
+    #SyntacticErrors counted by the decoder, when it logs only some of them
+    nSynErrorSummary = None
     metrics = {}
     
     line = file.readline()
@@ -57,10 +60,16 @@ def gather_metrics(file):
                 nFilesIntl+=1
         elif unknownStation in line:
             nUnknStn+=1
+        elif faultSummary in line:
+            count, error = line.split()[2:4]
+            if error == syntacticError:
+                nSynErrorSummary = (nSynErrorSummary or 0) + int(count)
         elif syntacticError in line:
             nSynError+=1 
             
         line = file.readline()
+    if nSynErrorSummary is not None:
+        nSynError = nSynErrorSummary
 
     nTotal = nFilesWritten+nUnknStn
     print( 'Wrote %d XML files' % (nFilesWritten) )
@@ -16,9 +16,13 @@ def gather_metrics(file):
     intl = 'INFO:Non-US Metar'
     unknownStation = 'Unknown station'
     syntacticError = 'SyntacticError'
+    faultSummary = 'INFO:Decoder faults:'
     startParse = 'Starting to parse'
     metarOrSpeci = 'DECODING'
     nilOb = 'Nil found'
+    duplicateOb = 'Duplicate report skipped'
+    supersededOb = 'Superseded report skipped'
+    correctionOb = 'Correction replaces'
 
     #print( "Starting to parse "+file.name+" for metrics")
     
@@ -28,21 +32,37 @@ def gather_metrics(file):
     nFilesUS=0
     nUnknStn=0
     nSynError = 0
+    #SyntacticErrors counted by the decoder, when it logs only some of them
+    nSynErrorSummary = None
     nParse = 0
     metrics = {}
     unk_stations = []
     nMetarSpeci = 0
     nNilFound = 0
+    nDuplicate = 0
+    nSuperseded = 0
+    nCorrection = 0
 
     line = file.readline()
 
     while line:
         line = line.strip()
-        if wroteFileMarker in line:
+        #Skipped and replacing reports name stations, never a new file
+        if duplicateOb in line:
+            nDuplicate+=1
+        elif supersededOb in line:
+            nSuperseded+=1
+        elif correctionOb in line:
+            nCorrection+=1
+        elif wroteFileMarker in line:
             nFilesWritten+=1
         elif unknownStation in line:
             nUnknStn+=1
             unk_stations.append(line)
+        elif faultSummary in line:
+            count, error = line.split()[2:4]
+            if error == syntacticError:
+                nSynErrorSummary = (nSynErrorSummary or 0) + int(count)
         elif syntacticError in line:
             nSynError+=1
         elif startParse in line:
@@ -57,6 +77,8 @@ def gather_metrics(file):
             nFilesIntl+=1
 
         line = file.readline()
+    if nSynErrorSummary is not None:
+        nSynError = nSynErrorSummary
     #Get unique unknown stations
     num_unique_unk_stations = get_unique_unknown_stns(unk_stations)
 
@@ -74,7 +96,7 @@ def gather_metrics(file):
     #print( ' %d total sytactic errors' % nSynError)
     
 
-    metrics= {'possibleNumFiles':nPossible,'numFilesWritten':nFilesWritten,'numIntl':nFilesIntl,'numUS':nFilesUS,'numUnknown':nUnknStn, 'numSynErr':nSynError, 'numUniqueUnkStns':num_unique_unk_stations, 'numParsed':nParse, 'numMetarSpeci':nMetarSpeci, 'numNil':nNilFound}
+    metrics= {'possibleNumFiles':nPossible,'numFilesWritten':nFilesWritten,'numIntl':nFilesIntl,'numUS':nFilesUS,'numUnknown':nUnknStn, 'numSynErr':nSynError, 'numUniqueUnkStns':num_unique_unk_stations, 'numParsed':nParse, 'numMetarSpeci':nMetarSpeci, 'numNil':nNilFound, 'numDuplicate':nDuplicate, 'numSuperseded':nSuperseded, 'numCorrection':nCorrection}
     return metrics
     file.close()
     
@@ -96,6 +118,9 @@ def get_report_counts(datafile_dir, logfilename, outputfile_dir):
         numSynErr = metrics['numSynErr']
         numUniqueUnkStns = metrics['numUniqueUnkStns']
         numNil = metrics['numNil']
+        numDuplicate = metrics['numDuplicate']
+        numSuperseded = metrics['numSuperseded']
+        numCorrection = metrics['numCorrection']
     #
     #Obtain metrics from the raw data files
     #
@@ -146,6 +171,9 @@ def get_report_counts(datafile_dir, logfilename, outputfile_dir):
     print ("{:5d} Expected observations in raw data ".format(num_obs)) 
     print ("{:5d} METAR or SPECI reports/obs encountered during decoding".format(numMetarOrSpeciObs))
     print ("{:5d} NIL reports encountered in parse_metar_us.py".format(numNil))
+    print ("{:5d} Duplicate reports skipped by parse_metar_us.py".format(numDuplicate))
+    print ("{:5d} Reports superseded by a correction, skipped by parse_metar_us.py".format(numSuperseded))
+    print ("{:5d} Corrections replacing an XML file already written".format(numCorrection))
     print ("{:5d} Intl observations (or no matching icao identifier found) ".format(numIntl))
     print ("{:5d} US observations".format(numUS)) 
     print ("{:5d} 'Unknown station' error raised by usMetarDecoder.py".format(numUnk))
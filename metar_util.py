@@ -0,0 +1,158 @@
+import re
+import time
+import bisect
+import calendar
+
+'''Utilities shared by the METAR decoder and the XML encoder.
+
+   Reports only give the day of the month, hour and minute they were issued.
+   The month and year are taken from a reference time, the time the reports
+   are decoded by default. A bulletin is better decoded against the time in
+   its WMO heading, and an archive against the time it was collected, so that
+   reprocessing it gives the same result whatever the wall clock says.
+'''
+
+def valid_day(tms):
+    """Checks if day of month is valid"""
+    year, month, day = tms[:3]
+    if day > 31:
+        return 0
+    if month in [4, 6, 9, 11] and day > 30:
+        return 0
+    if month == 2 and (day > 29 or day > 28 and year%4 != 0):
+        return 0
+    return 1
+
+def fix_date(tms, now=None):
+    """Tries to determine month and year from report timestamp.
+    tms contains day, hour, min of the report, current year and month.
+    now is the time the report is taken to be recent to, the wall clock
+    by default."""
+
+    if now is None:
+        now = time.time()
+    t = time.mktime(tms)
+    if t > now + 86400.0:       # previous month
+        if tms[1] > 1:
+            tms[1] -= 1
+        else:
+            tms[1] = 12
+            tms[0] -= 1
+    elif t < now - 25*86400.0:  # next month
+        if tms[1] < 12:
+            tms[1] += 1
+        else:
+            tms[1] = 1
+            tms[0] += 1
+
+def iter_matches(regex, text, pos=0, endpos=None):
+    """
+       Generates the matches of regex, a compiled regular expression, found
+       one after the other in text between pos and endpos, each search
+       starting where the previous match ended. The text is not copied, so
+       this is linear in its length.
+    """
+    if endpos is None:
+        endpos = len(text)
+    return regex.finditer(text, pos, endpos)
+
+def findLineStarts(text):
+    """Returns the offsets in text of the start of each line"""
+    return [0] + [m.end() for m in re.finditer('\n', text)]
+
+def lineColumnIndex(starts, span, first=0):
+    """Converts the (start, end) offsets of a decoded group, its 'span', to
+    the ('line.column', 'line.column') pair groups used to have as 'index'.
+    starts are the line offsets of the report, from findLineStarts(). Lines
+    are counted from 1 plus first, columns from 0."""
+    start, end = span
+    sl = bisect.bisect_right(starts, start) - 1
+    el = bisect.bisect_right(starts, end) - 1
+    return ('%d.%d' % (sl+1+first, start-starts[sl]),
+            '%d.%d' % (el+1+first, end-starts[el]))
+
+class ReferenceTime(object):
+    """
+       The time reports are decoded against, set once for a batch of
+       reports or a bulletin. Resolves the day, hour and minute of a report
+       to seconds since the epoch the same way as fix_date() and
+       time.mktime() of the completed time tuple, the start of the months
+       involved being worked out only once.
+    """
+    def __init__(self, now=None):
+        if now is None:
+            now = time.time()
+        self.now = now
+        self.gmt = time.gmtime(now)
+        #(year, month): time.mktime() of its first day
+        self._months = {}
+        #ddhhmm: ReferenceTime of a bulletin
+        self._headings = {}
+
+    def __repr__(self):
+        return 'ReferenceTime(%r)' % self.now
+
+    def fix_date(self, tms):
+        """fix_date() against this reference"""
+        fix_date(tms, self.now)
+
+    def _monthStart(self, year, month):
+        try:
+            return self._months[(year, month)]
+        except KeyError:
+            start = self._months[(year, month)] = time.mktime((year, month, 1, 0, 0, 0, 0, 0, 0))
+            return start
+
+    def _month(self, offset):
+        #
+        # (year, month) fix_date() settles on for offset seconds into the
+        # month of the reference
+        year, month = self.gmt[:2]
+        t = self._monthStart(year, month) + offset
+        if t > self.now + 86400.0:       # previous month
+            if month > 1:
+                return year, month - 1
+            return year - 1, 12
+        if t < self.now - 25*86400.0:  # next month
+            if month < 12:
+                return year, month + 1
+            return year + 1, 1
+        return year, month
+
+    def resolve(self, mday, hour, minute):
+        """
+           Args:
+               mday, hour, minute (int): Time of a report
+           Returns:
+               time.mktime() of the report's time tuple, completed with the
+               month and year fix_date() chooses, or None if that month has
+               no such day.
+        """
+        offset = (mday-1)*86400 + hour*3600 + minute*60
+        year, month = self._month(offset)
+        if not valid_day((year, month, mday)):
+            return None
+        return self._monthStart(year, month) + offset
+
+    def heading(self, ddhhmm):
+        """
+           Returns the ReferenceTime of a bulletin issued at ddhhmm, the
+           day, hour and minute of its WMO heading, resolved against this
+           one. This one if ddhhmm is not a valid time.
+        """
+        try:
+            return self._headings[ddhhmm]
+        except KeyError:
+            pass
+
+        reference = self
+        try:
+            mday, hour, minute = int(ddhhmm[:2]), int(ddhhmm[2:4]), int(ddhhmm[4:6])
+        except (TypeError, ValueError):
+            mday = 0
+        if 1 <= mday <= 31 and hour <= 23 and minute <= 59:
+            year, month = self._month((mday-1)*86400 + hour*3600 + minute*60)
+            if valid_day((year, month, mday)):
+                reference = ReferenceTime(calendar.timegm((year, month, mday, hour, minute, 0)))
+        self._headings[ddhhmm] = reference
+        return reference
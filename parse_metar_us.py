@@ -4,12 +4,21 @@
 # Copyright (c) 2016, University Corporation for Atmospheric Research (UCAR)
 #
 import os,sys,traceback
+import stat
 import optparse
+import multiprocessing
 import datetime
+import calendar
 import pytz
 import re
 import logging
+import collections
 import station_util
+import station_registry
+import station_table
+import report_cache
+import bulletin_util
+import metar_util
 
 import usMetarDecoder as usMD
 import METARXMLEncoder as MXE
@@ -40,161 +49,661 @@ us_metars =re.compile(r"""(
 [K][0-9A-Z]{3}|P[AH][0-9A-Z]{2}
 )""", re.VERBOSE|re.DOTALL)
 
+#
+# Code lists and station metadata needed by the encoder
+#STATION_INFO_FILE = '/home/ldm/util/metars/data/metarStationInfo.txt'
+WW_CODES_FILE = '/home/ldm/util/metars/data/ww.xml'
+STATION_INFO_FILE = '/home/idp/compare/NOAA/metars/data/metarStationInfo.txt'
+
 usage = ("Usage: %prog [options] [filename]\n\n"
         "If no filename is specified, reads from STDIN")
-parseopts = optparse.OptionParser(usage=usage)
-parseopts.add_option('-v', action='count', dest='verbosity', default=0,
-                         help='Verbosity level')
-parseopts.add_option('-D', action='store', dest='outdir', default='',
-                    help='Directory in which to output files')
-parseopts.add_option('-w', action='store_true',
-                    dest='writefiles', default=False,
-                    help='Write output to disk instaed of STDOUT')
-parseopts.add_option('-d', action='store_true',
-                    dest='date_dirs', default=False,
-                    help='Write output dated directories within -D dir')
-
-opts, args = parseopts.parse_args()
-verbosity = opts.verbosity
-writefiles = opts.writefiles
-date_dirs = opts.date_dirs
-
-#logging.basicConfig(filename=writefiles, level=logging.INFO)
-
-if writefiles:
-    if not opts.outdir:
-        print "writefiles option (-w)  also requires outputdir option (-D)."
-        parseopts.print_help()
-        sys.exit(2) 
-    outdir = opts.outdir
-    if not os.path.isdir(outdir):
-        print '%s does not exist or is not a directory' % outdir
-        sys.exit(2)
-else:
-    outdir = ""
-    
-reftime = datetime.datetime.utcnow()
-reftime = reftime.replace(second=0, microsecond=0,
-                        tzinfo=pytz.timezone('UTC'))
-
-if writefiles and outdir and date_dirs:
-    date = reftime.strftime('%Y%m%d')
-    hour = reftime.strftime('%H')
-    if not os.path.exists(os.path.join(outdir, date)):
-        os.mkdir(os.path.join(outdir, date))
-    if not os.path.exists(os.path.join(outdir, date, hour)):
-        os.mkdir(os.path.join(outdir, date, hour))
-    outdir = os.path.join(outdir, date, hour)
 
-#
-# Create the decoder/encoder objects
-decoder = usMD.Decoder()
-#encoder = MXE.XMLEncoder(wwCodesFile='/home/ldm/util/metars/data/ww.xml',metarStationInfoFile='/home/ldm/util/metars/data/metarStationInfo.txt')
-encoder = MXE.XMLEncoder(wwCodesFile='/home/ldm/util/metars/data/ww.xml',metarStationInfoFile='/home/idp/compare/NOAA/metars/data/metarStationInfo.txt')
-#
-if len(args) == 0:
-    fh = sys.stdin
-else:
-    fh = open(args[0],'r')
-filestr = fh.read()
-fh.close()
-
-bulletins = bulletin.findall(filestr)
-if len(bulletins) == 0:
-    bulletins = [filestr]
-for text in bulletins:
-  
+def get_option_parser():
+    """Returns the command line parser for this script"""
+
+    parseopts = optparse.OptionParser(usage=usage)
+    parseopts.add_option('-v', action='count', dest='verbosity', default=0,
+                             help='Verbosity level')
+    parseopts.add_option('-D', action='store', dest='outdir', default='',
+                        help='Directory in which to output files')
+    parseopts.add_option('-w', action='store_true',
+                        dest='writefiles', default=False,
+                        help='Write output to disk instaed of STDOUT')
+    parseopts.add_option('-d', action='store_true',
+                        dest='date_dirs', default=False,
+                        help='Write output dated directories within -D dir')
+    parseopts.add_option('--workers', action='store', type='int',
+                        dest='workers', default=0,
+                        help='Number of worker processes decoding and encoding reports')
+    parseopts.add_option('--chunksize', action='store', type='int',
+                        dest='chunksize', default=16,
+                        help='Number of reports handed to a worker at a time')
+    parseopts.add_option('--daemon', action='store_true',
+                        dest='daemon', default=False,
+                        help='Decode bulletins continuously as they arrive on STDIN or a FIFO')
+    parseopts.add_option('--trace', action='store_true',
+                        dest='trace', default=False,
+                        help='Trace the decoder parsing each report, for debugging (slow)')
+    parseopts.add_option('--dedup-window', action='store', type='float',
+                        dest='dedup_window', default=report_cache.DUPLICATE_WINDOW,
+                        help='Seconds during which repeats of a report, and reports superseded by a correction, '
+                             'are skipped, 0 to decode every copy [default: %default]')
+    parseopts.add_option('--dedup-size', action='store', type='int',
+                        dest='dedup_size', default=report_cache.DUPLICATE_SIZE,
+                        help='Most reports remembered for duplicate suppression [default: %default]')
+    parseopts.add_option('--reftime', action='store',
+                        dest='reftime', default=None,
+                        help='UTC time, YYYYMMDDHHMM, the reports are decoded against and the output named by, '
+                             'e.g. when an archive was collected, so reprocessing it gives the same result '
+                             '[default: now]')
+    parseopts.add_option('--max-steps', action='store', type='int',
+                        dest='max_steps', default=0,
+                        help='Most tokens the decoder tries on a report before giving up on it, '
+                             'keeping what was decoded, 0 for no limit [default: %default]')
+    parseopts.add_option('--max-seconds', action='store', type='float',
+                        dest='max_seconds', default=0,
+                        help='Most seconds the decoder spends on a report before giving up on it, '
+                             '0 for no limit [default: %default]')
+    parseopts.add_option('--fault-log-interval', action='store', type='int',
+                        dest='fault_log_interval', default=1,
+                        help='Log the first decoder fault of each kind with its report, then every Nth, '
+                             '0 for none. All are counted in the summary [default: %default]')
+    return parseopts
+
+def get_reftime(text=None):
+    """Returns the current time, to the minute, used to name the output.
+       If given, text is the time to use instead, as YYYYMMDDHHMM.
+    """
+
+    if text:
+        reftime = datetime.datetime.strptime(text, '%Y%m%d%H%M')
+    else:
+        reftime = datetime.datetime.utcnow()
+    return reftime.replace(second=0, microsecond=0,
+                           tzinfo=pytz.timezone('UTC'))
+
+#The metar_util.ReferenceTime of the last reftime
+_references = {}
+
+def get_reference(reftime):
+    """Returns the metar_util.ReferenceTime of reftime, a datetime from
+       get_reftime(). Bulletins are decoded against the time in their
+       heading, resolved against it.
+    """
+    reference = _references.get(reftime)
+    if reference is None:
+        _references.clear()
+        reference = _references[reftime] = metar_util.ReferenceTime(calendar.timegm(reftime.utctimetuple()))
+    return reference
+
+def get_outdir(outdir, reftime, date_dirs):
+    """Returns the output directory for the reference time, creating
+       the dated sub-directories when date_dirs is set.
+    """
+    if outdir and date_dirs:
+        date = reftime.strftime('%Y%m%d')
+        hour = reftime.strftime('%H')
+        if not os.path.exists(os.path.join(outdir, date)):
+            os.mkdir(os.path.join(outdir, date))
+        if not os.path.exists(os.path.join(outdir, date, hour)):
+            os.mkdir(os.path.join(outdir, date, hour))
+        outdir = os.path.join(outdir, date, hour)
+    return outdir
+
+def get_xmlfile(outdir, reftime, station, metartype):
+    """Returns the name of the XML file for a report"""
+
+    #Add seconds to hopefully provide more uniqueness to the file name,
+    #this only works if there is a measurable difference in time between
+    #duplicate station reports with resolution of seconds.
+    return os.path.join(outdir, "%s_%s_%s.xml" %(reftime.strftime('%Y%m%d_%H%M%S'), station, metartype.lower()))
+
+def create_decoder_encoder(trace=False, maxSteps=0, maxSeconds=0, faultLogInterval=1):
+    """Create the decoder/encoder objects. These are expensive to build
+       (grammar compilation, station and code list parsing) so callers
+       processing many files should create them once and reuse them.
+       If trace is set, the decoder traces every token it parses.
+       maxSteps and maxSeconds, if not 0, are the decoder's budget for
+       each report. One in faultLogInterval faults of each kind is logged.
+    """
+    if trace:
+        decoder = usMD.VerboseDecoder()
+    else:
+        decoder = usMD.Decoder()
+    if maxSteps:
+        decoder.maxSteps = maxSteps
+    if maxSeconds:
+        decoder.maxSeconds = maxSeconds
+    decoder.faultLogInterval = faultLogInterval
+    #The encoder's registry also answers the US station check, so us_stations.txt
+    #is loaded and merged once. A compiled station table is mapped by the encoder itself.
+    registry = None
+    if not station_table.is_table(STATION_INFO_FILE):
+        registry = station_registry.get_registry(stationInfoFile=STATION_INFO_FILE,
+                                                 usStationsFile=station_util.US_STATIONS_FILE)
+        station_util.set_registry(registry)
+    encoder = MXE.XMLEncoder(wwCodesFile=WW_CODES_FILE,metarStationInfoFile=STATION_INFO_FILE,
+                             stationRegistry=registry)
+    return decoder, encoder
+
+def create_duplicate_cache(opts):
+    """Returns the cache of reports seen, or None if suppression is off"""
+
+    if opts.dedup_window <= 0 or opts.dedup_size <= 0:
+        return None
+    return report_cache.DuplicateCache(opts.dedup_window, opts.dedup_size)
+
+def create_supersession_table(opts):
+    """Returns the table of corrected reports, or None if suppression is off"""
+
+    if opts.dedup_window <= 0 or opts.dedup_size <= 0:
+        return None
+    return report_cache.SupersessionTable(opts.dedup_window, opts.dedup_size)
+
+def print_duplicate_count(cache, supersession=None):
+    """Logs the number of duplicate and superseded reports skipped"""
+
+    if cache is not None:
+        print "INFO:%d duplicate reports skipped" % cache.duplicates
+    if supersession is not None:
+        print "INFO:%d superseded reports skipped, %d outputs replaced by corrections, %d by re-sent reports" % (
+            supersession.superseded, supersession.corrections, supersession.resends)
+
+def print_decoder_stats(decoder):
+    """Logs how many reports the decoder's fast path decoded, how many it
+       gave up on, and its faults by kind"""
+
+    total = decoder.fastpathHits + decoder.fastpathFallbacks
+    if total:
+        print "INFO:Decoder fast path: %d of %d reports (%.1f%%), %d handed to tpg" % (
+            decoder.fastpathHits, total, 100.0*decoder.fastpathRate(), decoder.fastpathFallbacks)
+    if decoder.budgetExceeded:
+        print "INFO:%d reports over the decoder budget, partly decoded" % decoder.budgetExceeded
+    print_fault_summary(decoder.errors)
+
+def print_fault_summary(errors):
+    """Logs the decoder faults counted in errors by kind, most frequent
+       first. The lines of several summaries add up."""
+
+    for count, error, token in usMD.fault_summary(errors):
+        print "INFO:Decoder faults: %d %s at token %s" % (count, error, token)
+
+def split_bulletins(filestr):
+    """Returns the \x01...\x03 framed bulletins in the raw feed text, or
+       the whole text if it isn't framed.
+    """
+    bulletins = bulletin.findall(filestr)
+    if len(bulletins) == 0:
+        bulletins = [filestr]
+    return bulletins
+
+def process_text(filestr, decoder, encoder, reftime, outdir='', writefiles=False, verbosity=0, cache=None, supersession=None):
+    """Decodes and encodes every METAR/SPECI found in the raw feed text.
+
+    Args:
+        filestr (string): Raw text, one or more \\x01...\\x03 framed bulletins
+        decoder (usMetarDecoder.Decoder): The decoder
+        encoder (METARXMLEncoder.XMLEncoder): The encoder
+        reftime (datetime): Time used to name the output files, and to
+                            decode the reports against
+        outdir (string): Directory in which the XML files are written
+        writefiles (bool): Write XML to disk instead of STDOUT
+        verbosity (int): Verbosity level
+        cache (report_cache.DuplicateCache): Reports already seen, which
+                                             are skipped if seen again
+        supersession (report_cache.SupersessionTable): Latest versions of
+                     the reports seen. Corrections replace the output of
+                     the report they correct.
+    Returns:
+        None
+    """
+    process_bulletins(split_bulletins(filestr), decoder, encoder, reftime, outdir, writefiles, verbosity, cache, supersession)
+
+def process_bulletins(bulletins, decoder, encoder, reftime, outdir='', writefiles=False, verbosity=0, cache=None, supersession=None):
+    """Decodes and encodes the reports in each of the bulletins, which may be
+       any iterable, e.g. bulletin_util.iter_file_bulletins(), so they are
+       never all held in memory.
+    """
+    for text in bulletins:
+        process_bulletin(text, decoder, encoder, reftime, outdir, writefiles, verbosity, cache, supersession)
+
+def process_bulletin(text, decoder, encoder, reftime, outdir='', writefiles=False, verbosity=0, cache=None, supersession=None):
+    """Decodes and encodes the reports in a single bulletin"""
+
+    for stext, station, metartype, version, ddhhmm in frame_bulletin(text, verbosity, cache=cache, supersession=supersession):
+        xmlfile = None
+        if writefiles and version is not None:
+            xmlfile = version.target(get_xmlfile(outdir, reftime, station, metartype))
+        xmlfile = process_report(stext, station, metartype, decoder, encoder, reftime, outdir, writefiles, verbosity,
+                                 xmlfile=xmlfile, reference=get_reference(reftime).heading(ddhhmm))
+        if xmlfile is not None and version is not None:
+            claim_output(version, xmlfile, station, metartype)
+
+def claim_output(version, xmlfile, station, metartype, out=None):
+    """Records that the report's XML file was written, logging whether it
+       replaced the output of a correction's original or of the same
+       report sent before. out defaults to STDOUT.
+    """
+    if out is None:
+        out = sys.stdout
+
+    replaced = version.claim(xmlfile)
+    if replaced == 'correction':
+        print >>out, "INFO:Correction replaces %s %s"%(station, metartype)
+    elif replaced == 'resend':
+        print >>out, "INFO:Re-sent report replaces %s %s"%(station, metartype)
+
+def frame_bulletin(text, verbosity=0, out=None, err=None, cache=None, supersession=None):
+    """Generates (report, station, METAR|SPECI, version, ddhhmm) for each US
+       report in a bulletin, ddhhmm being the time in its WMO heading. Informational messages are written to out and err,
+       which default to STDOUT and STDERR. Reports found in cache are
+       skipped, as are those superseded by a correction already seen.
+       version is the report's report_cache.Supersession, None without a
+       supersession table.
+    """
+    if out is None:
+        out = sys.stdout
+    if err is None:
+        err = sys.stderr
+
     if verbosity >= 1:
-        print text.replace( '\r', '')\
-            .replace( '', '')\
-            .replace( '', '')
-            
-    m = wmo_hdr.match(text)
-    if m:
-        text = text.replace(m.group(0),'',1)
-
-    m = metar_type.match(text)
-    if m is None:
+        print >>out, text.translate(None, '\r\x03\x01')
+
+    #
+    # WMO heading and METAR|SPECI keyword
+    ttaaii, cccc, ddhhmm, bbb, metartype, body = bulletin_util.parse_header(text)
+    text = text[body:]
+    if metartype is None:
         if 'NIL=' in text:
-            continue
-        sys.stderr.write("ERROR: Could not find 'METAR' or 'SPECI' identifier.\n")
-        continue
-    text = text.replace(m.group(0),'',1)
-    d = m.groupdict()
-    metartype = d['type']
+            return
+        err.write("ERROR: Could not find 'METAR' or 'SPECI' identifier.\n")
+        return
 
     metars = re.split('=\s*', text )
     for i in range(0,len(metars)):
-        stext = metars[i].strip()
-        stext = stext.replace( '.', '' )\
-            .replace( '','')\
-            .replace( ' \r\n ', ' ' )\
-            .replace( '\r\n ', ' ' )\
-            .replace( ' \r\n', ' ' )\
-            .replace( '\r\n', ' ' )\
-            .replace( '\r', ' ' )\
-            .replace( '\n', ' ' )\
-            .replace( '     ', ' ' )\
-            .replace( '    ', ' ' )\
-            .replace( '   ', ' ' )\
-            .replace( '  ', ' ' )
-        if re.sub(r'[\s]+', '', stext) == '':
+        stext = bulletin_util.normalize_report(metars[i])
+        if not stext:
             continue
         if stext[0:5] == metartype:
             station = stext[6:10]
+            report = stext[6:]
         else:
             station = stext[0:4]
+            report = stext
             stext = "%s\n%s=" % (metartype, stext)
-            
+
         if verbosity >= 2:
-            print "Starting to parse:'%s'" % stext
-                        
+            print >>out, "Starting to parse:'%s'" % stext
+
         if nill.match(stext):
-            print "INFO:Nil found: %s"%stext
+            print >>out, "INFO:Nil found: %s"%stext
             continue
-        
+
        # if not us_metars.match(station):
        #     print "INFO:Non US Metar encountered: %s"%station
        #     continue
 
         #Compare this station against the us_stations.txt to determine if this is a US station
         if station_util.is_US_station(station):
-            print "INFO:US Metar encountered: %s"%station
+            print >>out, "INFO:US Metar encountered: %s"%station
         else:
-            print "INFO:Non-US Metar or unrecognized station encountered: %s"%station
+            print >>out, "INFO:Non-US Metar or unrecognized station encountered: %s"%station
             continue
-        
-        try:
-            # The text *must* begin with METAR or SPECI
-            # keyword and end with a '=' indicating EOT. 
-            d = decoder(stext)
-            #logging.info("DECODING %s"%stext)
-            print("DECODING %s")%(stext)
-            if d:
-                encoder(d,report=stext,allowUSExtensions=True,nameSpaceDeclarations=True,debugComment=False)
-                #
-                # The second argument is whether to provide output suitable
-                # for viewing.
-                if writefiles:
-                    #Add seconds to hopefully provide more uniqueness to the file name,
-                    #this only works if there is a measurable difference in time between
-                    #duplicate station reports with resolution of seconds.
-                    xmlfile = os.path.join(outdir, "%s_%s_%s.xml" %(reftime.strftime('%Y%m%d_%H%M%S'), station, metartype.lower()))
+
+        #The same report redelivered or repeated in another bulletin. Checked
+        #after the station, so every copy is still counted as US or not.
+        if cache is not None and cache.is_duplicate(metartype, report):
+            print >>out, "INFO:Duplicate report skipped: %s"%station
+            continue
+
+        version = None
+        if supersession is not None:
+            version = supersession.update(metartype, station, report, bbb)
+            if version is None:
+                print >>out, "INFO:Superseded report skipped: %s"%station
+                continue
+
+        yield stext, station, metartype, version, ddhhmm
+
+def process_report(stext, station, metartype, decoder, encoder, reftime, outdir='', writefiles=False, verbosity=0,
+                   out=None, err=None, xmlsink=None, xmlfile=None, reference=None):
+    """Decodes a single report and writes its XML document.
+
+       Messages are written to out and err, which default to STDOUT and
+       STDERR. If given, xmlsink is called with the name of the XML file
+       and returns the file object the document is written to. xmlfile
+       overrides the name of the XML file, e.g. to replace the output of
+       the report corrected. The file is replaced atomically. reference
+       is the metar_util.ReferenceTime the report is decoded against, the
+       current time if not given.
+
+       Returns the XML file written, None if none was or if the document
+       was handed to xmlsink.
+    """
+    if out is None:
+        out = sys.stdout
+    if err is None:
+        err = sys.stderr
+
+    written = None
+    try:
+        # The text *must* begin with METAR or SPECI
+        # keyword and end with a '=' indicating EOT.
+        d = decoder(stext, reference)
+        #logging.info("DECODING %s"%stext)
+        print >>out, ("DECODING %s")%(stext)
+        if d:
+            encoder(d,report=stext,allowUSExtensions=True,nameSpaceDeclarations=True,debugComment=False,
+                    reference=reference)
+            #
+            # The second argument is whether to provide output suitable
+            # for viewing.
+            if writefiles:
+                if xmlfile is None:
+                    xmlfile = get_xmlfile(outdir, reftime, station, metartype)
+                if xmlsink is None:
+                    #Readers never see a partly written, or replaced, file
+                    tmpfile = xmlfile + '.tmp'
+                    encoder.printXML(tmpfile,True)
+                    os.rename(tmpfile, xmlfile)
+                    written = xmlfile
                 else:
-                    xmlfile = sys.stdout
+                    encoder.printXML(xmlsink(xmlfile),True)
+            else:
+                xmlfile = out
                 encoder.printXML(xmlfile,True)
-                
-                if writefiles and verbosity >= 1:
-                    print 'Wrote XML file', xmlfile
-            
-            
-        # A KeyError is usually 'station not found'
-        except KeyError:
-        #    pass
-            sys.stderr.write("WARNING: Unknown station '%s'.\n" % station)
-        #
-        # Something different, probably should halt . . .
-        except Exception:
-            #pass
-            traceback.print_exc()
 
+            if writefiles and verbosity >= 1:
+                print >>out, 'Wrote XML file', xmlfile
+
+
+    # A KeyError is usually 'station not found'
+    except KeyError:
+    #    pass
+        err.write("WARNING: Unknown station '%s'.\n" % station)
+    #
+    # Something different, probably should halt . . .
+    except Exception:
+        #pass
+        traceback.print_exc(file=err)
+
+    return written
+
+##############################################################################
+# Multiprocess decoding. The parent frames the bulletins and hands the reports
+# to a pool of workers, each with its own decoder and encoder. Everything a
+# worker would have written is recorded and replayed by the parent in report
+# order, so the output is the same as a serial run.
+#
+class _Capture(object):
+    """File-like object recording (stream, text) pairs in order"""
+
+    def __init__(self, records, stream):
+        self.records = records
+        self.stream = stream
+        self.softspace = 0
+
+    def write(self, text):
+        self.records.append((self.stream, text))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class _FileCapture(_Capture):
+    """Records an entire file, named by its path, once it is closed"""
+
+    def __init__(self, records, path):
+        _Capture.__init__(self, records, path)
+        self.chunks = []
+
+    def write(self, text):
+        self.chunks.append(text)
+
+    def close(self):
+        self.records.append((self.stream, ''.join(self.chunks)))
+
+def _replay(records):
+    """Writes out what was recorded by the _Capture objects, returning the
+       files written"""
+
+    written = []
+    for stream, text in records:
+        if stream == 'stdout':
+            sys.stdout.write(text)
+        elif stream == 'stderr':
+            sys.stderr.write(text)
+        else:
+            tmpfile = stream + '.tmp'
+            fh = open(tmpfile, 'w')
+            fh.write(text)
+            fh.close()
+            os.rename(tmpfile, stream)
+            written.append(stream)
+    return written
+
+_worker = {}
+
+def _init_worker(trace=False, maxSteps=0, maxSeconds=0, faultLogInterval=1):
+    """Pool initializer, gives each worker process its own decoder/encoder"""
+
+    decoder, encoder = create_decoder_encoder(trace, maxSteps, maxSeconds, faultLogInterval)
+    #
+    # Decoder warnings are recorded along with the rest of the output
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    logging.getLogger().addHandler(handler)
+    _worker.update(decoder=decoder, encoder=encoder, handler=handler)
+
+def _worker_report(job):
+    """Decodes and encodes one report in a worker. Returns what was recorded,
+       and the decoder faults counted since the last report, or None.
+    """
+    records, report = job
+    if report is not None:
+        stext, station, metartype, reftime, outdir, writefiles, verbosity, xmlfile, reference = report
+        out = _Capture(records, 'stdout')
+        err = _Capture(records, 'stderr')
+        _worker['handler'].stream = err
+        process_report(stext, station, metartype, _worker['decoder'], _worker['encoder'],
+                       reftime, outdir, writefiles, verbosity, out, err,
+                       lambda path: _FileCapture(records, path), xmlfile, reference)
+    errors = None
+    if _worker['decoder'].errors:
+        errors = _worker['decoder'].errors
+        _worker['decoder'].errors = collections.Counter()
+    return records, errors
+
+def _iter_jobs(bulletins, reftime, outdir, writefiles, verbosity, cache=None, supersession=None, pending=None):
+    """Frames the bulletins, generating (records, report) jobs for the workers.
+       records holds the messages written while framing up to that report.
+       For each job, (version, station, METAR|SPECI) of its report, or None,
+       is appended to pending if given, for the output to be claimed once
+       it is written.
+    """
+    records = []
+    out = _Capture(records, 'stdout')
+    err = _Capture(records, 'stderr')
+    for text in bulletins:
+        for stext, station, metartype, version, ddhhmm in frame_bulletin(text, verbosity, out, err, cache, supersession):
+            #The output file is chosen here, where the supersession table is
+            xmlfile = None
+            if writefiles and version is not None:
+                xmlfile = version.target(get_xmlfile(outdir, reftime, station, metartype))
+            reference = get_reference(reftime).heading(ddhhmm)
+            if pending is not None:
+                pending.append((version, station, metartype))
+            yield records[:], (stext, station, metartype, reftime, outdir, writefiles, verbosity, xmlfile, reference)
+            del records[:]
+    if records:
+        if pending is not None:
+            pending.append(None)
+        yield records[:], None
+
+def create_pool(workers, trace=False, maxSteps=0, maxSeconds=0, faultLogInterval=1):
+    """Returns a pool of worker processes, each owning a decoder/encoder"""
+
+    return multiprocessing.Pool(workers, _init_worker, (trace, maxSteps, maxSeconds, faultLogInterval))
+
+def process_text_pool(filestr, pool, reftime, outdir='', writefiles=False, verbosity=0, chunksize=16, cache=None, supersession=None,
+                      errors=None):
+    """Same as process_text(), but the reports are decoded and encoded by
+       the worker pool, chunksize reports at a time. Output is written in
+       the order the reports appear in the text.
+    """
+    process_bulletins_pool(split_bulletins(filestr), pool, reftime, outdir, writefiles, verbosity, chunksize, cache, supersession,
+                           errors)
+
+def process_bulletins_pool(bulletins, pool, reftime, outdir='', writefiles=False, verbosity=0, chunksize=16, cache=None, supersession=None,
+                           errors=None):
+    """Same as process_bulletins(), using the worker pool. Duplicates are
+       found by the parent, so they are never handed to a worker. The
+       workers' decoder faults are added to errors, a collections.Counter,
+       if given.
+    """
+
+    #The jobs are generated by the pool's own thread, ahead of the results
+    pending = collections.deque()
+    jobs = _iter_jobs(bulletins, reftime, outdir, writefiles, verbosity, cache, supersession, pending)
+    for records, faults in pool.imap(_worker_report, jobs, chunksize):
+        written = _replay(records)
+        job = pending.popleft()
+        if written and job is not None and job[0] is not None:
+            version, station, metartype = job
+            claim_output(version, written[-1], station, metartype)
+        if faults and errors is not None:
+            errors.update(faults)
+
+def run_daemon(path, decoder, encoder, pool=None, outdir='', writefiles=False, date_dirs=False, verbosity=0, cache=None, supersession=None,
+               reftime=None):
+    """Decodes bulletins from a continuous feed as soon as their ETX
+       arrives, keeping the decoder, encoder and station tables for the
+       life of the process.
+
+    Args:
+        path (string): FIFO or file to read, STDIN if empty. A FIFO is
+                       reopened when its writers go away.
+        decoder, encoder: Used when pool is None
+        pool (multiprocessing.Pool): Worker pool from create_pool()
+        outdir (string): Directory in which the XML files are written
+        writefiles (bool): Write XML to disk instead of STDOUT
+        date_dirs (bool): Write output to dated directories within outdir
+        verbosity (int): Verbosity level
+        cache (report_cache.DuplicateCache): Reports already seen
+        supersession (report_cache.SupersessionTable): Latest versions of the reports seen
+        reftime (string): YYYYMMDDHHMM to use as the time every bulletin
+                          is received, for get_reftime()
+    Returns:
+        None, when the feed reaches EOF
+    """
+    framer = bulletin_util.BulletinFramer()
+    while True:
+        if path:
+            fd = os.open(path, os.O_RDONLY)
+        else:
+            fd = sys.stdin.fileno()
+        for text in bulletin_util.read_bulletins(fd, framer=framer):
+            #
+            # The output is named by the time the bulletin was received
+            received = get_reftime(reftime)
+            if writefiles:
+                bulletin_outdir = get_outdir(outdir, received, date_dirs)
+            else:
+                bulletin_outdir = outdir
+            #
+            # The decoder faults are summed up for each bulletin
+            if pool is None:
+                process_bulletin(text, decoder, encoder, received, bulletin_outdir, writefiles, verbosity, cache, supersession)
+                errors = decoder.errors
+                decoder.errors = collections.Counter()
+            else:
+                errors = collections.Counter()
+                process_bulletins_pool([text], pool, received, bulletin_outdir, writefiles, verbosity, 1, cache, supersession,
+                                       errors)
+            print_fault_summary(errors)
+            sys.stdout.flush()
+            sys.stderr.flush()
+        if path:
+            os.close(fd)
+        if not (path and stat.S_ISFIFO(os.stat(path).st_mode)):
+            break
+
+def main(argv=None):
+
+    parseopts = get_option_parser()
+    opts, args = parseopts.parse_args(argv)
+    verbosity = opts.verbosity
+    writefiles = opts.writefiles
+    date_dirs = opts.date_dirs
+
+    #logging.basicConfig(filename=writefiles, level=logging.INFO)
+
+    if writefiles:
+        if not opts.outdir:
+            print "writefiles option (-w)  also requires outputdir option (-D)."
+            parseopts.print_help()
+            sys.exit(2)
+        outdir = opts.outdir
+        if not os.path.isdir(outdir):
+            print '%s does not exist or is not a directory' % outdir
+            sys.exit(2)
+    else:
+        outdir = ""
+
+    try:
+        get_reftime(opts.reftime)
+    except ValueError:
+        print '--reftime %s is not a YYYYMMDDHHMM time' % opts.reftime
+        sys.exit(2)
+
+    cache = create_duplicate_cache(opts)
+    supersession = create_supersession_table(opts)
+
+    if opts.daemon:
+        pool = decoder = encoder = None
+        if opts.workers > 0:
+            pool = create_pool(opts.workers, opts.trace, opts.max_steps, opts.max_seconds, opts.fault_log_interval)
+        else:
+            decoder, encoder = create_decoder_encoder(opts.trace, opts.max_steps, opts.max_seconds, opts.fault_log_interval)
+        try:
+            run_daemon(args[0] if args else '', decoder, encoder, pool, outdir, writefiles, date_dirs, verbosity, cache, supersession,
+                       opts.reftime)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return
+
+    reftime = get_reftime(opts.reftime)
+    if writefiles:
+        outdir = get_outdir(outdir, reftime, date_dirs)
+    #
+    # A file is scanned through a memory map, one bulletin at a time
+    if len(args) == 0:
+        bulletins = split_bulletins(sys.stdin.read())
+    else:
+        bulletins = bulletin_util.iter_file_bulletins(args[0])
+
+    if opts.workers > 0:
+        pool = create_pool(opts.workers, opts.trace, opts.max_steps, opts.max_seconds, opts.fault_log_interval)
+        errors = collections.Counter()
+        try:
+            process_bulletins_pool(bulletins, pool, reftime, outdir, writefiles, verbosity, opts.chunksize, cache, supersession,
+                                   errors)
+        finally:
+            pool.close()
+            pool.join()
+        print_duplicate_count(cache, supersession)
+        print_fault_summary(errors)
+        return
+    #
+    # Create the decoder/encoder objects
+    decoder, encoder = create_decoder_encoder(opts.trace, opts.max_steps, opts.max_seconds, opts.fault_log_interval)
+    process_bulletins(bulletins, decoder, encoder, reftime, outdir, writefiles, verbosity, cache, supersession)
+    print_duplicate_count(cache, supersession)
+    print_decoder_stats(decoder)
+
+if __name__ == '__main__':
+    main()
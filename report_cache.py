@@ -0,0 +1,209 @@
+import re
+import time
+import hashlib
+import collections
+
+'''Caches of the reports already seen by the ingest path, so the copies of
+   a report redelivered by the LDM feed, or repeated in several bulletins,
+   are not decoded, encoded and written again, and a corrected report
+   replaces the output of the report it corrects.
+'''
+
+#Seconds a report is remembered for
+DUPLICATE_WINDOW = 3600
+
+#Most reports remembered at once
+DUPLICATE_SIZE = 100000
+
+def report_key(metartype, report):
+    """
+        Args:
+            metartype (string): METAR or SPECI
+            report (string): Normalized report text, station onwards
+        Returns:
+            Digest identifying the report by its type, station, issue time
+            and body. Whitespace and the trailing '=' do not matter.
+    """
+    return hashlib.sha1('%s %s' % (metartype, ' '.join(report.rstrip('=').split()))).digest()
+
+class DuplicateCache(object):
+    """
+       Remembers the reports seen within the last window seconds, at most
+       maxsize of them, the oldest being forgotten first.
+    """
+    def __init__(self, window=DUPLICATE_WINDOW, maxsize=DUPLICATE_SIZE):
+        self.window = window
+        self.maxsize = maxsize
+        #Digest: time first seen, oldest first
+        self.seen = collections.OrderedDict()
+        #Number of duplicates found
+        self.duplicates = 0
+
+    def expire(self, now=None):
+        """Forgets the reports seen more than window seconds ago"""
+        if now is None:
+            now = time.time()
+        seen = self.seen
+        while seen:
+            key, first = next(seen.iteritems())
+            if now - first < self.window:
+                break
+            del seen[key]
+
+    def is_duplicate(self, metartype, report, now=None):
+        """
+           Returns True if the report was already seen within the window,
+           otherwise remembers it and returns False.
+        """
+        if now is None:
+            now = time.time()
+        self.expire(now)
+        key = report_key(metartype, report)
+        if key in self.seen:
+            self.duplicates += 1
+            return True
+        self.seen[key] = now
+        if len(self.seen) > self.maxsize:
+            self.seen.popitem(last=False)
+        return False
+
+    def __len__(self):
+        return len(self.seen)
+
+_issue_time = re.compile(r'[0-3][0-9][0-2][0-9][0-5][0-9]Z$')
+
+def correction_rank(bbb, report):
+    """
+        Args:
+            bbb (string): The BBB group of the WMO heading, or None
+            report (string): Normalized report text, station onwards
+        Returns:
+            0 for an original report, 1 for the first correction (CCA, AAA
+            or a COR token), 2 for the second (CCB, AAB) and so on.
+            Delayed reports (RRx) are originals.
+    """
+    rank = 0
+    if bbb and bbb[:2] in ('CC', 'AA'):
+        rank = ord(bbb[2]) - ord('A') + 1
+    tokens = report.split(None, 3)
+    if rank == 0 and len(tokens) > 2 and tokens[2] == 'COR':
+        rank = 1
+    return rank
+
+class Supersession(object):
+    """The latest version seen of a report, and where its output went"""
+
+    __slots__ = ('rank', 'path', 'time', 'written')
+
+    def __init__(self, rank, now):
+        self.rank = rank
+        self.time = now
+        #Output file, once one was written, and the rank of the version in it
+        self.path = None
+        self.written = None
+
+class ReportVersion(object):
+    """One version of a report, as SupersessionTable.update() found it"""
+
+    __slots__ = ('table', 'entry', 'rank')
+
+    def __init__(self, table, entry, rank):
+        self.table = table
+        self.entry = entry
+        self.rank = rank
+
+    def target(self, path):
+        """
+           Returns the file the report is to be written to: the file of the
+           version it supersedes if one was written, path otherwise.
+        """
+        return self.entry.path or path
+
+    def claim(self, path):
+        """
+           Records that the report was written to path. Call it only once
+           the file is in place.
+
+           Returns:
+               'correction' if the output of an earlier version was
+               replaced, 'resend' if that of the same version was, None
+               otherwise
+        """
+        entry = self.entry
+        if entry.path is None:
+            entry.path = path
+            entry.written = self.rank
+            return None
+        if self.rank > entry.written:
+            entry.written = self.rank
+            self.table.corrections += 1
+            return 'correction'
+        self.table.resends += 1
+        return 'resend'
+
+class SupersessionTable(object):
+    """
+       The reports seen within the last window seconds, at most maxsize of
+       them, keyed by report type, station and issue time. A correction
+       takes over the entry of the report it corrects, so its output
+       replaces the original's. A report older than the version already
+       seen is superseded.
+    """
+    def __init__(self, window=DUPLICATE_WINDOW, maxsize=DUPLICATE_SIZE):
+        self.window = window
+        self.maxsize = maxsize
+        #(type, station, issue time): Supersession, oldest first
+        self.reports = collections.OrderedDict()
+        #Number of reports superseded before they were decoded
+        self.superseded = 0
+        #Number of outputs replaced by a later version of the report, and
+        #by the same version sent again
+        self.corrections = 0
+        self.resends = 0
+
+    def expire(self, now=None):
+        """Forgets the reports seen more than window seconds ago"""
+        if now is None:
+            now = time.time()
+        reports = self.reports
+        while reports:
+            key, entry = next(reports.iteritems())
+            if now - entry.time < self.window:
+                break
+            del reports[key]
+
+    def update(self, metartype, station, report, bbb=None, now=None):
+        """
+           Args:
+               metartype (string): METAR or SPECI
+               station (string): ICAO id
+               report (string): Normalized report text, station onwards
+               bbb (string): The BBB group of the bulletin's WMO heading
+           Returns:
+               None if a later version of the report was already seen,
+               otherwise the ReportVersion of the report
+        """
+        if now is None:
+            now = time.time()
+        rank = correction_rank(bbb, report)
+        tokens = report.split(None, 2)
+        if len(tokens) < 2 or not _issue_time.match(tokens[1]):
+            #Without an issue time there is nothing to supersede
+            return ReportVersion(self, Supersession(rank, now), rank)
+
+        self.expire(now)
+        key = (metartype, station, tokens[1])
+        entry = self.reports.get(key)
+        if entry is None:
+            entry = self.reports[key] = Supersession(rank, now)
+            if len(self.reports) > self.maxsize:
+                self.reports.popitem(last=False)
+            return ReportVersion(self, entry, rank)
+        if rank < entry.rank:
+            self.superseded += 1
+            return None
+        entry.rank = rank
+        return ReportVersion(self, entry, rank)
+
+    def __len__(self):
+        return len(self.reports)
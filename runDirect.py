@@ -2,6 +2,8 @@
 import re
 import os
 import sys
+import errno
+import usMetarDecoder
 
 
 def get_filepaths(dir):
@@ -78,7 +80,13 @@ if __name__ == "__main__":
 #    script_cmd = "./parse_metar_us.py -vv -d -D /home/idp/compare/NOAA/metars/WorkInProgress/"+dir+" -w >>/home/idp/compare/NOAA/metars/WorkInProgress/"+dir+"/parseMetar.log 2>&1 "
  
 
+    #for file in files:
+    #    #cmd = script_cmd + "<" + file
+    #    cmd = "./usMetarDecoder.py " + file
+    #    os.system(cmd)
+    #
+    # Decode every file with the same decoder instead of starting
+    # usMetarDecoder.py once per file.
+    decoder = usMetarDecoder.Decoder()
     for file in files:
-        #cmd = script_cmd + "<" + file
-        cmd = "./usMetarDecoder.py " + file
-        os.system(cmd)
+        usMetarDecoder.main(usMetarDecoder.read_reports(file), decoder)
@@ -2,7 +2,10 @@
 import re
 import os
 import sys
+import errno
 import logging
+import parse_metar_us
+import report_cache
 
 
 def get_filepaths(dir):
@@ -64,6 +67,53 @@ def mkdir_p(dir):
             raise
 
 
+def run_batch(files, outdir, logfile, verbosity=2, date_dirs=True):
+    """Decodes and encodes every raw file in a single process.
+
+       Equivalent to running
+       ./parse_metar_us.py -vv -d -D outdir -w >>logfile 2>&1 <file
+       for each file, but the decoder and encoder are only built once and
+       a report repeated in several files is only decoded the first time.
+       A corrected report replaces the output of the report it corrects.
+
+       Args:
+          files (list):  Full filepaths of the raw data to be processed.
+          outdir (string):  Directory in which the XML files are written.
+          logfile (string):  Log file that STDOUT and STDERR are appended to.
+          verbosity (int):  Verbosity level, same as the -v option.
+          date_dirs (bool):  Write output to dated directories within outdir.
+       Returns:
+          None
+    """
+    decoder, encoder = parse_metar_us.create_decoder_encoder()
+    cache = report_cache.DuplicateCache()
+    supersession = report_cache.SupersessionTable()
+    #
+    # Decoder warnings went to STDERR of each parse_metar_us.py process
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    logging.getLogger().addHandler(handler)
+
+    stdout, stderr = sys.stdout, sys.stderr
+    log = open(logfile, 'a')
+    handler.stream = log
+    try:
+        sys.stdout = sys.stderr = log
+        for file in files:
+            reftime = parse_metar_us.get_reftime()
+            dir = parse_metar_us.get_outdir(outdir, reftime, date_dirs)
+            with open(file, 'r') as fh:
+                filestr = fh.read()
+            parse_metar_us.process_text(filestr, decoder, encoder, reftime, dir, True, verbosity, cache, supersession)
+            log.flush()
+        parse_metar_us.print_duplicate_count(cache, supersession)
+        parse_metar_us.print_decoder_stats(decoder)
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        logging.getLogger().removeHandler(handler)
+        log.close()
+
+
 if __name__ == "__main__":
     #Base directory where all output and log files will reside as subdirectories
     working_dir = "/home/idp/compare/NOAA/metars/WorkInProgress/" 
@@ -77,7 +127,12 @@ if __name__ == "__main__":
     files = get_filepaths("/home/idp/compare/data/metars/"+dir )
 #    script_cmd = "./Metar2Xml_us.csh /home/idp/compare/NOAA/metars/"+dir
 #    script_cmd = "./parse_metar_us.py -vv -d -D /home/idp/compare/NOAA/metars/WorkInProgress/"+dir+" -w >>/home/idp/compare/NOAA/metars/WorkInProgress/"+dir+"/parseMetar.log 2>&1 "
-    script_cmd = "./parse_metar_us.py -vv -d -D "+ working_dir  +dir+" -w >>" + working_dir + dir+"/parseMetar.log 2>&1 "
-    for file in files:
-        cmd = script_cmd + "<" + file
-        os.system(cmd)
+#    script_cmd = "./parse_metar_us.py -vv -d -D "+ working_dir  +dir+" -w >>" + working_dir + dir+"/parseMetar.log 2>&1 "
+#    for file in files:
+#        cmd = script_cmd + "<" + file
+#        os.system(cmd)
+    #
+    # Run every file through the same decoder/encoder in this process rather than
+    # starting parse_metar_us.py once per file.
+    logfile = os.path.join(full_dir, "parseMetar.log")
+    run_batch(files, full_dir, logfile)
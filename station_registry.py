@@ -0,0 +1,254 @@
+import os
+import re
+import time
+import collections
+
+import createStns
+
+'''A single registry of station metadata, merged from the station files
+   used by the decoding pipeline:
+
+   metarStationInfo.txt  uuid|icao|lat|lon|elev|name|country|MTR, the
+                         station information used by the XML encoder.
+                         metar_stns.txt, written by createStns.py, has
+                         the same format.
+   stations3.txt         The comma delimited list createStns.py converts.
+   us_stations.txt       icao,lat,lon,elevation,site_name,country for the
+                         US stations only.
+
+   Each file is parsed once per process and parsed again when its
+   modification time changes, so a long running process picks up station
+   updates without a restart.
+'''
+
+#Seconds between checks of the station files for changes
+CHECK_INTERVAL = 1.0
+
+US_STATIONS_FILE = './us_stations.txt'
+
+Station = collections.namedtuple('Station', 'icao lat lon elev name uuid country is_US')
+
+_icao_re = re.compile(r'(^[A-Z][A-Z0-9]{3})')
+
+def read_station_info(filename):
+    """
+        Args: filename of a metarStationInfo.txt or metar_stns.txt file
+        Returns: Dictionary of icao: [lat, lon, elev, name, uuid, country]
+    """
+    stations = {}
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            fields = line.split('|')
+            if len(fields) != 8:
+                continue
+            uuid,icao,lat,lon,elev,name,country,junk = fields
+            stations[icao.strip()] = [lat.strip(), lon.strip(), elev.strip(), name.strip(), uuid, country.strip()]
+    return stations
+
+def read_stations3(filename):
+    """
+        Args: filename of a stations3.txt file
+        Returns: Dictionary of icao: [lat, lon, elev, name, uuid, country]
+                 for the stations createStns.py would write to metar_stns.txt
+    """
+    stations = {}
+    with open(filename, 'r') as f:
+        for line in f:
+            fields = createStns.convert_line(line)
+            if fields is None:
+                continue
+            icao, lat, lon, elev, name, country = fields
+            stations[icao] = [lat, lon, elev, name, createStns.STATION_UUID, country.strip()]
+    return stations
+
+def read_us_stations(filename):
+    """
+        Args: filename of a us_stations.txt file
+        Returns: collections.OrderedDict of icao: [lat, lon, elev, name, None, country],
+                 in the order the stations first appear in the file
+    """
+    stations = collections.OrderedDict()
+    with open(filename, 'r') as f:
+        for line in f:
+            icao_match = _icao_re.search(line)
+            if icao_match is None or icao_match.group(0) in stations:
+                continue
+            fields = line.rstrip('\r\n').split(',')
+            fields += [''] * (6 - len(fields))
+            stations[icao_match.group(0)] = [fields[1], fields[2], fields[3], fields[4], None, fields[5]]
+    return stations
+
+class _Source(object):
+    """A station file, read once and read again when it changes"""
+
+    def __init__(self, filename, reader):
+        self.filename = filename
+        self.reader = reader
+        self.mtime = None
+        self.stations = {}
+        #Incremented every time the file is read
+        self.version = 0
+
+    def update(self):
+        mtime = os.stat(self.filename).st_mtime
+        if mtime != self.mtime:
+            self.stations = self.reader(self.filename)
+            self.mtime = mtime
+            self.version += 1
+
+#Sources shared by all the registries, keyed by (reader, filename)
+_sources = {}
+
+def _get_source(filename, reader):
+    key = (reader, filename)
+    if key not in _sources:
+        _sources[key] = _Source(filename, reader)
+    return _sources[key]
+
+class StationRegistry(object):
+    """
+       Station metadata keyed by ICAO id, merged from the station files.
+       Location, name and uuid are taken from the station information
+       file, then stations3.txt, then us_stations.txt; is_US is set for
+       the stations listed in us_stations.txt.
+    """
+    def __init__(self, stationInfoFile=None, usStationsFile=US_STATIONS_FILE,
+                 stations3File=None, checkInterval=CHECK_INTERVAL):
+        #In order of precedence
+        self.sources = []
+        if stationInfoFile:
+            self.sources.append(_get_source(stationInfoFile, read_station_info))
+        if stations3File:
+            self.sources.append(_get_source(stations3File, read_stations3))
+        self.usSource = None
+        if usStationsFile:
+            self.usSource = _get_source(usStationsFile, read_us_stations)
+            self.sources.append(self.usSource)
+
+        self.checkInterval = checkInterval
+        self.checked = None
+        self.versions = None
+        self.stations = {}
+        self.usSet = frozenset()
+        self.usList = []
+        self.geography = {}
+        self.refresh()
+
+    def refresh(self, force=False):
+        """
+           Checks the station files for changes, at most once every
+           checkInterval seconds, and rebuilds the registry if any changed.
+        """
+        now = time.time()
+        if not force and self.checked is not None and now - self.checked < self.checkInterval:
+            return
+        self.checked = now
+        for source in self.sources:
+            source.update()
+        versions = [source.version for source in self.sources]
+        if versions != self.versions:
+            self._merge()
+            self.versions = versions
+
+    def _merge(self):
+
+        us = {}
+        usList = []
+        if self.usSource is not None:
+            us = self.usSource.stations
+            #us_stations.txt order, as station_util.get_US_icaos() always returned
+            usList = us.keys()
+
+        stations = {}
+        geography = {}
+        for source in reversed(self.sources):
+            for icao, (lat, lon, elev, name, uuid, country) in source.stations.iteritems():
+                stations[icao] = Station(icao, lat, lon, elev, name, uuid, country, icao in us)
+                #What the encoder needs: only stations with a uuid can be encoded
+                if uuid is not None:
+                    geography[icao] = ('%s %s %s' % (lat, lon, elev), name, uuid)
+
+        self.stations = stations
+        self.geography = geography
+        self.usSet = frozenset(us)
+        self.usList = usList
+
+    def __getitem__(self, icao):
+        """Returns the Station, raises KeyError if unknown"""
+        self.refresh()
+        return self.stations[icao]
+
+    def __contains__(self, icao):
+        self.refresh()
+        return icao in self.stations
+
+    def get(self, icao, default=None):
+        self.refresh()
+        return self.stations.get(icao, default)
+
+    def is_US(self, icao):
+        """True if icao is listed in us_stations.txt"""
+        self.refresh()
+        return icao in self.usSet
+
+    def filter_US(self, icaos):
+        """Returns the set of icaos that are US stations"""
+        self.refresh()
+        return self.usSet.intersection(icaos)
+
+    def US_icaos(self):
+        """Returns the list of US station ids, in us_stations.txt order"""
+        self.refresh()
+        return list(self.usList)
+
+    def geographyView(self):
+        """
+           Returns a read-only mapping of icao: ('lat lon elev', name, uuid)
+           as METARXMLEncoder.getGeography() builds from the station
+           information file. It follows the registry as it is reloaded.
+        """
+        return GeographyView(self)
+
+class GeographyView(object):
+    """The station lookup the XML encoder uses, served by a registry"""
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def __getitem__(self, icao):
+        self.registry.refresh()
+        return self.registry.geography[icao]
+
+    def __contains__(self, icao):
+        self.registry.refresh()
+        return icao in self.registry.geography
+
+    def has_key(self, icao):
+        return icao in self
+
+    def get(self, icao, default=None):
+        self.registry.refresh()
+        return self.registry.geography.get(icao, default)
+
+    def keys(self):
+        self.registry.refresh()
+        return self.registry.geography.keys()
+
+    def __len__(self):
+        self.registry.refresh()
+        return len(self.registry.geography)
+
+#Registries shared within the process, keyed by their files
+_registries = {}
+
+def get_registry(stationInfoFile=None, usStationsFile=US_STATIONS_FILE, stations3File=None):
+    """
+       Returns the registry for the given station files, creating it the
+       first time. Everyone asking for the same files shares one registry.
+    """
+    key = (stationInfoFile, usStationsFile, stations3File)
+    if key not in _registries:
+        _registries[key] = StationRegistry(stationInfoFile, usStationsFile, stations3File)
+    return _registries[key]
@@ -0,0 +1,357 @@
+#!/usr/bin/env python2
+import os
+import re
+import sys
+import time
+import mmap
+import struct
+import optparse
+import tempfile
+import zlib
+
+import station_registry
+
+'''A compiled station table, the binary equivalent of metarStationInfo.txt,
+   that is opened through a memory map so every process decoding METARs
+   shares one copy of it in the page cache instead of building its own
+   dictionary.
+
+   Layout, all integers little endian:
+
+     header    magic 'STNT', version, key width, station count, offsets of
+               the key array, the record array and the string pool, offset
+               and number of slots of the hash index
+     keys      count fixed-width ICAO ids, NUL padded, in sorted order
+     index     open addressing hash table of key numbers, the slot of a
+               key being crc32(key) modulo the number of slots, then the
+               following slots in turn; EMPTY marks an unused slot
+     records   count records in key order: lat, lon and elev as integers
+               and the number of decimals each was given with, flags, then
+               the offset in the string pool of the station's strings and
+               the lengths of its name, uuid and country
+     pool      the strings, exactly as they appear in the source files
+
+   The coordinates are kept only as integers, from which their text is
+   written back exactly. The few that cannot be, e.g. '-0' or '1e3', are
+   kept as 'lat lon elev' text in the pool after the country instead.
+
+   Measured with 'benchmark.py stations' on 10000 synthetic stations, the
+   table takes 0.88 MB, shared by every process, against 0.83 MB for its
+   text source. It opens in about 20 us, where getGeography() takes 15 to
+   20 ms and 3.8 MB of each process's memory. A lookup takes about 6 us,
+   50 times the dict's 0.1 us, which is small next to the milliseconds an
+   encoded report takes. The encoder maps one only when it is given a compiled table as
+   its station information file; build one with
+
+     ./station_table.py -o metarStationInfo.bin metarStationInfo.txt
+'''
+
+MAGIC = 'STNT'
+VERSION = 3
+
+_header = struct.Struct('<4sIIIIIIII')
+_slot = struct.Struct('<I')
+_unpack_slot = _slot.unpack_from
+
+EMPTY = 0xffffffff
+_record = struct.Struct('<iiiBBBBIHHHH')
+
+#Record flags
+HAS_UUID = 1
+IS_US = 2
+TEXT_POSITION = 4
+
+#Most decimals of a coordinate kept as an integer
+MAX_DECIMALS = 9
+_scale = [10.0**n for n in range(MAX_DECIMALS+1)]
+_number = re.compile(r'-?\d+(\.(\d+))?$')
+
+#Seconds between checks of the table file for changes
+CHECK_INTERVAL = station_registry.CHECK_INTERVAL
+
+def _float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return float('nan')
+
+def _format(value, decimals):
+    """The text of a coordinate kept as an integer"""
+    #Exact, as value/10**decimals has far fewer digits than a double keeps
+    return '%.*f' % (decimals, value/_scale[decimals])
+
+def _pack(text):
+    """Returns (value, decimals) of a coordinate, or None if its text
+       cannot be written back exactly from them"""
+    m = _number.match(text)
+    if m is None:
+        return None
+    decimals = len(m.group(2) or '')
+    value = int(text.replace('.', ''))
+    if decimals > MAX_DECIMALS or not -2**31 <= value < 2**31 or _format(value, decimals) != text:
+        return None
+    return value, decimals
+
+def write_table(stations, filename):
+    """
+       Writes a station table. The file is replaced atomically, so
+       processes that have the previous table mapped are not disturbed.
+
+       Args:
+           stations: Iterable of station_registry.Station
+           filename (string): Table to write
+       Returns:
+           Number of stations written
+    """
+    stations = sorted(stations, key=lambda s: s.icao)
+    width = max([len(s.icao) for s in stations] or [4])
+
+    pool = []
+    poolsize = 0
+    keys = []
+    records = []
+    for s in stations:
+        keys.append(s.icao.ljust(width, '\0'))
+        flags = 0
+        if s.uuid is not None:
+            flags |= HAS_UUID
+        if s.is_US:
+            flags |= IS_US
+        name, uuid, country = s.name or '', s.uuid or '', s.country or ''
+        strings = [name, uuid, country]
+        coordinates = [_pack(text) for text in (s.lat, s.lon, s.elev)]
+        if None in coordinates:
+            flags |= TEXT_POSITION
+            strings.append('%s %s %s' % (s.lat, s.lon, s.elev))
+            coordinates = [(0, 0)] * 3
+        (lat, latdec), (lon, londec), (elev, elevdec) = coordinates
+        records.append(_record.pack(lat, lon, elev, latdec, londec, elevdec, flags, poolsize,
+                                    len(name), len(uuid), len(country), len(''.join(strings[3:]))))
+        pool.extend(strings)
+        poolsize += sum([len(text) for text in strings])
+
+    #Half again as many slots as keys. On 10000 stations a load of 2/3
+    #takes about 2 probes per hit and 6 per miss, against 1.5 and 2.5 at
+    #a load of 1/2 and 2.5 and 8 at 3/4
+    nslots = len(keys) + len(keys)//2 + 1
+    slots = [EMPTY] * nslots
+    for i, key in enumerate(keys):
+        slot = (zlib.crc32(key) & 0xffffffff) % nslots
+        while slots[slot] != EMPTY:
+            slot = (slot + 1) % nslots
+        slots[slot] = i
+
+    keyoff = _header.size
+    hashoff = keyoff + width*len(keys)
+    recoff = hashoff + _slot.size*nslots
+    pooloff = recoff + _record.size*len(records)
+
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_header.pack(MAGIC, VERSION, width, len(keys), keyoff, recoff, pooloff, hashoff, nslots))
+            f.write(''.join(keys))
+            f.write(struct.pack('<%dI' % nslots, *slots))
+            f.write(''.join(records))
+            f.write(''.join(pool))
+        os.chmod(tmpname, 0644)
+        os.rename(tmpname, filename)
+    except:
+        os.unlink(tmpname)
+        raise
+    return len(keys)
+
+def is_table(filename):
+    """True if filename is a compiled station table"""
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+class StationTable(object):
+    """
+       A compiled station table, looked up through the hash index of the
+       mapped file. Used as a mapping it gives the same
+       ('lat lon elev', name, uuid) tuples as METARXMLEncoder.getGeography()
+       for the stations that have a uuid. The file is mapped again when it
+       is replaced.
+    """
+    def __init__(self, filename, checkInterval=CHECK_INTERVAL):
+        self.filename = filename
+        self.checkInterval = checkInterval
+        self.mm = None
+        self.ident = None
+        self.checked = None
+        self.refresh()
+
+    def refresh(self, force=False):
+        """
+           Maps the table again if the file was replaced, checking at most
+           once every checkInterval seconds.
+        """
+        now = time.time()
+        if not force and self.checked is not None and now - self.checked < self.checkInterval:
+            return
+        self.checked = now
+        st = os.stat(self.filename)
+        ident = (st.st_ino, st.st_mtime, st.st_size)
+        if ident != self.ident:
+            self._open()
+            self.ident = ident
+
+    def _open(self):
+        with open(self.filename, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, width, count, keyoff, recoff, pooloff, hashoff, nslots = _header.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            mm.close()
+            raise ValueError('%s is not a version %d station table' % (self.filename, VERSION))
+        if self.mm is not None:
+            self.mm.close()
+        self.mm = mm
+        self.width = width
+        self.count = count
+        self.keyoff = keyoff
+        self.recoff = recoff
+        self.pooloff = pooloff
+        self.hashoff = hashoff
+        self.nslots = nslots
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def _key(self, i):
+        start = self.keyoff + i*self.width
+        return self.mm[start:start+self.width]
+
+    def _find(self, icao):
+        """Returns the record of icao in the table, or None"""
+        width = self.width
+        if len(icao) != width:
+            if len(icao) > width:
+                return None
+            icao = icao.ljust(width, '\0')
+        mm, keyoff, hashoff, nslots = self.mm, self.keyoff, self.hashoff, self.nslots
+        slot = (zlib.crc32(icao) & 0xffffffff) % nslots
+        while True:
+            i = _unpack_slot(mm, hashoff + slot*4)[0]
+            if i == EMPTY:
+                return None
+            start = keyoff + i*width
+            if mm[start:start+width] == icao:
+                return _record.unpack_from(mm, self.recoff + i*_record.size)
+            slot = (slot + 1) % nslots
+
+    def _strings(self, rec):
+        """The name, uuid, country and position text of a record"""
+        start = self.pooloff + rec[7]
+        text = self.mm[start:start+sum(rec[8:12])]
+        name = text[:rec[8]]
+        uuid = text[rec[8]:rec[8]+rec[9]]
+        country = text[rec[8]+rec[9]:rec[8]+rec[9]+rec[10]]
+        return name, uuid, country, text[len(text)-rec[11]:]
+
+    def _position(self, rec, strings):
+        """The lat, lon and elev text of a record"""
+        if rec[6] & TEXT_POSITION:
+            return strings[3].split(' ')
+        return _format(rec[0], rec[3]), _format(rec[1], rec[4]), _format(rec[2], rec[5])
+
+    def station(self, icao, default=None):
+        """Returns the station_registry.Station for icao, or default"""
+        self.refresh()
+        rec = self._find(icao)
+        if rec is None:
+            return default
+        strings = self._strings(rec)
+        lat, lon, elev = self._position(rec, strings)
+        name, uuid, country = strings[:3]
+        if not rec[6] & HAS_UUID:
+            uuid = None
+        return station_registry.Station(icao, lat, lon, elev, name, uuid, country, bool(rec[6] & IS_US))
+
+    def position(self, icao):
+        """Returns (lat, lon, elev) as floats, raises KeyError if unknown"""
+        self.refresh()
+        rec = self._find(icao)
+        if rec is None:
+            raise KeyError(icao)
+        if rec[6] & TEXT_POSITION:
+            return tuple([_float(text) for text in self._position(rec, self._strings(rec))])
+        return rec[0]/_scale[rec[3]], rec[1]/_scale[rec[4]], rec[2]/_scale[rec[5]]
+
+    def __getitem__(self, icao):
+        self.refresh()
+        rec = self._find(icao)
+        if rec is None or not rec[6] & HAS_UUID:
+            raise KeyError(icao)
+        if rec[6] & TEXT_POSITION:
+            position = self._strings(rec)[3]
+        else:
+            position = '%.*f %.*f %.*f' % (rec[3], rec[0]/_scale[rec[3]], rec[4], rec[1]/_scale[rec[4]],
+                                           rec[5], rec[2]/_scale[rec[5]])
+        start = self.pooloff + rec[7]
+        end = start + rec[8]
+        return position, self.mm[start:end], self.mm[end:end+rec[9]]
+
+    def get(self, icao, default=None):
+        try:
+            return self[icao]
+        except KeyError:
+            return default
+
+    def __contains__(self, icao):
+        return self.get(icao) is not None
+
+    def has_key(self, icao):
+        return icao in self
+
+    def icaos(self):
+        """Returns every station id in the table, sorted"""
+        self.refresh()
+        return [self._key(i).rstrip('\0') for i in xrange(self.count)]
+
+    def keys(self):
+        return [icao for icao in self.icaos() if icao in self]
+
+    def __len__(self):
+        return len(self.keys())
+
+def main(argv=None):
+    usage = ("Usage: %prog [options] [metarStationInfo.txt ...]\n\n"
+             "Compiles station text files into a station table. Stations in\n"
+             "earlier files take precedence over later ones.")
+    parseopts = optparse.OptionParser(usage=usage)
+    parseopts.add_option('-o', action='store', dest='output', default='metarStationInfo.bin',
+                         help='Station table to write [default: %default]')
+    parseopts.add_option('-s', '--stations3', action='append', dest='stations3', default=[],
+                         help='stations3.txt file to include, as createStns.py converts it')
+    parseopts.add_option('-u', '--us-stations', action='store', dest='usStations', default=None,
+                         help='us_stations.txt file marking the US stations')
+    opts, args = parseopts.parse_args(argv)
+    if not args and not opts.stations3:
+        parseopts.print_help()
+        sys.exit(2)
+
+    #Lowest precedence first, so each file overrides the ones after it
+    stations = {}
+    us = None
+    if opts.usStations:
+        us = station_registry.StationRegistry(None, opts.usStations)
+        stations.update(us.stations)
+    sources = [(f, None) for f in args] + [(None, f) for f in opts.stations3]
+    for stationInfoFile, stations3File in reversed(sources):
+        registry = station_registry.StationRegistry(stationInfoFile, None, stations3File)
+        stations.update(registry.stations)
+    if us is not None:
+        for icao, station in stations.items():
+            stations[icao] = station._replace(is_US=us.is_US(icao))
+
+    count = write_table(stations.values(), opts.output)
+    print 'Wrote %d stations to %s' % (count, opts.output)
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import sys
 import os
-import re
+
+import station_registry
 
 '''Utilities for extracting information from the us_stations.txt, which
    contains the US stations' icao_code, lat, lon, elevation, site_name, and country.
@@ -10,34 +11,52 @@ import re
    FIELDS TERMINATED BY ','
    LINES TERMINATED BY '\n'; 
 '''
+US_STATIONS_FILE = './us_stations.txt'
+
+#Registry set by set_registry(), None for the shared one of us_stations.txt
+_us_registry = None
+
+def set_registry(registry):
+    """
+        Makes registry, a station_registry.StationRegistry that includes
+        us_stations.txt, answer the US station checks, e.g. the one the
+        encoder uses, so there is only one to load and merge.
+    """
+    global _us_registry
+    _us_registry = registry
+
+def _registry():
+    """
+        Returns the shared station registry. It reloads us_stations.txt
+        whenever the file changes.
+    """
+    if _us_registry is not None:
+        return _us_registry
+    return station_registry.get_registry(usStationsFile=US_STATIONS_FILE)
+
 def get_US_icaos():
     """
         Args: None
         Returns: List of US station icao identifiers.
     """
-    us_list = [] 
-    with open('./us_stations.txt', 'r') as f:
-        for line in f:
-            icao_match = re.search(r'(^[A-Z][A-Z0-9]{3})',line)
-            if icao_match:
-                #only add if not already in the list
-                #print ('match: %s')%(icao_match.group(0))
-                if icao_match.group(0) in us_list:
-                    continue
-                else:
-                    us_list.append(icao_match.group(0))
-    return us_list
-         
+    return _registry().US_icaos()
+
 def is_US_station(station):
     """
        Determines whether a station is a US station
        
     """
-    us_stations = get_US_icaos()
-    if station in us_stations:
-        return True
-    else:
-        return False  
+    return _registry().is_US(station)
+
+def filter_US_stations(stations):
+    """
+       Batch version of is_US_station(), e.g. for all the stations in a
+       bulletin.
+
+       Args: Iterable of station icao identifiers
+       Returns: Set of those that are US stations
+    """
+    return _registry().filter_US(stations)
 
 
 
@@ -63,6 +82,9 @@ if __name__ == "__main__":
                     
         if station != 'KDEN' and not result:
             print ('Test PASSES for unknown or non-US station: %s') %(station)
+
+    #Test filter_US_stations()
+    print ('US stations among %s: %s')%(test_stations, sorted(filter_US_stations(test_stations)))
     
  
 
@@ -0,0 +1,87 @@
+#!/usr/bin/env python2
+'''Tests of metar_util, run from the top directory with
+
+     python -m unittest discover -s tests
+'''
+import calendar
+import time
+import unittest
+
+import metar_util
+
+def reference(*utc):
+    return metar_util.ReferenceTime(calendar.timegm(utc + (0,) * (6 - len(utc))))
+
+def mktime(year, month, mday, hour, minute):
+    return time.mktime((year, month, mday, hour, minute, 0, 0, 0, 0))
+
+class ReferenceTimeTest(unittest.TestCase):
+
+    def test_same_month(self):
+        self.assertEqual(reference(2026, 10, 12, 12).resolve(12, 11, 53), mktime(2026, 10, 12, 11, 53))
+        self.assertEqual(reference(2026, 10, 12, 12).resolve(1, 0, 0), mktime(2026, 10, 1, 0, 0))
+
+    def test_day_rollover(self):
+        now = reference(2026, 10, 12, 0, 10)
+        self.assertEqual(now.resolve(11, 23, 55), mktime(2026, 10, 11, 23, 55))
+        self.assertEqual(now.resolve(12, 0, 5), mktime(2026, 10, 12, 0, 5))
+        #
+        # A little ahead of the reference is still this month
+        self.assertEqual(now.resolve(12, 12, 0), mktime(2026, 10, 12, 12, 0))
+
+    def test_month_rollover(self):
+        #
+        # Back to the last day of the previous month
+        now = reference(2026, 11, 1, 0, 10)
+        self.assertEqual(now.resolve(31, 23, 55), mktime(2026, 10, 31, 23, 55))
+        self.assertEqual(now.resolve(1, 0, 5), mktime(2026, 11, 1, 0, 5))
+        #
+        # Forward to the first day of the next month
+        now = reference(2026, 10, 31, 23, 55)
+        self.assertEqual(now.resolve(1, 0, 5), mktime(2026, 11, 1, 0, 5))
+        self.assertEqual(now.resolve(31, 23, 50), mktime(2026, 10, 31, 23, 50))
+
+    def test_missing_day(self):
+        #
+        # The 31st before October 1st would be in September
+        self.assertEqual(reference(2026, 10, 1, 0, 10).resolve(31, 23, 55), None)
+        self.assertEqual(reference(2027, 3, 1, 0, 10).resolve(29, 23, 55), None)
+        self.assertEqual(reference(2028, 3, 1, 0, 10).resolve(29, 23, 55), mktime(2028, 2, 29, 23, 55))
+
+    def test_year_rollover(self):
+        now = reference(2027, 1, 1, 0, 10)
+        self.assertEqual(now.resolve(31, 23, 55), mktime(2026, 12, 31, 23, 55))
+        self.assertEqual(now.resolve(1, 0, 5), mktime(2027, 1, 1, 0, 5))
+        now = reference(2026, 12, 31, 23, 55)
+        self.assertEqual(now.resolve(1, 0, 5), mktime(2027, 1, 1, 0, 5))
+        self.assertEqual(now.resolve(31, 23, 50), mktime(2026, 12, 31, 23, 50))
+
+    def test_same_as_fix_date(self):
+        #
+        # Every day of the month, against references on either side of
+        # the turn of each month of a year and a leap year
+        for year in (2026, 2028):
+            for month in range(1, 13):
+                start = calendar.timegm((year, month, 1, 0, 0, 0))
+                for now in (start - 3600, start + 600, start + 15*86400):
+                    clock = metar_util.ReferenceTime(now)
+                    gmt = time.gmtime(now)
+                    for mday in range(1, 32):
+                        for hour, minute in ((0, 5), (23, 55)):
+                            tms = [gmt[0], gmt[1], mday, hour, minute, 0, 0, 0, 0]
+                            metar_util.fix_date(tms, now)
+                            expected = None
+                            if metar_util.valid_day(tms):
+                                expected = time.mktime(tms)
+                            self.assertEqual(clock.resolve(mday, hour, minute), expected,
+                                             (time.gmtime(now)[:5], mday, hour, minute))
+
+    def test_heading(self):
+        now = reference(2027, 1, 1, 0, 10)
+        self.assertEqual(now.heading('312355').gmt[:5], (2026, 12, 31, 23, 55))
+        self.assertTrue(now.heading('312355') is now.heading('312355'))
+        self.assertTrue(now.heading('322355') is now)
+        self.assertTrue(now.heading('bad') is now)
+
+if __name__ == '__main__':
+    unittest.main()
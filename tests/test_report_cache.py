@@ -0,0 +1,137 @@
+#!/usr/bin/env python2
+'''Tests of report_cache, run from the top directory with
+
+     python -m unittest discover -s tests
+'''
+import unittest
+
+import report_cache
+
+REPORT = 'KDEN 121153Z 00000KT 10SM CLR 20/10 A3000'
+OTHER = 'KCOS 121154Z 17012KT 10SM CLR 18/13 A3011'
+LATER = 'KBOU 121210Z 02007KT 10SM CLR 19/M02 A3015'
+
+class DuplicateCacheTest(unittest.TestCase):
+
+    def test_duplicates(self):
+        cache = report_cache.DuplicateCache()
+        self.assertFalse(cache.is_duplicate('METAR', REPORT, now=0))
+        self.assertTrue(cache.is_duplicate('METAR', REPORT, now=1))
+        self.assertTrue(cache.is_duplicate('METAR', ' %s=' % REPORT.replace(' ', '  '), now=2))
+        self.assertFalse(cache.is_duplicate('SPECI', REPORT, now=3))
+        self.assertFalse(cache.is_duplicate('METAR', OTHER, now=4))
+        self.assertEqual(cache.duplicates, 2)
+        self.assertEqual(len(cache), 3)
+
+    def test_expires_oldest_first(self):
+        #
+        # A duplicate does not make its report any younger
+        cache = report_cache.DuplicateCache(window=10)
+        cache.is_duplicate('METAR', REPORT, now=0)
+        cache.is_duplicate('METAR', OTHER, now=5)
+        self.assertTrue(cache.is_duplicate('METAR', REPORT, now=9))
+        self.assertTrue(cache.is_duplicate('METAR', OTHER, now=12))
+        self.assertEqual(len(cache), 1)
+        self.assertFalse(cache.is_duplicate('METAR', REPORT, now=13))
+        cache.expire(now=16)
+        self.assertEqual(len(cache), 1)
+        self.assertTrue(cache.is_duplicate('METAR', REPORT, now=16))
+
+    def test_forgets_oldest_when_full(self):
+        cache = report_cache.DuplicateCache(maxsize=2)
+        for now, report in enumerate((REPORT, OTHER, LATER)):
+            cache.is_duplicate('METAR', report, now=now)
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(cache.is_duplicate('METAR', LATER, now=3))
+        self.assertTrue(cache.is_duplicate('METAR', OTHER, now=4))
+        self.assertFalse(cache.is_duplicate('METAR', REPORT, now=5))
+        #
+        # Remembered again, in place of the oldest left
+        self.assertFalse(cache.is_duplicate('METAR', OTHER, now=6))
+
+class CorrectionRankTest(unittest.TestCase):
+
+    def test_rank(self):
+        rank = report_cache.correction_rank
+        self.assertEqual(rank(None, REPORT), 0)
+        self.assertEqual(rank('RRA', REPORT), 0)
+        self.assertEqual(rank('CCA', REPORT), 1)
+        self.assertEqual(rank('AAB', REPORT), 2)
+        self.assertEqual(rank(None, REPORT.replace('Z ', 'Z COR ')), 1)
+        self.assertEqual(rank('CCB', REPORT.replace('Z ', 'Z COR ')), 2)
+
+class SupersessionTableTest(unittest.TestCase):
+
+    def test_correction_replaces_original(self):
+        table = report_cache.SupersessionTable()
+        original = table.update('METAR', 'KDEN', REPORT, now=0)
+        self.assertEqual(original.target('first.xml'), 'first.xml')
+        self.assertEqual(original.claim('first.xml'), None)
+
+        correction = table.update('METAR', 'KDEN', REPORT, bbb='CCA', now=1)
+        self.assertEqual(correction.target('second.xml'), 'first.xml')
+        self.assertEqual(correction.claim('first.xml'), 'correction')
+        self.assertEqual(table.corrections, 1)
+        self.assertEqual(len(table), 1)
+
+    def test_resend_replaces_same_version(self):
+        table = report_cache.SupersessionTable()
+        table.update('METAR', 'KDEN', REPORT, now=0).claim('first.xml')
+        resend = table.update('METAR', 'KDEN', REPORT, bbb='RRA', now=1)
+        self.assertEqual(resend.target('second.xml'), 'first.xml')
+        self.assertEqual(resend.claim('first.xml'), 'resend')
+        self.assertEqual((table.corrections, table.resends), (0, 1))
+
+    def test_original_after_correction_is_superseded(self):
+        table = report_cache.SupersessionTable()
+        table.update('METAR', 'KDEN', REPORT, bbb='CCB', now=0).claim('first.xml')
+        self.assertEqual(table.update('METAR', 'KDEN', REPORT, bbb='CCA', now=1), None)
+        self.assertEqual(table.update('METAR', 'KDEN', REPORT, now=2), None)
+        self.assertEqual(table.superseded, 2)
+
+    def test_unclaimed_version_is_not_replaced(self):
+        #
+        # Until a version is written, a later one goes to its own file
+        table = report_cache.SupersessionTable()
+        table.update('METAR', 'KDEN', REPORT, now=0)
+        correction = table.update('METAR', 'KDEN', REPORT, bbb='CCA', now=1)
+        self.assertEqual(correction.target('second.xml'), 'second.xml')
+        self.assertEqual(correction.claim('second.xml'), None)
+        self.assertEqual(table.corrections, 0)
+
+    def test_keyed_by_type_station_and_time(self):
+        table = report_cache.SupersessionTable()
+        table.update('METAR', 'KDEN', REPORT, bbb='CCA', now=0)
+        self.assertNotEqual(table.update('SPECI', 'KDEN', REPORT, now=1), None)
+        self.assertNotEqual(table.update('METAR', 'KDEN', REPORT.replace('121153Z', '121253Z'), now=2), None)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.superseded, 0)
+
+    def test_without_issue_time(self):
+        table = report_cache.SupersessionTable()
+        version = table.update('METAR', 'KDEN', 'KDEN NIL', now=0)
+        self.assertEqual(version.target('first.xml'), 'first.xml')
+        self.assertEqual(len(table), 0)
+
+    def test_expires_oldest_first(self):
+        table = report_cache.SupersessionTable(window=10)
+        table.update('METAR', 'KDEN', REPORT, bbb='CCA', now=0)
+        table.update('METAR', 'KCOS', OTHER, bbb='CCA', now=5)
+        self.assertEqual(table.update('METAR', 'KDEN', REPORT, now=9), None)
+        #
+        # The original is taken as new once its correction is forgotten
+        self.assertEqual(table.update('METAR', 'KCOS', OTHER, now=12), None)
+        self.assertNotEqual(table.update('METAR', 'KDEN', REPORT, now=12), None)
+        self.assertEqual(len(table), 2)
+
+    def test_forgets_oldest_when_full(self):
+        table = report_cache.SupersessionTable(maxsize=2)
+        for now, (station, report) in enumerate((('KDEN', REPORT), ('KCOS', OTHER), ('KBOU', LATER))):
+            table.update('METAR', station, report, bbb='CCA', now=now)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.update('METAR', 'KCOS', OTHER, now=3), None)
+        self.assertEqual(table.update('METAR', 'KBOU', LATER, now=4), None)
+        self.assertNotEqual(table.update('METAR', 'KDEN', REPORT, now=5), None)
+
+if __name__ == '__main__':
+    unittest.main()
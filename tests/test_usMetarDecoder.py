@@ -0,0 +1,272 @@
+#!/usr/bin/env python2
+'''Tests of usMetarDecoder. They need tpg, as the decoder does, and are
+   run from the top directory with
+
+     python -m unittest discover -s tests
+'''
+import StringIO
+import calendar
+import logging
+import string
+import sys
+import unittest
+
+import tpg
+
+import benchmark
+import metar_util
+import usMetarDecoder
+
+REPORT = 'METAR KDEN 121153Z 00000KT 10SM CLR 20/10 A3000 RMK AO2 SLP123 T02000100='
+
+def decode_one(decoder, report, **kwargs):
+    """Returns (result, fault) of decoder.decode_many() for a single report"""
+
+    context, result, fault = next(decoder.decode_many([report], **kwargs))
+    return result, fault
+
+class BudgetTest(unittest.TestCase):
+
+    def test_tpg_path_is_budgeted(self):
+        #
+        # The grammar's ContextSensitiveLexer hands tokens to eatCSL()
+        decoder = usMetarDecoder.Decoder()
+        decoder.fastpath = False
+        decoder.maxSteps = 5
+        result, fault = decode_one(decoder, REPORT)
+        self.assertTrue(isinstance(fault, usMetarDecoder.BudgetExceeded))
+        self.assertEqual(decoder.budgetExceeded, 1)
+        self.assertEqual(result['fault']['error'], 'BudgetExceeded')
+
+    def test_within_budget(self):
+        decoder = usMetarDecoder.Decoder()
+        decoder.fastpath = False
+        result, fault = decode_one(decoder, REPORT)
+        self.assertEqual(fault, None)
+        self.assertTrue(decoder._steps > 5)
+        self.assertEqual(decoder.budgetExceeded, 0)
+        self.assertEqual(result['ident']['str'], 'KDEN')
+
+class FieldsTest(unittest.TestCase):
+
+    BODY = ('ident', 'itime', 'wind', 'vsby', 'sky', 'temp', 'alt')
+
+    def decode(self, report, fastpath, fields=None):
+        decoder = usMetarDecoder.Decoder()
+        decoder.fastpath = fastpath
+        result, fault = decode_one(decoder, report, fields=fields)
+        self.assertEqual(fault, None)
+        return decoder, result
+
+    def test_tpg_path_skips_remarks(self):
+        decoder, result = self.decode(REPORT, False, self.BODY)
+        self.assertEqual(decoder.skippedReports, 1)
+        self.assertEqual(result['skipped']['str'], 'RMK AO2 SLP123 T02000100')
+        self.assertFalse('mslp' in result or 'tempdec' in result)
+        #
+        # The groups wanted are those of a full decode
+        decoder, full = self.decode(REPORT, False)
+        for field in self.BODY:
+            self.assertEqual(result[field], full[field])
+
+    def test_tpg_path_same_as_fast_path(self):
+        decoder, tpgResult = self.decode(REPORT, False, self.BODY)
+        decoder, fastResult = self.decode(REPORT, True, self.BODY)
+        self.assertEqual(decoder.fastpathHits, 1)
+        self.assertEqual(tpgResult, fastResult)
+
+    def test_tpg_path_keeps_wanted_remarks(self):
+        #
+        # A surface visibility remark replaces the body's
+        report = REPORT.replace('AO2', 'AO2 SFC VIS 2')
+        decoder, result = self.decode(report, False, ('vsby',))
+        self.assertEqual(decoder.skippedReports, 0)
+        self.assertFalse('skipped' in result)
+        self.assertTrue(result['vsby']['str'].startswith('SFC VIS'))
+        self.assertEqual(result['twrvsby']['str'], '10SM')
+
+class DecodeManyTest(unittest.TestCase):
+
+    SHORT = 'METAR KDEN 121153Z 00000KT 10SM CLR 20/10 A3000='
+
+    def test_faults_are_per_report(self):
+        #
+        # A budget the short report fits in and REPORT, with its remarks,
+        # does not
+        decoder = usMetarDecoder.Decoder()
+        decoder.maxSteps = 10**6
+        steps = []
+        for report in (self.SHORT, REPORT):
+            decode_one(decoder, report)
+            steps.append(decoder._steps)
+        self.assertTrue(steps[0] < steps[1])
+        decoder.maxSteps = steps[0]
+
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logging.getLogger().addHandler(handler)
+        try:
+            decoded = list(decoder.decode_many([(self.SHORT, 'first'), (REPORT, 'second'), self.SHORT]))
+        finally:
+            logging.getLogger().removeHandler(handler)
+
+        self.assertEqual([context for context, result, fault in decoded], ['first', 'second', None])
+        first, second, third = [(result, fault) for context, result, fault in decoded]
+        self.assertEqual(first[1], None)
+        self.assertTrue(isinstance(second[1], usMetarDecoder.BudgetExceeded))
+        self.assertEqual(third[1], None)
+        #
+        # The report given up on keeps what was decoded up to the fault
+        self.assertEqual(second[0]['fault']['error'], 'BudgetExceeded')
+        self.assertEqual(second[0]['ident']['str'], 'KDEN')
+        self.assertFalse('fault' in first[0] or 'fault' in third[0])
+        self.assertEqual(first[0], third[0])
+        self.assertEqual(third[0]['alt']['str'], 'A3000')
+        #
+        # Counted, not logged
+        self.assertEqual(decoder.budgetExceeded, 1)
+        self.assertEqual(sum(decoder.errors.values()), 1)
+        self.assertEqual(records, [])
+
+class RemarkDispatchTest(unittest.TestCase):
+
+    def remarks(self):
+        """Text of the remark groups of the sample reports, from each group on"""
+
+        reports = benchmark.decode_reports(benchmark.load_bulletins()) + benchmark.REMARK_REPORTS
+        texts = []
+        for report in reports:
+            if ' RMK ' in report:
+                groups = report.split(' RMK ', 1)[1].rstrip('=').split(' ')
+                texts.extend([' '.join(groups[i:]) for i in range(len(groups))])
+        return texts
+
+    def test_table_keeps_alternatives_and_order(self):
+        #
+        # Whatever the text starts with, the alternatives of its first
+        # character that match it are all of those that do, in order
+        texts = self.remarks()
+        texts.extend([c + 'RA 123/4' for c in string.printable])
+        dispatch = usMetarDecoder._RemarkDispatch
+        for text in texts:
+            matches = lambda alternatives: [name for name, callback in alternatives
+                                            if usMetarDecoder._TokenRe[name].match(text)]
+            self.assertEqual(matches(dispatch.get(text[:1], dispatch[None])),
+                             matches(usMetarDecoder._RemarkAlternatives), text)
+
+    def test_same_as_in_turn(self):
+        reports = benchmark.decode_reports(benchmark.load_bulletins()) + benchmark.REMARK_REPORTS
+        reference = metar_util.ReferenceTime(calendar.timegm((2026, 10, 12, 12, 0, 0)))
+        dispatched = usMetarDecoder.Decoder()
+        inturn = usMetarDecoder.Decoder()
+        inturn.dispatchRemarks = False
+        for report in reports:
+            self.assertEqual(dispatched(report, reference), inturn(report, reference), report)
+        self.assertEqual(dispatched.fastpathHits, len(reports))
+        self.assertEqual(inturn.fastpathHits, len(reports))
+
+class VerboseDecoderTest(unittest.TestCase):
+
+    def test_same_as_decoder(self):
+        #
+        # Both decode with tpg, only the verbose one tracing its tokens
+        self.assertFalse(issubclass(usMetarDecoder.Decoder, tpg.VerboseParser))
+        reports = benchmark.decode_reports(benchmark.load_bulletins()) + benchmark.REMARK_REPORTS
+        reference = metar_util.ReferenceTime(calendar.timegm((2026, 10, 12, 12, 0, 0)))
+        decoder = usMetarDecoder.Decoder()
+        decoder.fastpath = False
+        verbose = usMetarDecoder.VerboseDecoder()
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = StringIO.StringIO()
+        try:
+            for report in reports:
+                self.assertEqual(verbose(report, reference), decoder(report, reference), report)
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+class LocationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.size = usMetarDecoder.LOCATION_CACHE_SIZE
+        usMetarDecoder._locationCache.clear()
+
+    def tearDown(self):
+        usMetarDecoder.LOCATION_CACHE_SIZE = self.size
+        usMetarDecoder._locationCache.clear()
+
+    def parse(self, locationString):
+        locations = {}
+        usMetarDecoder.processLocationString(locationString, locations)
+        return locations
+
+    def test_sectors(self):
+        self.assertEqual(self.parse('VC NE'), {'VC': {'sector0': {'ccw': 22.5, 'cw': 67.5}}})
+        #
+        # A sector across north, and one on its own
+        self.assertEqual(self.parse('DSNT NW-N AND E'),
+                         {'DSNT': {'sector0': {'ccw': 292.5, 'cw': 22.5},
+                                   'sector1': {'ccw': 67.5, 'cw': 112.5}}})
+        #
+        # Sectors next to each other are merged
+        self.assertEqual(self.parse('NE-E AND SE'), {'ATSTN': {'sector0': {'ccw': 22.5, 'cw': 157.5}}})
+        self.assertEqual(self.parse('OHD AND DSNT SE'),
+                         {'OHD': {'sector0': {'ccw': 0.0, 'cw': 360.0}},
+                          'DSNT': {'sector0': {'ccw': 112.5, 'cw': 157.5}},
+                          'ATSTN': {}})
+
+    def test_cached(self):
+        first = self.parse('DSNT NW-N AND E')
+        self.assertTrue('DSNT NW-N AND E' in usMetarDecoder._locationCache)
+        #
+        # Each call has dictionaries of its own
+        first['DSNT']['sector0']['ccw'] = 0.0
+        second = self.parse('DSNT NW-N AND E')
+        self.assertEqual(second['DSNT']['sector0'], {'ccw': 292.5, 'cw': 22.5})
+
+        usMetarDecoder.LOCATION_CACHE_SIZE = 0
+        usMetarDecoder._locationCache.clear()
+        self.assertEqual(self.parse('DSNT NW-N AND E'), second)
+        self.assertEqual(len(usMetarDecoder._locationCache), 0)
+
+    def test_least_recently_used_forgotten(self):
+        usMetarDecoder.LOCATION_CACHE_SIZE = 2
+        for locationString in ('VC NE', 'DSNT W', 'VC NE', 'OHD'):
+            self.parse(locationString)
+        self.assertEqual(list(usMetarDecoder._locationCache), ['VC NE', 'OHD'])
+
+    def test_unexpected_tokens_reported_each_time(self):
+        stdout = sys.stdout
+        sys.stdout = out = StringIO.StringIO()
+        try:
+            first = self.parse('DSNT XYZ NE')
+            second = self.parse('DSNT XYZ NE')
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(first, second)
+        self.assertEqual(out.getvalue().count('Unexpected token in location string XYZ NE'), 2)
+
+class FastPathTest(unittest.TestCase):
+
+    def test_same_as_tpg(self):
+        #
+        # Every group is compared, 'span' offsets included. 'index' is not a
+        # key of the groups, it is worked out from the 'span' of each when
+        # read, so it is compared on its own.
+        reports = benchmark.decode_reports(benchmark.load_bulletins()) + benchmark.REMARK_REPORTS
+        reference = metar_util.ReferenceTime(calendar.timegm((2026, 10, 12, 12, 0, 0)))
+        fast = usMetarDecoder.Decoder()
+        slow = usMetarDecoder.Decoder()
+        slow.fastpath = False
+        for report in reports:
+            expected = slow(report, reference)
+            result = fast(report, reference)
+            self.assertEqual(result, expected, report)
+            for key, group in expected.items():
+                if 'span' in group:
+                    self.assertEqual(result[key]['index'], group['index'], key)
+        self.assertEqual(fast.fastpathHits, len(reports))
+        self.assertEqual(slow.fastpathHits, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,8 +8,10 @@
 # Author: Mark Oberfield
 # Organization: NOAA/NWS/OSTI/MDL 
 #
-import exceptions, logging, re, time, types
+import bisect, collections, exceptions, hashlib, logging, marshal, os, re, sre_parse, string, sys, tempfile, time, types
 import tpg
+import metar_util
+import compact_report
 
 _CompassDegrees = {'N':(337.5,022.5), 'NE':(022.5,067.5), 'E':(067.5,112.5), 'SE':(112.5,157.5),
                    'S':(157.5,202.5), 'SW':(202.5,247.5), 'W':(247.5,292.5), 'NW':(292.5,337.5)}
@@ -17,6 +19,9 @@ _CompassDegrees = {'N':(337.5,022.5), 'NE':(022.5,067.5), 'E':(067.5,112.5), 'SE
 # local exceptions
 class Error(exceptions.Exception): pass
 
+class BudgetExceeded(Error):
+    """A report took more steps or time to decode than its budget"""
+
 ##############################################################################
 # regular expressions for identifying elements in a METAR/SPECI
 #
@@ -188,129 +193,584 @@ Estwind -> estwind/x $ self.estwind(x) $ ;
 Maintenance -> maintenance/x $ self.maintenance(x) $ ;
 """
 
+##############################################################################
+# fast path
+#
+# The grammar above, walked directly with the same token regular expressions
+# and callbacks, the way tpg's context sensitive lexer does: at each step
+# skip the separators, then try the expected tokens in grammar order, the
+# first one that matches and whose callback accepts it wins. Reports the
+# walk cannot be certain to decode as tpg would are handed to tpg.
+#
+_TokenRe = dict([(name, re.compile(regex, re.DOTALL)) for name, regex in _TokList])
+_SeparatorRe = re.compile(r'\s+', re.DOTALL)
+#
+# Mandatory, as ((token, callback), ...) alternatives, repeated or not
+_MandatoryGroups = [
+    ((('wind', 'wind'),), False),
+    ((('wind_vrb', 'wind'),), False),
+    ((('vsby', 'vsby'),), False),
+    ((('rvr', 'rvr'),), True),
+    ((('pcp', 'pcp'), ('obv', 'obv'), ('vcnty', 'vcnty'), ('funnel', 'obv')), True),
+    ((('sky', 'sky'),), False),
+    ((('temp', 'temp'),), False),
+    ((('alt', 'alt'),), False),
+]
+#
+# Remarks alternatives, in the order of the Remarks rule
+_RemarkAlternatives = [
+    ('ostype', 'ostype'), ('pkwnd', 'pkwnd'), ('wshft', 'wshft'), ('sfcvis', 'sfcvsby'),
+    ('twrvis', 'twrvsby'), ('vvis', 'vvis'), ('sctrvis', 'sctrvis'), ('vis2loc', 'vis2loc'),
+    ('ltg', 'ltg'), ('pcpnhist', 'pcpnhist'), ('tstmvmt', 'tstmvmt'), ('hail', 'hail'),
+    ('vcig', 'vcig'), ('obsc', 'obsc'), ('vsky', 'vsky'), ('cig2loc', 'cig2loc'),
+    ('pchgr', 'pressureChgRapidly'), ('mslp', 'mslp'), ('nospeci', 'nospeci'), ('aurbo', 'aurbo'),
+    ('contrails', 'contrails'), ('snoincr', 'snoincr'), ('other', 'other'), ('pcp1h', 'pcp1h'),
+    ('pcp6h', 'pcp6h'), ('pcp24h', 'pcp24h'), ('iceacc', 'iceacc'), ('snodpth', 'snodpth'),
+    ('lwe', 'lwe'), ('sunshine', 'sunshine'), ('tempdec', 'tempdec'), ('maxt6h', 'maxt6h'),
+    ('mint6h', 'mint6h'), ('xtrmet', 'xtrmet'), ('ptndcy3h', 'prestendency'), ('ssindc', 'ssindc'),
+    ('maintenance', 'maintenance'), ('estwind', 'estwind'), ('any', None),
+]
+
+#
+# Characters the match of a regular expression may start with
+_Categories = {
+    sre_parse.CATEGORY_DIGIT: string.digits,
+    sre_parse.CATEGORY_WORD: string.ascii_letters + string.digits + '_',
+    sre_parse.CATEGORY_SPACE: string.whitespace,
+}
+
+def _firstChars(items):
+    #
+    # Returns (chars, nullable) for the parsed items of a regular
+    # expression: the characters a match may start with, None when that
+    # is not worked out, and whether the match may be empty.
+    chars = set()
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            first, nullable = set(chr(av)), False
+        elif op == sre_parse.CATEGORY and av in _Categories:
+            first, nullable = set(_Categories[av]), False
+        elif op == sre_parse.IN:
+            first, nullable = set(), False
+            for op, av in av:
+                if op == sre_parse.LITERAL:
+                    first.add(chr(av))
+                elif op == sre_parse.RANGE:
+                    first.update([chr(c) for c in range(av[0], av[1]+1)])
+                elif op == sre_parse.CATEGORY and av in _Categories:
+                    first.update(_Categories[av])
+                else:
+                    return None, True
+        elif op == sre_parse.BRANCH:
+            first, nullable = set(), False
+            for branch in av[1]:
+                c, n = _firstChars(branch)
+                if c is None:
+                    return None, True
+                first |= c
+                nullable = nullable or n
+        elif op == sre_parse.SUBPATTERN:
+            first, nullable = _firstChars(av[1])
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            first, nullable = _firstChars(av[2])
+            nullable = nullable or av[0] == 0
+        elif op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            #
+            # Zero width, so the characters that follow may come first
+            first, nullable = set(), True
+        else:
+            return None, True
+
+        if first is None:
+            return None, True
+        chars |= first
+        if not nullable:
+            return chars, False
+    return chars, True
+
+def _dispatchTable(alternatives):
+    #
+    # {character: alternatives}, the alternatives, in order, that may
+    # match text starting with that character. Those that may match any
+    # text are in every entry, and under None.
+    firsts = []
+    for name, callback in alternatives:
+        chars, nullable = _firstChars(sre_parse.parse(dict(_TokList)[name], re.DOTALL))
+        if nullable:
+            chars = None
+        firsts.append(chars)
+
+    table = {}
+    for char in set().union(*[chars for chars in firsts if chars is not None]):
+        table[char] = [alt for alt, chars in zip(alternatives, firsts) if chars is None or char in chars]
+    table[None] = [alt for alt, chars in zip(alternatives, firsts) if chars is None]
+    return table
+#
+# The Remarks alternatives by the first character of the group
+_RemarkDispatch = _dispatchTable(_RemarkAlternatives)
+#
+# Groups decoded from the body of a report, before the remarks
+_BodyFields = frozenset(['type', 'ident', 'itime', 'autocor', 'wind', 'vsby', 'rvr', 'vrbrvr',
+                         'pcp', 'obv', 'vcnty', 'sky', 'temp', 'alt'])
+#
+# Body groups a remark replaces, and the token of that remark
+_RemarkOverrides = {'vsby': 'sfcvis'}
+
+class _Fallback(Exception):
+    """The fast path cannot decode the report as tpg would"""
+
+class _SkipRemarks(Exception):
+    """The remarks, starting at the offset given, are not wanted"""
+
+class _Token(object):
+    """The token being processed by the fast path, and the match that found it"""
+
+    __slots__ = ('name', 'start', 'end', 'match')
+
+    def __init__(self, name, start, end, match=None):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.match = match
+
+class _Group(dict):
+    """
+       A decoded group. Its 'index', the ('line.column', 'line.column') pair
+       groups used to have, is worked out from its 'span' when asked for,
+       and is not one of its keys.
+    """
+    __slots__ = ('_text',)
+
+    def __missing__(self, key):
+        if key != 'index' or not dict.__contains__(self, 'span'):
+            raise KeyError(key)
+        return metar_util.lineColumnIndex(metar_util.findLineStarts(self._text), self['span'])
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def has_key(self, key):
+        return key in self
+
+    def __contains__(self, key):
+        if key == 'index':
+            return dict.__contains__(self, 'span')
+        return dict.__contains__(self, key)
+
 ##############################################################################
 # local functions
-def valid_day(tms):
-    """Checks if day of month is valid"""
-    year, month, day = tms[:3]
-    if day > 31:
-        return 0
-    if month in [4, 6, 9, 11] and day > 30:
-        return 0
-    if month == 2 and (year%4 == 0 and day > 29 or day > 28):
-        return 0
-    return 1
+def _lineEnd(text, starts, n):
+    try:
+        return starts[n+1] - 1
+    except IndexError:
+        return len(text)
+
+def _complexValue(v, whole, fraction, lessThan=True):
+    """Returns (value, oper) of the whole and fraction groups of v, a match
+of _complexFraction, oper being 'M' if the fraction has the M prefix.
+lessThan tells what the prefix means: True, less than the fraction, M1/x
+then counting as 0; False, nothing, the fraction is counted anyway; None,
+the fraction is invalid and not counted.
+"""
+    value = 0.0
+    oper = None
+    try:
+        value += float(v.group(whole).strip())
+    except (AttributeError, ValueError):
+        pass
+
+    try:
+        num, den = v.group(fraction).split('/', 1)
+        if num[0] == 'M' and lessThan is not None:
+            if num != 'M1' or not lessThan:
+                value += float(num[1:])/float(den)
+            oper = 'M'
+        else:
+            value += float(num)/float(den)
+
+    except (AttributeError, ValueError):
+        pass
+
+    return value, oper
 
 def getAllMatches(re,inputstr):
 
-    curpos = 0
-    matches = []
-    while len(inputstr[curpos:]):
-        try:
-            m = re.search(inputstr[curpos:])
-            matches.append(m.groupdict())
-            curpos += m.end()
-        except AttributeError:
-            break
-            
-    return matches
+    return [m.groupdict() for m in metar_util.iter_matches(re,inputstr)]
+
+#
+# Compass points as octants, numbered clockwise from north. A sector runs
+# from the ccw edge of its first octant to the cw edge of its last, and is
+# continued by a sector starting at the octant following its last.
+_CompassPoints = ['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW']
+_CompassOctants = dict([(pt, n) for n, pt in enumerate(_CompassPoints)])
+_NextOctant = [(n + 1) % 8 for n in range(8)]
+#
+# Most location strings whose parse is kept. There are few distinct ones.
+LOCATION_CACHE_SIZE = 1024
+#
+# Location string: ((distance, ((key, ccw, cw), ...)), ...) and
+# ((string, unexpected tokens), ...) of its parse, most recently used last
+_locationCache = collections.OrderedDict()
 
 def processLocationString(locationString,locations):
     #
+    # The parse of a location string is kept, its unexpected tokens being
+    # reported again each time it is seen
+    try:
+        parsed, unexpected = _locationCache.pop(locationString)
+    except KeyError:
+        parsed, unexpected = _parseLocations(locationString)
+    else:
+        for strng, count in unexpected:
+            for n in range(count):
+                print 'Unexpected token in location string', strng
+    if LOCATION_CACHE_SIZE > 0:
+        if len(_locationCache) >= LOCATION_CACHE_SIZE:
+            _locationCache.popitem(last=False)
+        _locationCache[locationString] = parsed, unexpected
+
+    for distance, spans in parsed:
+        locations[distance] = _sectorDict(spans)
+    return
+
+def _parseLocations(locationString):
+
+    parsed = []
+    unexpected = []
+
+    def parse(distance, strng):
+        spans, count = _parseSectors(strng)
+        parsed.append((distance, spans))
+        if count:
+            unexpected.append((strng, count))
+    #
     # overhead is the simplest
     pos = locationString.find('OHD')
     if pos >= 0:
-        locations['OHD'] = { 'sector0': { 'ccw':0.0,'cw':360.0 }}
+        parsed.append(('OHD', (('sector0', 0.0, 360.0),)))
         locationString = '%s%s' % (locationString[:pos],locationString[pos+4:])
     #
     # Parse out language "in the vicinity" (VC); shouldn't be mixed up with DSNT
     vcLocation = _re_VC.search(locationString)
     if vcLocation:
-        vcString = locationString[(vcLocation.start()+2):vcLocation.end()]
-        locations['VC'] = parseLocationString(vcString)
+        parse('VC', locationString[(vcLocation.start()+2):vcLocation.end()])
         locationString = '%s%s' % (locationString[:vcLocation.start()],locationString[vcLocation.end():])
-            
+
     dsntLocation = _re_DSNT.search(locationString)
     if dsntLocation:
-        dsntString = locationString[(dsntLocation.start()+4):dsntLocation.end()]
-        locations['DSNT'] = parseLocationString(dsntString)
+        parse('DSNT', locationString[(dsntLocation.start()+4):dsntLocation.end()])
         locationString = '%s%s' % (locationString[:dsntLocation.start()],locationString[dsntLocation.end():])
     #
     # locationString now has what is left over....
     if locationString.strip():
-        locations['ATSTN'] = parseLocationString(locationString)
+        parse('ATSTN', locationString)
 
-    return
+    return tuple(parsed), tuple(unexpected)
 
-def parseLocationString(strng):
+def _sectorDict(spans):
+    return dict([(key, {'ccw': ccw, 'cw': cw}) for key, ccw, cw in spans])
 
-    spans = {}
-    sector = -1
+def _parseSectors(strng):
+    #
+    # The sectors of a location string, as ((key, ccw, cw), ...), and the
+    # number of unexpected tokens in it
+    sectors = []
+    unexpected = 0
 
-    for token in strng.split():        
+    for token in strng.split():
         #
         # AND suggests a discontinuity
         if token == 'AND':
-            continue        
-        sector += 1        
+            continue
+        #
+        # A new sector number for each token, that stays unused if the
+        # token is not a compass point
+        sectors.append(None)
         #
         # If a range of compass points are indicated, combine the spans if possible
         if token.find('-') > 0:
             for sectr in token.split('-'):
-                try:
-                    if spans['sector%d' % sector]['cw'] == _CompassDegrees[sectr][0]:
-                        spans['sector%d' % sector]['cw'] = _CompassDegrees[sectr][1]
-                    else:
-                        raise KeyError
-
-                except KeyError:
-                    if spans.has_key('sector%d' % sector):
-                        sector += 1
-                        
-                    spans['sector%d' % sector] = {'ccw': _CompassDegrees[sectr][0],
-                                                  'cw' : _CompassDegrees[sectr][1]}
+                octant = _CompassOctants[sectr]
+                last = sectors[-1]
+                if last is None:
+                    sectors[-1] = [octant, octant]
+                elif _NextOctant[last[1]] == octant:
+                    last[1] = octant
+                else:
+                    sectors.append([octant, octant])
         #
         # No compass point span given
         else:
-            try:
-                spans['sector%d' % sector] = {'ccw': _CompassDegrees[token][0],
-                                              'cw' : _CompassDegrees[token][1]}
-            except KeyError:
+            octant = _CompassOctants.get(token)
+            if octant is None:
                 print 'Unexpected token in location string', strng
+                unexpected += 1
+            else:
+                sectors[-1] = [octant, octant]
     #
-    # Final pass to see if directions can be combined
-    discontinuities = len(spans.keys())
-    markedForDeletion = []
-    
+    # Final pass to see if directions can be combined. Only as many sector
+    # numbers as there are sectors are looked at, a sector left unused
+    # among them being a KeyError.
+    discontinuities = len(sectors) - sectors.count(None)
+    markedForDeletion = [False] * discontinuities
+
     for discnt in range(0,discontinuities):
         for target in range(discnt+1,discontinuities):
-            try:
-               markedForDeletion.index(target)
-            except ValueError:
-                if spans['sector%d' % discnt]['cw'] == spans['sector%d' % target]['ccw']:
-                    spans['sector%d' % discnt]['cw'] = spans['sector%d' % target]['cw']
-                    markedForDeletion.append(target)
-        
-    while markedForDeletion:
+            if not markedForDeletion[target]:
+                for n in (discnt, target):
+                    if sectors[n] is None:
+                        raise KeyError('sector%d' % n)
+                if _NextOctant[sectors[discnt][1]] == sectors[target][0]:
+                    sectors[discnt][1] = sectors[target][1]
+                    markedForDeletion[target] = True
+
+    spans = []
+    for n, sector in enumerate(sectors):
+        if sector is not None and not (n < discontinuities and markedForDeletion[n]):
+            spans.append(('sector%d' % n, _CompassDegrees[_CompassPoints[sector[0]]][0],
+                          _CompassDegrees[_CompassPoints[sector[1]]][1]))
+    return tuple(spans), unexpected
+
+def parseLocationString(strng):
+
+    return _sectorDict(_parseSectors(strng)[0])
+
+##############################################################################
+# compiled grammar cache
+#
+# tpg turns the grammar into Python source and compiles it whenever the
+# module is imported, which takes longer than decoding a small file. The
+# code of the generated methods is kept in a cache directory, under a hash
+# of the grammar, Python and tpg versions, and loaded instead. The token
+# regular expressions are still compiled by the lexer as before; compiled
+# patterns cannot be serialized.
+#
+# The directory is $METAR_GRAMMAR_CACHE, or .tpgcache next to this file. An
+# empty $METAR_GRAMMAR_CACHE turns the cache off.
+_Grammar = '\n'.join([_Options, _Separator, _Tokens, _Rules])
+
+def _grammar_cache_file(grammar):
+
+    cachedir = os.environ.get('METAR_GRAMMAR_CACHE',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), '.tpgcache'))
+    if not cachedir:
+        return None
+    key = hashlib.sha1('\0'.join([grammar, sys.version, str(getattr(tpg, '__version__', '')),
+                                  str(marshal.version)])).hexdigest()
+    return os.path.join(cachedir, '%s.marshal' % key)
+
+def _compile_grammar(grammar):
+    """Returns the methods tpg generates for the grammar, by name"""
+
+    class _Compiled(tpg.Parser):
+        __doc__ = grammar
+
+    return dict([(name, value) for name, value in _Compiled.__dict__.items()
+                 if name not in ('__doc__', '__module__', '__dict__', '__weakref__')])
+
+def _load_grammar(filename, namespace):
+
+    with open(filename, 'rb') as fh:
+        entries = marshal.load(fh)
+    return dict([(name, types.FunctionType(code, namespace, fname, defaults))
+                 for name, fname, code, defaults in entries])
+
+def _save_grammar(filename, methods):
+
+    entries = []
+    for name, value in methods.items():
+        if not isinstance(value, types.FunctionType) or value.func_closure:
+            #Only plain functions can be rebuilt from their code
+            raise ValueError('%s is not a plain function' % name)
+        entries.append((name, value.func_name, value.func_code, value.func_defaults))
+
+    cachedir = os.path.dirname(filename)
+    if not os.path.isdir(cachedir):
+        os.makedirs(cachedir)
+    fd, tmpname = tempfile.mkstemp(dir=cachedir)
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            marshal.dump(entries, fh)
+        os.rename(tmpname, filename)
+    except:
+        os.unlink(tmpname)
+        raise
+
+# Problems with the grammar cache met at import, before the application
+# sets up logging. They are logged at the first decode.
+_grammarWarnings = []
+
+def _log_grammar_warnings():
+
+    log = logging.getLogger(__name__)
+    while _grammarWarnings:
+        log.warning(_grammarWarnings.pop(0))
+
+def grammar_methods(grammar=_Grammar):
+    """
+       Returns the parser methods generated from the grammar, from the cache
+       if it holds them, compiling the grammar and caching them otherwise.
+    """
+    filename = _grammar_cache_file(grammar)
+    if filename and os.path.exists(filename):
         try:
-            del spans['sector%d' % markedForDeletion.pop()]
-        except KeyError:
-            pass
-        
-    return spans
+            return _load_grammar(filename, globals())
+        except (EOFError, ValueError, TypeError, IOError), e:
+            _grammarWarnings.append('Ignoring grammar cache %s: %s' % (filename, str(e)))
+
+    methods = _compile_grammar(grammar)
+    if filename:
+        try:
+            _save_grammar(filename, methods)
+        except (IOError, OSError, ValueError), e:
+            _grammarWarnings.append('Cannot cache grammar in %s: %s' % (filename, str(e)))
+    return methods
 
 ##############################################################################
 # decoder class
-class Decoder(tpg.VerboseParser):
-    """METAR decoder class"""
+class Decoder(tpg.Parser):
+    #
+    # METAR decoder class. There is no docstring: tpg would compile it as the
+    # grammar. The parser methods are added from grammar_methods() below.
+
+    # Decode with the fast path first, tpg only when it gives up
+    fastpath = True
+    # Try only the remarks that may start with the group's first character
+    dispatchRemarks = True
+    # Most tokens tried, and seconds spent, decoding one report before it is
+    # given up on, None for no limit. A long malformed report can take the
+    # grammar's backtracking a very long time.
+    maxSteps = None
+    maxSeconds = None
+    # Faults logged with their report: all of them with 1, the first of
+    # each kind and every faultLogInterval-th after it with more, none with
+    # 0. All of them are counted in errors.
+    faultLogInterval = 1
+
+    def __init__(self):
+
+        super(Decoder, self).__init__()
+        self._token = None
+        self._lineStarts = None
+        # metar_util.ReferenceTime the report is decoded against
+        self._reference = None
+        # Reports decoded by the fast path, and handed over to tpg
+        self.fastpathHits = 0
+        self.fastpathFallbacks = 0
+        # Tokens tried for the report, and when its time is up
+        self._steps = 0
+        self._deadline = None
+        # Reports given up on for exceeding the budget
+        self.budgetExceeded = 0
+        # Groups wanted from the report, None for all of them
+        self._fields = None
+        self._partial = False
+        # Reports whose remarks were skipped, and the characters skipped
+        self.skippedReports = 0
+        self.skippedChars = 0
+        # Faults, by (exception class name, name of the token being
+        # processed). Counters of several decoders add up.
+        self.errors = collections.Counter()
+
+    def __call__(self, metar, reference=None, fields=None):
+        """
+           Decodes a report against reference, a metar_util.ReferenceTime,
+           the time it is decoded by default. With fields, the names of the
+           groups wanted, decoding may stop at the remarks, see
+           decode_many().
+        """
+        metar = self._start(metar, reference, fields)
+        try:
+            return self._groups(self._decode(metar))
 
-    __doc__ = '\n'.join([_Options, _Separator, _Tokens, _Rules])
-    verbose = 3
+        except Exception, e:
+            if self._fault(e):
+                if isinstance(e, tpg.SyntacticError):
+                    logging.warning('Decoder fault: %s; METAR: %s' % (str(e),metar))
+                elif isinstance(e, BudgetExceeded):
+                    logging.warning('Decoder budget exceeded: %s; METAR: %s' % (str(e),metar))
+                else:
+                    logging.error('Unhandled exception in decoder: %s; METAR: %s' % (str(e),metar))
+            return self._groups(self._metar)
+
+    def decode_many(self, reports, reference=None, compact=False, fields=None):
+        """
+           Decodes the reports one after the other, with the same lexer and
+           parser, yielding (context, result, fault) for each as it is
+           decoded.
+
+           Each report is a string or a list of lines, as __call__ takes,
+           or a (report, context) tuple, context being anything the caller
+           wants back with the result, e.g. the bulletin heading. It is
+           None otherwise. fault is None if the report was decoded, else
+           the exception that stopped the decoder, result then holding
+           what was decoded up to it, BudgetExceeded for a report given up
+           on. Faults are counted in errors, but not logged.
+
+           The reports are decoded against reference, a
+           metar_util.ReferenceTime. Without one, the time they are decoded
+           is taken once per second rather than once per report.
+
+           With compact, the results are compact_report.CompactReports,
+           which take much less memory when many of them are kept.
+
+           fields are the names of the groups wanted, e.g. ('ident',
+           'itime', 'wind', 'vsby', 'sky', 'alt'), all of them by default.
+           If none of them is decoded or changed by the remarks, those are
+           not decoded, their text and offsets being the result's
+           'skipped' group instead. 'unparsed' and 'additive' are only
+           worked out if wanted. Faults in the remarks skipped are not
+           seen.
+        """
+        second = None
+        for report in reports:
+            context = None
+            if type(report) == types.TupleType:
+                report, context = report
+
+            clock = reference
+            if clock is None:
+                now = time.time()
+                if int(now) != second:
+                    second = int(now)
+                    batch = metar_util.ReferenceTime(now)
+                clock = batch
+
+            metar = self._start(report, clock, fields)
+            fault = None
+            try:
+                result = self._groups(self._decode(metar))
+            except Exception, e:
+                self._fault(e)
+                result = self._groups(self._metar)
+                fault = e
 
-    def __call__(self, metar):
-        
+            if compact:
+                result = compact_report.compact(result, metar)
+            yield context, result, fault
+
+    def _start(self, metar, reference=None, fields=None):
+        #
+        # Resets the decoder for the report, returning its text as decoded
+        if _grammarWarnings:
+            _log_grammar_warnings()
+        self._reference = reference
+        if fields is not None:
+            fields = frozenset(fields)
+        self._fields = fields
+        # Remarks may be skipped
+        self._partial = fields is not None and fields <= _BodyFields
         self._metar = {}
         self._first = 0
+        self._token = None
+        self._lineStarts = None
+        self._steps = 0
+        self._deadline = None
+        if self.maxSeconds is not None:
+            self._deadline = time.time() + self.maxSeconds
         if type(metar) == types.ListType:
             metar = '\n'.join(metar)
         #
@@ -318,124 +778,331 @@ class Decoder(tpg.VerboseParser):
         eot = metar.find('=')
         if eot > 0:
             metar = metar[:eot]+' '
+        self._input = metar
+        return metar
+
+    def _decode(self, metar):
+
+        if self.fastpath:
+            try:
+                result = self._fastParse(metar)
+                self.fastpathHits += 1
+                return result
+            except _Fallback:
+                #
+                # On any other exception the token stays, to name the fault
+                self.fastpathFallbacks += 1
+                self._metar = {}
+                self._token = None
+
         try:
             return super(Decoder, self).__call__(metar)
+        except _SkipRemarks, e:
+            return self._skip(e.args[0])
 
-        except tpg.SyntacticError, e:
-            logging.warning('Decoder fault: %s; METAR: %s' % (str(e),metar))
-            return self._metar
-
-        except Exception, e:
-            logging.error('Unhandled exception in decoder: %s; METAR: %s' % (str(e),metar))
-            return self._metar
+    def _groups(self, result):
+        #
+        # The decoded groups as _Groups, which give their 'index' lazily
+        text = self._input
+        for key, group in result.items():
+            if type(group) is dict and 'span' in group:
+                group = result[key] = _Group(group)
+                group._text = text
+        return result
+
+    def _remarksWanted(self, start):
+        #
+        # True if a group wanted is decoded, or may be replaced, by the
+        # remarks starting at start
+        if not self._partial:
+            return True
+        for field in self._fields:
+            name = _RemarkOverrides.get(field)
+            if name is not None and _TokenRe[name].search(self._input, start):
+                return True
+        return False
+
+    def _skip(self, start):
+        #
+        # The groups decoded before the remarks starting at start, which
+        # are recorded as skipped
+        text = self._input
+        end = len(text.rstrip())
+        self._metar['skipped'] = {'str': text[start:end], 'span': (start, end)}
+        self.skippedReports += 1
+        self.skippedChars += end - start
+        return self._metar
 
-    def index(self):
-        
-        ti = self.lexer.cur_token
-        return ('%d.%d' % (ti.line+self._first, ti.column-1),
-                '%d.%d' % (ti.end_line+self._first, ti.end_column-1))
+    def step(self):
+        """
+           Counts a token tried, raises BudgetExceeded when the report has
+           used up its steps or its time.
+        """
+        self._steps += 1
+        if self.maxSteps is not None and self._steps > self.maxSteps:
+            self.budgetExceeded += 1
+            raise BudgetExceeded('more than %d steps' % self.maxSteps)
+        if self._deadline is not None and time.time() > self._deadline:
+            self.budgetExceeded += 1
+            raise BudgetExceeded('more than %g seconds' % self.maxSeconds)
+
+    def eat(self, name):
+        #
+        # Every token tpg tries, backtracking included, goes through here
+        # or, with the ContextSensitiveLexer the grammar sets, eatCSL()
+        self.step()
+        return self._eaten(super(Decoder, self).eat(name))
 
     def eatCSL(self, name):
-        """Overrides super definition"""
+
+        self.step()
+        return self._eaten(super(Decoder, self).eatCSL(name))
+
+    def _eaten(self, value):
+        #
+        # Stops at the remarks when none of the groups wanted is in them
+        if value == 'RMK' and self._partial:
+            start = self.span()[0]
+            if not self._remarksWanted(start):
+                raise _SkipRemarks(start)
+        return value
+
+    def _fault(self, error):
+        #
+        # Counts the fault and records it in the result as 'fault', its
+        # exception class name and token. Returns True if it is to be logged.
+        name = error.__class__.__name__
+        token = self.tokenName()
+        self._metar['fault'] = {'error': name, 'token': token}
+        errors = self.errors
+        errors[(name, token)] += 1
+        interval = self.faultLogInterval
+        return interval > 0 and (errors[(name, token)] - 1) % interval == 0
+
+    def faultSummary(self):
+        """
+           Returns [(count, exception class name, token name), ...] of the
+           faults so far, most frequent first
+        """
+        return fault_summary(self.errors)
+
+    def referenceTime(self):
+        """The metar_util.ReferenceTime the report is decoded against"""
+
+        if self._reference is None:
+            self._reference = metar_util.ReferenceTime()
+        return self._reference
+
+    def fastpathRate(self):
+        """Returns the fraction of the reports decoded by the fast path"""
+
+        total = self.fastpathHits + self.fastpathFallbacks
+        if total == 0:
+            return 0.0
+        return float(self.fastpathHits) / total
+
+    def _fastParse(self, metar):
+        """
+           Decodes the report with the fast path, raises _Fallback if tpg
+           has to decode it instead.
+        """
+        spaces = _SeparatorRe.match
+        size = len(metar)
+        step = None
+        if self.maxSteps is not None or self.maxSeconds is not None:
+            step = self.step
+
+        def skip(pos):
+            m = spaces(metar, pos)
+            if m:
+                return m.end()
+            return pos
+
+        def accept(name, callback, start):
+            #
+            # Returns the position past the token at start, None if it
+            # isn't there or its callback rejected it.
+            if step is not None:
+                step()
+            m = _TokenRe[name].match(metar, start)
+            if m is None:
+                return None
+            if callback is not None:
+                self._token = _Token(name, start, m.end(), m)
+                try:
+                    getattr(self, callback)(m.group())
+                except tpg.WrongToken:
+                    return None
+            return m.end()
+
+        def eat(name, callback, pos):
+            return accept(name, callback, skip(pos))
+
+        def choose(alternatives, pos, dispatch=None):
+            #
+            # The first of the alternatives accepted, the separators being
+            # skipped once for all of them. With dispatch, only those
+            # that may start with the next character are tried.
+            start = skip(pos)
+            if dispatch is not None:
+                alternatives = dispatch.get(metar[start:start+1], dispatch[None])
+            for name, callback in alternatives:
+                end = accept(name, callback, start)
+                if end is not None:
+                    return end
+            return None
+
+        def mandatory(pos):
+            for alternatives, repeat in _MandatoryGroups:
+                while True:
+                    end = choose(alternatives, pos)
+                    if end is None:
+                        break
+                    pos = end
+                    if not repeat:
+                        break
+            return pos
+
+        pos = eat('type', 'obtype', 0)
+        if pos is None:
+            raise _Fallback
+        pos = eat('ident', 'ident', pos)
+        if pos is None or metar.startswith('NIL', skip(pos)):
+            raise _Fallback
+        pos = eat('itime', 'itime', pos)
+        if pos is None:
+            raise _Fallback
+        end = eat('autocor', 'autocor', pos)
+        if end is not None:
+            pos = end
+        #
+        # Body -> Mandatory{1,2} noRMK? Mandatory Remarks?
+        pos = mandatory(mandatory(pos))
+        end = eat('noRMK', None, pos)
+        if end is not None:
+            pos = end
+        pos = skip(mandatory(pos))
+        if metar.startswith('RMK', pos):
+            if pos + 3 < size and not metar[pos+3].isspace():
+                raise _Fallback
+            if self._partial and not self._remarksWanted(pos):
+                self._token = None
+                return self._skip(pos)
+            pos += 3
+            dispatch = None
+            if self.dispatchRemarks:
+                dispatch = _RemarkDispatch
+            while True:
+                end = choose(_RemarkAlternatives, pos, dispatch)
+                if end is None:
+                    break
+                pos = end
+        elif pos < size:
+            #
+            # Left over text that tpg may or may not reject
+            raise _Fallback
+
+        self._token = None
+        return self.unparsed()
+
+    def currentToken(self):
+        """The token being processed, by the fast path or by tpg"""
+
+        if self._token is not None:
+            return self._token
+        return self.lexer.cur_token
+
+    def tokenName(self):
+        """Name of the token being processed, None if there is none"""
+
         try:
-            value = super(Decoder, self).eatCSL(name)
-            return value
-        except tpg.WrongToken:
-            raise
+            return self.currentToken().name
+        except AttributeError:
+            return None
+
+    def tokenRegex(self):
+        """The compiled regular expression of the token being processed"""
+
+        return _TokenRe[self.currentToken().name]
+
+    def tokenMatch(self, s):
+        """
+           The match object of the token s being processed. The fast path
+           hands over the one it found the token with; tpg keeps its own to
+           itself, so the token is matched again.
+        """
+        if self._token is not None:
+            return self._token.match
+        return self.tokenRegex().search(s)
+
+    def lineStarts(self):
+        """Offsets of the lines of the report being decoded"""
+
+        if self._lineStarts is None:
+            self._lineStarts = metar_util.findLineStarts(self._input)
+        return self._lineStarts
+
+    def span(self):
+        """(start, end) offsets of the token being processed in the report"""
+
+        if self._token is not None:
+            return self._token.start, self._token.end
+        ti = self.lexer.cur_token
+        starts = self.lineStarts()
+        return (starts[ti.line-1] + ti.column-1,
+                starts[ti.end_line-1] + ti.end_column-1)
+
+    def index(self):
+        """
+           ('line.column', 'line.column') of the token being processed,
+           the index decoded groups used to have
+        """
+        return metar_util.lineColumnIndex(self.lineStarts(), self.span(), self._first)
 
     def fix_date(self,tms):
         """Tries to determine month and year from report timestamp.
 tms contains day, hour, min of the report, current year and month
 """
-        now = time.time()
-        t = time.mktime(tms)    
-        if t > now + 86400.0:       # previous month
-            if tms[1] > 1:
-                tms[1] -= 1
-            else:
-                tms[1] = 12
-                tms[0] -= 1
-        elif t < now - 25*86400.0:  # next month
-            if tms[1] < 12:
-                tms[1] += 1
-            else:
-                tms[1] = 1
-                tms[0] += 1
+        self.referenceTime().fix_date(tms)
 
     #######################################################################
     # Methods called by the parser
     def alt(self, s):
         
-        d = self._metar['alt'] = {'str': s, 'index': self.index(), 'uom':"[in_i'Hg]",
+        d = self._metar['alt'] = {'str': s, 'span': self.span(), 'uom':"[in_i'Hg]",
                                   'value':int(s[1:])/100.0}
         
     def ident(self, s):
         
-        self._metar['ident'] = {'str': s, 'index': self.index()}
+        self._metar['ident'] = {'str': s, 'span': self.span()}
 
     def itime(self, s):
         
-        d = self._metar['itime'] = {'str': s, 'index': self.index()}
+        d = self._metar['itime'] = {'str': s, 'span': self.span()}
         mday, hour, min = int(s[:2]), int(s[2:4]), int(s[4:6])
+        reference = self.referenceTime()
         try:
             if mday > 31 or hour > 23 or min > 59:
                 raise Error('Invalid time')
-            tms = list(time.gmtime())
-            tms[2:6] = mday, hour, min, 0
-            self.fix_date(tms)
-            if not valid_day(tms):
+            d['value'] = reference.resolve(mday, hour, min)
+            if d['value'] is None:
                 raise Error('Invalid day')
-            d['value'] = time.mktime(tms)
         except Error, e:
-            d['value'] = time.time()
+            d['value'] = reference.now
             d['error'] = str(e)
 
     def obtype(self, s):
         
-        self._metar['type'] = {'str': s, 'index': self.index()}
+        self._metar['type'] = {'str': s, 'span': self.span()}
 
     def vvis(self, s):
         
-        d = self._metar['vvis'] = {'str': s, 'index': self.index(), 'uom':'[mi_i]'}
-        v = self.lexer.tokens[self.lexer.cur_token.name][0].search(s)
-        vis = 0.0
-        
-        try:
-            vis += float(v.group('vintlo').strip())
-        except (AttributeError, ValueError):
-            pass
-            
-        try:
-            num, den = v.group('vfraclo').split('/', 1)
-            if num[0] == 'M':
-                if num != 'M1':
-                    vis += float(num[1:])/float(den)
-                d['oper']='M'
-                
-            else:
-                vis += float(num)/float(den)
-                
-        except (AttributeError, ValueError):
-            pass
-
-        d['lo'] = vis
-        
-        vis = 0.0
-        try:
-            vis += float(v.group('vinthi').strip())
-        except (AttributeError, ValueError):
-            pass
-            
-        try:
-            num, den = v.group('vfrachi').split('/', 1)
-            vis += float(num)/float(den)
-            metric = False
-            
-        except (AttributeError, ValueError):
-
-            pass
-        
-        d['hi'] = vis
+        d = self._metar['vvis'] = {'str': s, 'span': self.span(), 'uom':'[mi_i]'}
+        v = self.tokenMatch(s)
+        d['lo'], oper = _complexValue(v, 'vintlo', 'vfraclo')
+        if oper:
+            d['oper'] = oper
+        d['hi'] = _complexValue(v, 'vinthi', 'vfrachi', lessThan=None)[0]
         d['uom'] = self._metar['vsby']['uom']
         #
         # Bad token processed
@@ -446,75 +1113,37 @@ tms contains day, hour, min of the report, current year and month
     # SFC VIS found in comments
     def sfcvsby(self, s):
         
-        v = self.lexer.tokens[self.lexer.cur_token.name][0].search(s)
-        vis = 0.0
-            
-        try:
-            vis += float(v.group('whole').strip())
-        except (AttributeError, ValueError):
-            pass
-            
-        try:
-            num, den = v.group('fraction').split('/', 1)
-            if num[0] == 'M':
-                if num != 'M1':
-                    vis += float(num[1:])/float(den)
-                oper = 'M'
-            else:
-                vis += float(num)/float(den)
-                
-        except (AttributeError, ValueError):
-            pass
+        v = self.tokenMatch(s)
+        vis, oper = _complexValue(v, 'whole', 'fraction')
         #
         # What is in the prevailing group is tower visibility
         self._metar['twrvsby'] = self._metar['vsby'].copy()
         self._metar['vsby'] = {'str': s,
-                               'index': self.index(),
+                               'span': self.span(),
                                'value': vis,
                                'uom':self._metar['twrvsby']['uom']}
-        try:
+        if oper:
             self._metar['vsby']['oper'] = oper
-        except NameError:
-            pass
         
     def vsby(self, s):
 
-        v = self.lexer.tokens[self.lexer.cur_token.name][0].search(s)
-        vis = 0.0
+        v = self.tokenMatch(s)
+        vis, oper = _complexValue(v, 'whole', 'fraction')
         uom = 'm'
         if s[-2:] == 'SM':         # miles            
             uom = '[mi_i]'
-            
-        try:
-            vis += float(v.group('whole').strip())
-        except (AttributeError, ValueError):
-            pass
-            
-        try:
-            num, den = v.group('fraction').split('/', 1)
-            if num[0] == 'M':
-                if num != 'M1':
-                    vis += float(num[1:])/float(den)
-                oper = 'M'
-            else:
-                vis += float(num)/float(den)
-                
-        except (AttributeError, ValueError):
-            pass
                 
-        d = self._metar['vsby'] = {'str': s, 'index': self.index(),
+        d = self._metar['vsby'] = {'str': s, 'span': self.span(),
                                    'value': vis, 'uom': uom}
-        try:
+        if oper:
             d['oper'] = oper
-        except NameError:
-            pass
 
     def wind(self, s):
         #
         # Handle variable wind direction > 6kts which always comes after the wind group
         try:            
             d = self._metar['wind']
-            d['index'] = (d['index'][0],self.index()[1])
+            d['span'] = (d['span'][0],self.span()[1])
             d['str'] = "%s %s" % (d['str'],s)
             ccw,cw = s.split('V')
             d.update({'ccw': ccw, 'cw': cw})
@@ -523,7 +1152,7 @@ tms contains day, hour, min of the report, current year and month
         except KeyError:
             pass
         
-        d = self._metar['wind'] = {'str': s, 'index': self.index()}
+        d = self._metar['wind'] = {'str': s, 'span': self.span()}
         if s.startswith('VRB'):
             dd = 'VRB'
         else:
@@ -544,24 +1173,24 @@ tms contains day, hour, min of the report, current year and month
         if 'obv' in self._metar:
             return
         
-        self._metar['obv'] = {'str': s, 'index': self.index()}
+        self._metar['obv'] = {'str': s, 'span': self.span()}
 
     def pcp(self, s):
 
-        self._metar['pcp'] = {'str': s, 'index': self.index()}
+        self._metar['pcp'] = {'str': s, 'span': self.span()}
 
     def vcnty(self, s):
 
-        d = self._metar['vcnty'] = {'str': s, 'index': self.index()}
+        d = self._metar['vcnty'] = {'str': s, 'span': self.span()}
 
     def sky(self, s):
 
-        self._metar['sky'] = {'str': s, 'index': self.index()}
+        self._metar['sky'] = {'str': s, 'span': self.span()}
 
     def vsky(self,s):
 
-        d = self._metar['vsky'] = {'str': s, 'index': self.index(), 'uom':'[ft_i]'}
-        v = self.lexer.tokens[self.lexer.cur_token.name][0].search(s)
+        d = self._metar['vsky'] = {'str': s, 'span': self.span(), 'uom':'[ft_i]'}
+        v = self.tokenMatch(s)
         try:
             d['hgt'] = int(v.group(3))*100
         except (TypeError,ValueError):
@@ -577,14 +1206,14 @@ tms contains day, hour, min of the report, current year and month
         
     def vcig(self,s):
 
-        d = self._metar['vcig'] = {'str': s, 'index': self.index(), 'uom':'[ft_i]'}
-        v = self.lexer.tokens[self.lexer.cur_token.name][0].search(s)
+        d = self._metar['vcig'] = {'str': s, 'span': self.span(), 'uom':'[ft_i]'}
+        v = self.tokenMatch(s)
         d['lo']=int(v.group(1))*100
         d['hi']=int(v.group(2))*100
         
     def temp(self, s):
 
-        d = self._metar['temp'] = {'str': s, 'index': self.index(), 'uom':'Cel'}
+        d = self._metar['temp'] = {'str': s, 'span': self.span(), 'uom':'Cel'}
         tok = s.split('/')
         
         if tok[0][0] == 'M':
@@ -615,7 +1244,7 @@ tms contains day, hour, min of the report, current year and month
                     
     def tempdec(self, s):
         
-        d = self._metar['tempdec'] = {'str': s, 'index': self.index()}
+        d = self._metar['tempdec'] = {'str': s, 'span': self.span()}
         tt = float(s[2:5])/10.0
         if s[1] == '1':
             tt = -tt
@@ -629,10 +1258,10 @@ tms contains day, hour, min of the report, current year and month
     def pcp1h(self, s):
 
         try:
-            self._metar['pcp1h'] = {'str': s, 'index': self.index(), 'uom':'[in_i]',
+            self._metar['pcp1h'] = {'str': s, 'span': self.span(), 'uom':'[in_i]',
                                     'value': float(s[1:])/100.0, 'period': '1'}
         except ValueError:
-            self._metar['pcp1h'] = {'str': s, 'index': self.index()}
+            self._metar['pcp1h'] = {'str': s, 'span': self.span()}
 
     def mslp(self, s):
         
@@ -640,7 +1269,7 @@ tms contains day, hour, min of the report, current year and month
             p = float(s[3:])/10.0
 
         except ValueError:
-            self._metar['mslp'] =  {'str': s, 'index': self.index()}
+            self._metar['mslp'] =  {'str': s, 'span': self.span()}
             return
         
         if p >= 60.0:
@@ -648,17 +1277,17 @@ tms contains day, hour, min of the report, current year and month
         else:
             p += 1000.0
             
-        d = self._metar['mslp'] =  {'str': s, 'index': self.index(), 'uom':'hPa', 'value':p }
+        d = self._metar['mslp'] =  {'str': s, 'span': self.span(), 'uom':'hPa', 'value':p }
 
     def autocor(self,s):
-        self._metar['autocor'] = {'str': s, 'index': self.index()}
+        self._metar['autocor'] = {'str': s, 'span': self.span()}
         
     def vrb_rvr(self,s,r):
         #
         # Multiple RVRs are possible
         try:
             d = self._metar['vrbrvr']
-            d['index'] = (d['index'][0],self.index()[1])
+            d['span'] = (d['span'][0],self.span()[1])
             d['str'] += ' %s' % s
             d['lo'] += ' %s' % r.group('lo')
             d['hi'] += ' %s' % r.group('hi')    
@@ -679,7 +1308,7 @@ tms contains day, hour, min of the report, current year and month
             if s[-2:] == 'FT':
                 uom = '[ft_i]'
                 
-            self._metar['vrbrvr'] = {'str': s, 'index': self.index(), 'uom': uom }
+            self._metar['vrbrvr'] = {'str': s, 'span': self.span(), 'uom': uom }
             self._metar['vrbrvr'].update(r.groupdict())
             del self._metar['vrbrvr']['minus']
             del self._metar['vrbrvr']['plus']
@@ -704,7 +1333,7 @@ tms contains day, hour, min of the report, current year and month
         # Multiple RVRs are possible
         try:            
             d = self._metar['rvr']
-            d['index'] = (d['index'][0],self.index()[1])
+            d['span'] = (d['span'][0],self.span()[1])
             d['str'] += ' %s' % s
             d['mean'] += ' %s' % r.group('mean')
             d['rwy'] += ' %s' % r.group('rwy')
@@ -725,7 +1354,7 @@ tms contains day, hour, min of the report, current year and month
             if s[-2:] == 'FT':
                 uom = '[ft_i]'
                 
-            self._metar['rvr'] = {'str': s, 'index': self.index(), 'uom': uom }
+            self._metar['rvr'] = {'str': s, 'span': self.span(), 'uom': uom }
             self._metar['rvr'].update(r.groupdict())            
             if r.group('tend') == '':
                 self._metar['rvr']['tend'] = ' '
@@ -734,11 +1363,11 @@ tms contains day, hour, min of the report, current year and month
             
     def ostype(self,s):
         
-        self._metar['ostype'] = {'str': s, 'index': self.index()}
+        self._metar['ostype'] = {'str': s, 'span': self.span()}
 
     def pkwnd(self,s):
         
-        d = self._metar['pkwnd'] = {'str': s, 'index': self.index()}
+        d = self._metar['pkwnd'] = {'str': s, 'span': self.span()}
         wind,hhmm = s.split(' ')[-1].split('/')
         
         d['dd'] = int(wind[:3])
@@ -756,7 +1385,7 @@ tms contains day, hour, min of the report, current year and month
             
     def wshft(self,s):
         
-        d = self._metar['wshft'] = {'str': s, 'index': self.index()}
+        d = self._metar['wshft'] = {'str': s, 'span': self.span()}
         tokens = s.split()
         hhmm = tokens[1]
         tms = list(time.gmtime(self._metar['itime']['value']))
@@ -782,107 +1411,48 @@ tms contains day, hour, min of the report, current year and month
             
     def twrvsby(self,s):
         
-        v = self.lexer.tokens[self.lexer.cur_token.name][0].search(s)
-        vis = 0.0
-        
-        try:
-            vis += float(v.group('whole').strip())
-        except (AttributeError, ValueError):
-            pass
-            
-        try:
-            num, den = v.group('fraction').split('/', 1)
-            if num[0] == 'M':
-                if num != 'M1':
-                    vis += float(num[1:])/float(den)
-                oper = 'M'
-            else:
-                vis += float(num)/float(den)
-                
-        except (AttributeError, ValueError):
-            pass
+        v = self.tokenMatch(s)
+        vis, oper = _complexValue(v, 'whole', 'fraction')
 
         d = self._metar['twrvsby'] = {'str': s,
-                                      'index': self.index(),
+                                      'span': self.span(),
                                       'value': vis,
                                       'uom': self._metar['vsby']['uom']}
-        try:
+        if oper:
             d['oper'] = oper
-            
-        except NameError:
-            pass
         
     def sctrvis(self,s):
 
-        v = self.lexer.tokens[self.lexer.cur_token.name][0].search(s)            
-        vis = 0.0
-        
-        try:
-            vis += float(v.group('whole').strip())
-        except (AttributeError, ValueError):
-            pass
-            
-        try:
-            num, den = v.group('fraction').split('/', 1)
-            if num[0] == 'M':
-                if num != 'M1':
-                    vis += float(num[1:])/float(den)
-                oper = 'M'
-            else:
-                vis += float(num)/float(den)
-                
-        except (AttributeError, ValueError):
-            pass
+        v = self.tokenMatch(s)
+        vis, oper = _complexValue(v, 'whole', 'fraction')
 
         compassPt = s.split()[1]
         self._metar['sectorvis'] = {'str': s,
-                                    'index': self.index(),
+                                    'span': self.span(),
                                     'value': vis,
                                     'direction': _CompassDegrees[compassPt],
                                     'uom': self._metar['vsby']['uom']}
-        try:
+        if oper:
             self._metar['sectorvis']['oper'] = oper
 
-        except NameError:
-            pass
-            
-
     def vis2loc(self,s):
 
-        v = self.lexer.tokens[self.lexer.cur_token.name][0].search(s)            
-        vis = 0.0
-        try:
-            vis += float(v.group('whole').strip())
-        except (AttributeError, ValueError):
-            pass
-            
-        try:
-            num, den = v.group('fraction').split('/', 1)
-            if num[0] == 'M':
-                if num != 'M1':
-                    vis += float(num[1:])/float(den)
-                oper = 'M'
-            else:
-                vis += float(num)/float(den)
-                
-        except (AttributeError, ValueError):
-            pass
+        v = self.tokenMatch(s)
+        vis, oper = _complexValue(v, 'whole', 'fraction')
         
         self._metar['vis2ndlocation'] = {'str': s,
-                                         'index': self.index(),
+                                         'span': self.span(),
                                          'value': vis,
                                          'location': v.group('loc'),
                                          'uom': self._metar['vsby']['uom'],
                                          }
-        try:
+        if oper:
             self._metar['vis2ndlocation']['oper'] = oper
-        except NameError:
-            pass
         
     def ltg(self,s):
         
-        d = self._metar['lightning'] = {'str': s, 'index': self.index()}        
-        lxr = self.lexer.tokens[self.lexer.cur_token.name][0].search(s)
+        d = self._metar['lightning'] = {'str': s, 'span': self.span()}        
+        lxr = self.tokenMatch(s)
         locations = {}
         #
         # Lightning flash frequency is optional
@@ -892,8 +1462,8 @@ tms contains day, hour, min of the report, current year and month
         #
         # Sorted lightning characteristics, if any
         bpos = s.find('LTG')+3
-        epos = lxr.end(3)
-        if epos > 0:
+        epos = lxr.end(3) - lxr.start()
+        if lxr.end(3) > 0:
             ltgtypes = s[bpos:epos]
             sortedTypes = [ltgtypes[n:n+2] for n in range(0,len(ltgtypes),2)]
             sortedTypes.sort()
@@ -908,7 +1478,7 @@ tms contains day, hour, min of the report, current year and month
         
     def tstmvmt(self,s):
 
-        d = self._metar['tstmvmt'] = {'str': s, 'index': self.index()}        
+        d = self._metar['tstmvmt'] = {'str': s, 'span': self.span()}        
         
         mspos = s.find('MOV')
         locations = {}
@@ -928,68 +1498,53 @@ tms contains day, hour, min of the report, current year and month
         try:
             d = self._metar['pcpnhist']
             d['str'] = '%s%s' % (d['str'],s)
-            d['index'] = (d['index'][0],self.index()[1])
+            d['span'] = (d['span'][0],self.span()[1])
             
         except KeyError:
-            self._metar['pcpnhist'] = {'str': s, 'index': self.index()}
+            self._metar['pcpnhist'] = {'str': s, 'span': self.span()}
 
     def hail(self,s):
         
-        v = self.lexer.tokens[self.lexer.cur_token.name][0].search(s)            
-        siz = 0.0
-        try:
-            siz += float(v.group('whole').strip())
-        except (AttributeError, ValueError):
-            pass
-            
-        try:
-            num, den = v.group('fraction').split('/', 1)
-            if num[0] == 'M':
-                siz += float(num[1:])/float(den)
-            else:
-                siz += float(num)/float(den)
-                
-        except (AttributeError, ValueError):
-            pass
-                            
-        self._metar['hail'] = {'str': s, 'value':siz, 'index': self.index(), 'uom':'[in_i]'}
+        v = self.tokenMatch(s)            
+        siz = _complexValue(v, 'whole', 'fraction', lessThan=False)[0]
+        self._metar['hail'] = {'str': s, 'value':siz, 'span': self.span(), 'uom':'[in_i]'}
 
     def obsc(self,s):
 
         pcp,sky = s.split()        
         self._metar['obsc'] = {'str': s,
-                               'index': self.index(),
+                               'span': self.span(),
                                'pcp': pcp,
                                'sky': sky}
 
     def pressureChgRapidly(self,s):
         
-        self._metar['pchgr'] = {'str': s, 'index': self.index(),
+        self._metar['pchgr'] = {'str': s, 'span': self.span(),
                                 'value': {'R':'RISING','F':'FALLING'}.get(s[-2])}
         
     def cig2loc(self,s):
         
-        c = self.lexer.tokens[self.lexer.cur_token.name][0].search(s)            
+        c = self.tokenMatch(s)            
         value = int(s.split()[1])*100
-        self._metar['cig2ndlocation'] = {'str': s, 'index': self.index(),
+        self._metar['cig2ndlocation'] = {'str': s, 'span': self.span(),
                                          'value': value, 'uom': '[ft_i]',
                                          'location':c.group('loc')}
 
     def nospeci(self,s):
         
-        self._metar['nospeci'] = {'str': s, 'index': self.index()}
+        self._metar['nospeci'] = {'str': s, 'span': self.span()}
         
     def aurbo(self,s):
         
-        self._metar['aurbo'] = {'str': s, 'index': self.index()}
+        self._metar['aurbo'] = {'str': s, 'span': self.span()}
         
     def contrails(self,s):
         
-        self._metar['contrails'] = {'str': s, 'index': self.index()}
+        self._metar['contrails'] = {'str': s, 'span': self.span()}
         
     def snoincr(self,s):
         
-        d = self._metar['snoincr'] = {'str': s, 'index': self.index(), 'period': '1', 'uom':'[in_i]'}
+        d = self._metar['snoincr'] = {'str': s, 'span': self.span(), 'period': '1', 'uom':'[in_i]'}
         try:
             d['value'],d['depth'] = map(int,s.split(' ')[1].split('/'))
             
@@ -998,16 +1553,16 @@ tms contains day, hour, min of the report, current year and month
         
     def other(self,s):
         
-        self._metar['event'] = {'str': s, 'index': self.index()}
+        self._metar['event'] = {'str': s, 'span': self.span()}
         
     def pcp6h(self,s):
         
         try:
-            d = self._metar['pcpamt'] = {'str': s, 'index': self.index(), 'uom':'[in_i]',
+            d = self._metar['pcpamt'] = {'str': s, 'span': self.span(), 'uom':'[in_i]',
                                          'value': float(s[1:])/100.0}
         except ValueError:
             
-            self._metar['pcpamt'] = {'str': s, 'index': self.index()}
+            self._metar['pcpamt'] = {'str': s, 'span': self.span()}
             return
         
         if self._metar['type']['str'] == 'METAR':
@@ -1020,88 +1575,88 @@ tms contains day, hour, min of the report, current year and month
     def pcp24h(self,s):
         
         try:
-            self._metar['pcpamt24h'] = {'str': s, 'index': self.index(), 'uom':'[in_i]',
+            self._metar['pcpamt24h'] = {'str': s, 'span': self.span(), 'uom':'[in_i]',
                                         'value': float(s[1:])/100.0,
                                         'period':'24'}
         except ValueError:
-            self._metar['pcpamt24h'] = {'str': s, 'index': self.index()}
+            self._metar['pcpamt24h'] = {'str': s, 'span': self.span()}
             
 
     def iceacc(self,s):
         
         try:
-            self._metar['iceacc%c' % s[1]] = {'str': s, 'index': self.index(), 'uom':'[in_i]',
+            self._metar['iceacc%c' % s[1]] = {'str': s, 'span': self.span(), 'uom':'[in_i]',
                                               'value': float(s[2:])/100.0,
                                               'period':'%d' % int(s[1])}
         except ValueError:
-            self._metar['iceacc%c' % s[1]] = {'str': s, 'index': self.index()}
+            self._metar['iceacc%c' % s[1]] = {'str': s, 'span': self.span()}
             
         
     def snodpth(self,s):
         
         try:
-            self._metar['snodpth'] = {'str': s, 'index': self.index(), 'uom':'[in_i]',
+            self._metar['snodpth'] = {'str': s, 'span': self.span(), 'uom':'[in_i]',
                                       'period':'1',
                                       'value':float(s[3:])}
         except ValueError:
-            self._metar['snodpth'] = {'str': s, 'index': self.index()}
+            self._metar['snodpth'] = {'str': s, 'span': self.span()}
 
     def lwe(self,s):
         
         try:
-            self._metar['lwe'] = {'str': s, 'index': self.index(), 'uom':'[in_i]',
+            self._metar['lwe'] = {'str': s, 'span': self.span(), 'uom':'[in_i]',
                                   'value':float(s[4:])/10.0}
         except ValueError:
-            self._metar['lwe'] = {'str': s, 'index': self.index()}
+            self._metar['lwe'] = {'str': s, 'span': self.span()}
             
 
     def sunshine(self,s):
 
         try:
-            self._metar['ssmins'] = {'str': s, 'index': self.index(),
+            self._metar['ssmins'] = {'str': s, 'span': self.span(),
                                      'value':int(s[3:])}
         except ValueError:
-            self._metar['ssmins'] = {'str': s, 'index': self.index()}
+            self._metar['ssmins'] = {'str': s, 'span': self.span()}
 
     def maxt6h(self,s):
         
         try:
-            self._metar['maxT6h'] = {'str': s, 'index': self.index(),
+            self._metar['maxT6h'] = {'str': s, 'span': self.span(),
                                      'value':float(s[3:])/10.0,
                                      'period':'6'}
             if s[2] == '1':
                 self._metar['maxT6h']['value'] = -(self._metar['maxT6h']['value'])
                 
         except ValueError:
-            self._metar['maxT6h'] = {'str': s, 'index': self.index()}
+            self._metar['maxT6h'] = {'str': s, 'span': self.span()}
 
     def mint6h(self,s):
         
         try:
-            self._metar['minT6h'] = {'str': s, 'index': self.index(),
+            self._metar['minT6h'] = {'str': s, 'span': self.span(),
                                      'value':float(s[3:])/10.0,
                                      'period':'6'}
             if s[2] == '1':
                 self._metar['minT6h']['value'] = -(self._metar['minT6h']['value'])
 
         except ValueError:
-            self._metar['minT6h'] = {'str': s, 'index': self.index()}
+            self._metar['minT6h'] = {'str': s, 'span': self.span()}
 
     def xtrmet(self,s):
         
         try:
-            self._metar['maxT24h'] = {'str': s, 'index': self.index(),
+            self._metar['maxT24h'] = {'str': s, 'span': self.span(),
                                       'value':float(s[3:6])/10.0,
                                       'period':'24'}
         except ValueError:
-            self._metar['maxT24h'] = {'str': s, 'index': self.index()}
+            self._metar['maxT24h'] = {'str': s, 'span': self.span()}
 
         try:
-            self._metar['minT24h'] = {'str': s, 'index': self.index(),
+            self._metar['minT24h'] = {'str': s, 'span': self.span(),
                                       'value':float(s[7:10])/10.0,
                                       'period':'24'}
         except ValueError:
-            self._metar['minT24h'] = {'str': s, 'index': self.index()}
+            self._metar['minT24h'] = {'str': s, 'span': self.span()}
         
         try:
             if s[2] == '1':
@@ -1120,115 +1675,138 @@ tms contains day, hour, min of the report, current year and month
     def prestendency(self,s):
         
         try:
-            self._metar['ptndcy'] = {'str': s, 'index': self.index(),
+            self._metar['ptndcy'] = {'str': s, 'span': self.span(),
                                      'character':s[1],
                                      'pchg':float(s[2:])/10.0}
         except ValueError:
-            self._metar['ptndcy'] = {'str': s, 'index': self.index()}
+            self._metar['ptndcy'] = {'str': s, 'span': self.span()}
 
     def estwind(self,s):
 
-        self._metar['estwind'] = {'index': self.index()}
+        self._metar['estwind'] = {'span': self.span()}
         
     def ssindc(self,s):
 
         try:
             d = self._metar['ssistatus']
             d['str'] = '%s %s' % (d['str'], s)
-            d['index'] = (d['index'][0],self.index()[1])
+            d['span'] = (d['span'][0],self.span()[1])
             
         except KeyError:
-            self._metar['ssistatus'] = {'str': s.strip(), 'index': self.index()}
+            self._metar['ssistatus'] = {'str': s.strip(), 'span': self.span()}
 
     def maintenance(self,s):
         
-        self._metar['maintenance'] = {'index': self.index()}
-        
-    def whiteOut(self,key):
-        #
-        # Starting, ending line and character positions
-        index = self._metar[key]['index']
-        slpos,scpos = map(int,index[0].split('.'))
-        elpos,ecpos = map(int,index[1].split('.'))
-
-        if slpos == elpos:
-            self.unparsedText[slpos][scpos:ecpos] = ' ' * (ecpos-scpos)
-        else:
-            self.unparsedText[slpos][scpos:] = ' ' * len(self.unparsedText[slpos][scpos:])
-            self.unparsedText[elpos][:ecpos+1] = ' ' * (ecpos+1)
-
-        #print 'removed',key
-        #print '\n'.join([''.join(x) for x in self.unparsedText])
+        self._metar['maintenance'] = {'span': self.span()}
         
     def unparsed(self):
-
-        self.unparsedText = [list(x) for x in self.lexer.input.split('\n')]
-        self.unparsedText.insert(0,[])
         #
-        # Remove all tokens from input string that were successfully parsed.
-        map(self.whiteOut,self._metar.keys())
-        self.unparsedText.pop(0)
+        # Blank out all tokens that were successfully parsed. A token
+        # spanning lines is blanked to the end of its first line and from
+        # the start of its last one, up to one past its end.
+        fields = self._fields
+        if fields is not None and 'unparsed' not in fields and 'additive' not in fields:
+            return self._metar
+        text = self._input
+        starts = self.lineStarts()
+        mask = bytearray(text)
+        longer = set()
+        for d in self._metar.itervalues():
+            start, end = d['span']
+            sl = bisect.bisect_right(starts, start) - 1
+            el = bisect.bisect_right(starts, end) - 1
+            if sl == el:
+                mask[start:end] = ' ' * (end-start)
+                continue
+            lineEnd = _lineEnd(text, starts, sl)
+            mask[start:lineEnd] = ' ' * (lineEnd-start)
+            lineEnd = _lineEnd(text, starts, el)
+            if end + 1 > lineEnd:
+                longer.add(el)
+                end = lineEnd - 1
+            mask[starts[el]:end+1] = ' ' * (end+1-starts[el])
+
+        lines = str(mask).split('\n')
+        for n in longer:
+            lines[n] += ' '
         #
         # Before the RMK token, if there is one, should be considered an error
-        # After the RMK token, it is considered text added by the observer
-        #
-        rmk_pos = -1
+        # After the RMK token, it is considered text added by the observer.
+        # Only the first R of a line is looked at, and nothing past the
+        # line holding RMK is kept.
         additiveText = []
         unrecognized = []
-        
-        for lne in self.unparsedText:
-            try:
-                pos = lne.index('R')
-                if pos > -1 and lne[pos:pos+3] == ['R','M','K']:
-                    rmk_pos = pos
-                    unrecognized.append(''.join(lne[:pos]))
-                    additiveText.append(''.join(lne[pos+3:]))
-                    break
-                
-            except ValueError:
-                pass
-            #
-            # RMK not found yet
-            if rmk_pos == -1:
-                unrecognized.append(''.join(lne))
-            else:
-                additiveText.append(''.join(lne))                        
+        for lne in lines:
+            pos = lne.find('R')
+            if pos > -1 and lne.startswith('RMK', pos):
+                unrecognized.append(lne[:pos])
+                additiveText.append(lne[pos+3:])
+                break
+            unrecognized.append(lne)
         #
         # Reassemble and remove superfluous whitespaces
-        try:
-            text = ' '.join(additiveText).strip()
-            if len(text):
-                self._metar['additive'] = {'str':text}
-                
-        except IndexError:
-            pass
-            
-        try:
-            text = ' '.join(unrecognized).strip()
-            if len(text):
-                self._metar['unparsed'] = {'str':text}
-                
-        except IndexError:
-            pass
+        text = ' '.join(additiveText).strip()
+        if len(text):
+            self._metar['additive'] = {'str':text}
+
+        text = ' '.join(unrecognized).strip()
+        if len(text):
+            self._metar['unparsed'] = {'str':text}
         
         return self._metar
     
+def fault_summary(errors):
+    """
+       Returns [(count, exception class name, token name), ...] of the
+       faults in errors, a Decoder's errors or the sum of several, most
+       frequent first
+    """
+    return sorted([(count, name, token) for (name, token), count in errors.iteritems()],
+                  key=lambda fault: (-fault[0], fault[1:]))
+
+def _add_grammar_methods(cls):
+    for name, method in grammar_methods().items():
+        setattr(cls, name, method)
+
+_add_grammar_methods(Decoder)
+
+class VerboseDecoder(Decoder, tpg.VerboseParser):
+    #
+    # Same results as Decoder, tracing every token the parser tries to eat.
+    # Much slower, for debugging the grammar only. No docstring, so the
+    # grammar compiled for Decoder is inherited as is.
+    verbose = 3
+    fastpath = False
+
 ##############################################################################
 # public part
 ##############################################################################
 # test
-def main(reports):
+def read_reports(filename):
+    """Returns the observations in filename, each terminated with the EOT '=' character"""
+    #
+    # The decoder is depending on the presence of the EOT '=' character, so we need to
+    # append to the observations read in.
+    #
+    allobs = ['%s=' % x for x in open(filename).read().split('=')]
+    #
+    # Last item in the list is empty, so remove it.
+    allobs.pop()
+    return allobs
+
+def main(reports,decoder=None):
     import pprint
     pp = pprint.PrettyPrinter(indent=2)
     #
-    # Create a US METAR decoder
-    decoder = Decoder()
+    # Create a US METAR decoder, unless the caller is reusing one
+    if decoder is None:
+        decoder = Decoder()
     #
     # Pass observations to it.
-    for report in reports:
-        logging.debug('BEGIN decoding %s '%report)
-        d = decoder(report)
+    for report, d, fault in decoder.decode_many([(r, r) for r in reports]):
         print report
+        if fault is not None:
+            print 'Decoder fault: %s' % str(fault)
         pp.pprint(d)
 
     
@@ -1239,15 +1817,12 @@ if __name__ == '__main__':
     #
     # To that end, provided a sample set of METAR/SPECI records under /data directory
     #
+    # With -t before the file name, the parser traces its progress.
+    #
     import logging, sys
 
     #logging.basicConfig(filename='example.log',level=logging.DEBUG)
-    #
-    # The decoder is depending on the presence of the EOT '=' character, so we need to
-    # append to the observations read in.
-    #
-    allobs = ['%s=' % x for x in open(sys.argv[1]).read().split('=')]
-    #
-    # Last item in the list is empty, so remove it.
-    allobs.pop()
-    main(allobs)
+    if sys.argv[1] == '-t':
+        main(read_reports(sys.argv[2]),VerboseDecoder())
+    else:
+        main(read_reports(sys.argv[1]))